@@ -0,0 +1,149 @@
+# Copyright 2018 Mobvoi Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+
+
+#!/usr/bin/python2
+
+# benchmark-compressed-matrix.py times the decompression of random CM / CM2 /
+# CM3 matrices by CompressedMatrix.GetNumpyMatrix() against the element by
+# element GetNumpyMatrixElementwise(), and checks both are bit-exact with
+# kaldi_decompress(), a literal transcription of Kaldi's compressed-matrix.cc
+# in plain python that does not share any code or numpy arithmetic with them.
+
+import argparse
+import numpy
+import struct
+import sys
+import time
+from pyKaldiIO.kaldi_matrix import CompressedMatrix
+from pyKaldiIO.kaldi_matrix import GlobalHeader
+
+
+def random_compressed_matrix(fmt, rows, cols):
+    cmat = CompressedMatrix()
+    cmat.global_header = GlobalHeader()
+    cmat.global_header.format = fmt
+    cmat.global_header.min_value = float(numpy.float32(-10.0 * numpy.random.rand()))
+    cmat.global_header.range = float(numpy.float32(20.0 * numpy.random.rand()))
+    cmat.global_header.num_rows = rows
+    cmat.global_header.num_cols = cols
+    if fmt == 1:
+        cmat.percol_header = numpy.sort(
+            numpy.random.randint(0, 65536, [cols, 4]), axis=1).astype(numpy.uint16)
+        cmat.data = numpy.random.randint(0, 256, [rows, cols]).astype(numpy.uint8)
+    elif fmt == 2:
+        cmat.data = numpy.random.randint(0, 65536, [rows, cols]).astype(numpy.uint16)
+    else:
+        cmat.data = numpy.random.randint(0, 256, [rows, cols]).astype(numpy.uint8)
+    return cmat
+
+
+def f32(x):
+    # Round a python float (a C double) to a C float.
+    return struct.unpack('<f', struct.pack('<f', x))[0]
+
+
+def kaldi_uint16_to_float(min_value, range_value, value):
+    # min_value + range * 1.52590218966964e-05F * value, all in float.
+    return f32(min_value + f32(f32(range_value * f32(1.52590218966964e-05)) * value))
+
+
+def kaldi_char_to_float(p0, p25, p75, p100, value):
+    # (p25 - p0) * value is float, the (1/64.0) constants are double, so the
+    # last multiply and the add are in double, rounded to float on return.
+    if value <= 64:
+        return f32(p0 + f32(f32(p25 - p0) * value) * (1/64.0))
+    elif value <= 192:
+        return f32(p25 + f32(f32(p75 - p25) * (value - 64)) * (1/128.0))
+    else:
+        return f32(p75 + f32(f32(p100 - p75) * (value - 192)) * (1/63.0))
+
+
+def kaldi_decompress(cmat):
+    ''' kaldi_decompress() is CompressedMatrix::CopyToMat() of Kaldi. Python
+        floats are C doubles, and every float operation of Kaldi is a double
+        operation on floats rounded by f32(), which is exact for + and *.
+    '''
+    header = cmat.global_header
+    min_value = f32(header.min_value)
+    range_value = f32(header.range)
+    rows = [ [ 0.0 ] * header.num_cols for r in xrange(header.num_rows) ]
+    if header.format == 1:
+        for c in xrange(header.num_cols):
+            p0, p25, p75, p100 = [ kaldi_uint16_to_float(min_value, range_value, int(p))
+                                   for p in cmat.percol_header[c] ]
+            for r in xrange(header.num_rows):
+                rows[r][c] = kaldi_char_to_float(p0, p25, p75, p100,
+                                                 int(cmat.data[r, c]))
+    else:
+        # float increment = h->range * (1.0 / 65535.0), or (1.0 / 255.0).
+        increment = f32(range_value * (1.0 / (65535.0 if header.format == 2
+                                        else 255.0)))
+        for r in xrange(header.num_rows):
+            for c in xrange(header.num_cols):
+                rows[r][c] = f32(min_value + f32(int(cmat.data[r, c]) * increment))
+    return numpy.array(rows, dtype=numpy.float32)
+
+
+def bit_exact(mat, reference):
+    # Compare the bits, so that e.g. -0.0 and 0.0 differ.
+    return mat.dtype == numpy.float32 and \
+           numpy.array_equal(mat.view(numpy.uint32),
+                             reference.view(numpy.uint32))
+
+
+def main():
+    numpy.random.seed(args.seed)
+    for fmt, token in [ (1, 'CM'), (2, 'CM2'), (3, 'CM3') ]:
+        cmat = random_compressed_matrix(fmt, args.num_rows, args.num_cols)
+
+        reference = kaldi_decompress(cmat)
+
+        start = time.time()
+        elementwise = cmat.GetNumpyMatrixElementwise()
+        elementwise_time = time.time() - start
+
+        start = time.time()
+        for i in xrange(args.repeats):
+            mat = cmat.GetNumpyMatrix()
+        vectorized_time = (time.time() - start) / args.repeats
+
+        exact = bit_exact(mat, reference) and \
+                bit_exact(elementwise, reference)
+        print('%s %dx%d: elementwise %.4f s, vectorized %.6f s, '
+              'speedup %.0fx, bit-exact %s' %
+              (token, args.num_rows, args.num_cols, elementwise_time,
+               vectorized_time, elementwise_time / vectorized_time, exact))
+        if not exact:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    # switches
+    parser.add_argument('--num-rows', metavar = 'num-rows',
+                        type = int, help='rows of the random matrices, e.g. '
+                        'frames of an utterance.', default = 500)
+    parser.add_argument('--num-cols', metavar = 'num-cols',
+                        type = int, help='columns of the random matrices.',
+                        default = 40)
+    parser.add_argument('--repeats', metavar = 'repeats',
+                        type = int, help='number of vectorized runs to average.',
+                        default = 100)
+    parser.add_argument('--seed', metavar = 'seed',
+                        type = int, help='random seed.', default = 777)
+
+    args = parser.parse_args()
+
+    main()
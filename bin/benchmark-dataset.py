@@ -0,0 +1,109 @@
+# Copyright 2018 Mobvoi Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+
+
+#!/usr/bin/python2
+
+# benchmark-dataset.py compares the input throughput of dataset_from_kaldi()
+# with dataset_from_tfrecords(), on the same utterances converted by
+# convert-to-tfrecords.py. It reads the first --max-utterances sequences of
+# each dataset, shuffled as in training, for each of --num-parallel-calls, and
+# prints the utterances/s and frames/s.
+
+import argparse
+import nnet
+import sys
+import tensorflow as tf
+import time
+
+tf.logging.set_verbosity(tf.logging.INFO)
+
+
+def throughput(data, nnet_target, num_parallel_calls):
+    with tf.Graph().as_default():
+        _, dataset, _, _ = \
+            nnet.read_dataset(
+                data=data,
+                nnet_target=nnet_target,
+                left_context=args.left_context,
+                right_context=args.right_context,
+                subsample=args.subsample,
+                shuffle=True,
+                seed=123,
+                num_parallel_calls=num_parallel_calls,
+                num_parallel_reads=args.num_parallel_reads,
+            )
+        if args.max_utterances > 0:
+            dataset = dataset.take(args.max_utterances)
+        sequence = dataset.prefetch(num_parallel_calls) \
+                          .make_one_shot_iterator().get_next()
+
+        num_utterances = 0
+        num_frames = 0
+        with tf.Session() as sess:
+            start = time.time()
+            while True:
+                try:
+                    num_frames += sess.run(sequence['sequence_length'])
+                    num_utterances += 1
+                except tf.errors.OutOfRangeError:
+                    break
+            elapsed = time.time() - start
+    return num_utterances / elapsed, num_frames / elapsed
+
+
+def main(_):
+    for num_parallel_calls in [ int(n) for n in args.num_parallel_calls.split(',') ]:
+        for name, data, nnet_target in \
+            [ ('tfrecords', args.tfrecords_scp, None),
+              ('kaldi', args.feats_rspecifier, args.labels_rspecifier) ]:
+            utterances_per_second, frames_per_second = \
+                throughput(data, nnet_target, num_parallel_calls)
+            print('%s num_parallel_calls = %d: %.1f utterances/s, %.0f frames/s'
+                  % (name, num_parallel_calls,
+                     utterances_per_second, frames_per_second))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    # positional args.
+    parser.add_argument('tfrecords_scp', metavar = '<tfrecords.scp>',
+                        type = str, help = 'tfrecords.scp from convert-to-tfrecords.py.')
+    parser.add_argument('feats_rspecifier', metavar = '<feats-rspecifier>',
+                        type = str, help = 'the features converted, e.g. scp:feats.scp.')
+    parser.add_argument('labels_rspecifier', metavar = '<labels-rspecifier>',
+                        type = str, help = 'the labels converted, e.g. ark:labels.ark.')
+
+    # optional args.
+    parser.add_argument('--num-parallel-calls', metavar = 'num-parallel-calls',
+                        type = str, help = 'comma-separated values of num_parallel_calls to compare.',
+                        default = '1,8,32')
+    parser.add_argument('--num-parallel-reads', metavar = 'num-parallel-reads',
+                        type = int, help = 'number of tfrecords files read in parallel.', default = 8)
+    parser.add_argument('--max-utterances', metavar = 'max-utterances',
+                        type = int, help = 'utterances read per run, 0 for all.', default = 2000)
+    parser.add_argument('--left-context', metavar = 'left-context',
+                        type = int, help = 'left context spliced, as in the nnet config.', default = 0)
+    parser.add_argument('--right-context', metavar = 'right-context',
+                        type = int, help = 'right context spliced, as in the nnet config.', default = 0)
+    parser.add_argument('--subsample', metavar = 'subsample',
+                        type = int, help = 'subsampling factor, as in the nnet config.', default = 0)
+
+    args = parser.parse_args()
+
+    log = ' '.join(sys.argv)
+    tf.logging.info(log)
+
+    tf.app.run(main=main, argv=[sys.argv[0]])
@@ -14,8 +14,13 @@
 
 #!/usr/bin/python2
 
+import Queue
 import argparse
+import hashlib
+import multiprocessing
 import nnet
+import numpy as np
+import os
 import pyKaldiIO
 import sys
 import tensorflow as tf
@@ -23,35 +28,296 @@ import tensorflow as tf
 tf.logging.set_verbosity(tf.logging.INFO)
 
 
+def shard_prefix():
+    # The shards are named after the --manifest, or else the tfrecords.scp,
+    # so that the files of this conversion can be told apart from others in
+    # tfrecords_dir, e.g. of the training and validation sets.
+    name = args.manifest if args.manifest else args.tfrecords_scp
+    return os.path.splitext(os.path.basename(name))[0] + '-shard'
+
+
+def create_shard_writer(prefix=None):
+    if args.shard_size <= 0 and args.shard_utterances <= 0:
+        return None
+    if prefix is None:
+        prefix = shard_prefix()
+    return nnet.TFRecordShardWriter(
+               tfrecords_dir=args.tfrecords_dir,
+               prefix=prefix,
+               shard_size=int(args.shard_size * 1024 * 1024),
+               shard_utterances=args.shard_utterances,
+               # Records reused from the last run stay in its shards.
+               skip_existing=bool(args.manifest),
+           )
+
+
+def write_record(key, nnet_input, nnet_target, shard_writer):
+    if shard_writer is not None:
+        shard, offset, length = shard_writer.write(
+            nnet.serialize_tfrecord(
+                nnet_input=nnet_input,
+                nnet_target=nnet_target,
+                record_format=args.record_format,
+            )
+        )
+        location = '%s %d %d' % (shard, offset, length)
+    else:
+        filename = args.tfrecords_dir + '/' + key + '.tfrecords'
+        nnet.write_tfrecord(
+            filename=filename,
+            nnet_input=nnet_input,
+            nnet_target=nnet_target,
+            record_format=args.record_format,
+        )
+        location = filename
+    if args.record_format != nnet.RECORD_FORMAT_SEQUENCE:
+        location += ' format=%d' % args.record_format
+    if args.left_context or args.right_context:
+        location += ' context=%d,%d' % (args.left_context, args.right_context)
+    if args.subsample:
+        location += ' subsample=%d' % args.subsample
+    return location
+
+
+def conversion_settings():
+    # Records written with other settings can not be reused.
+    sharded = args.shard_size > 0 or args.shard_utterances > 0
+    return 'format=%d context=%d,%d subsample=%d sharded=%d' % \
+           (args.record_format, args.left_context, args.right_context,
+            args.subsample, int(sharded))
+
+
+def utterance_digest(nnet_input, nnet_target):
+    ''' utterance_digest() returns '<feature-hash> <label-hash>' of the
+        utterance as read, before splicing, for the --manifest. The feature
+        hash also covers the conversion settings.
+    '''
+    feature_hash = hashlib.sha1(conversion_settings())
+    feature_hash.update('%d %d ' % nnet_input.shape)
+    feature_hash.update(np.ascontiguousarray(nnet_input, dtype='<f4').tobytes())
+    label_hash = '-'
+    if nnet_target is not None:
+        label_hash = hashlib.sha1(
+                         np.ascontiguousarray(nnet_target, dtype='<i4').tobytes()
+                     ).hexdigest()
+    return '%s %s' % (feature_hash.hexdigest(), label_hash)
+
+
+def record_file(location):
+    # The tfrecords file (or shard) of a location in tfrecords.scp.
+    return location.split()[0]
+
+
+def read_manifest(manifest):
+    ''' read_manifest() parses the --manifest of the last run, where each
+        line is
+
+            <feature-hash> <label-hash> <line of tfrecords.scp>
+
+        into { key : (digest, head, location) }.
+    '''
+    entries = dict()
+    if not os.path.exists(manifest):
+        return entries
+    for line in open(manifest, 'r'):
+        token = line.rstrip().split()
+        if not token:
+            continue
+        if len(token) < 7:
+            log = 'invalid line in %s: \"%s\"' % (manifest, line.rstrip())
+            tf.logging.fatal(log)
+            sys.exit(1)
+        digest = ' '.join(token[0:2])
+        head = ' '.join(token[2:6])
+        location = ' '.join(token[6:])
+        entries[token[2]] = (digest, head, location)
+    return entries
+
+
+def compact_shards(lines):
+    ''' compact_shards() rewrites the live records of the shards whose
+        live records take less than --compact-threshold of their size into
+        new shards, and returns lines, [ (digest, head, location) ] of the
+        manifest, with the locations updated, and the number of shards
+        compacted. The old shards are left to be removed as stale.
+    '''
+    live_bytes = dict()
+    for _, _, location in lines:
+        token = location.split()
+        live_bytes[token[0]] = live_bytes.get(token[0], 0) + int(token[2]) + 16
+    shards = set( shard for shard, size in live_bytes.iteritems()
+                  if size < args.compact_threshold * os.path.getsize(shard) )
+    if not shards:
+        return lines, 0
+
+    shard_writer = create_shard_writer(shard_prefix() + '-c')
+    files = dict()
+    compacted = []
+    for digest, head, location in lines:
+        token = location.split()
+        if token[0] in shards:
+            if token[0] not in files:
+                files[token[0]] = open(token[0], 'rb')
+            # Skip the uint64 length and the uint32 crc of the length, the
+            # record is framed again by the writer.
+            files[token[0]].seek(int(token[1]) + 12)
+            record = files[token[0]].read(int(token[2]))
+            if len(record) != int(token[2]):
+                log = 'truncated record at %s in %s' % (token[1], token[0])
+                tf.logging.fatal(log)
+                sys.exit(1)
+            shard, offset, length = shard_writer.write(record)
+            location = ' '.join([ shard, str(offset), str(length) ] + token[3:])
+        compacted.append((digest, head, location))
+    for f in files.itervalues():
+        f.close()
+    shard_writer.close()
+    return compacted, len(shards)
+
+
+def remove_unreferenced_shards(live_files):
+    ''' remove_unreferenced_shards() removes the shards of this conversion,
+        named by shard_prefix(), that nothing refers to, e.g. those written
+        by a run that did not finish.
+    '''
+    prefix = shard_prefix() + '-'
+    live_files = set( os.path.abspath(f) for f in live_files )
+    removed = 0
+    for name in os.listdir(args.tfrecords_dir):
+        filename = os.path.join(args.tfrecords_dir, name)
+        if name.startswith(prefix) and name.endswith('.tfrecords') and \
+           os.path.abspath(filename) not in live_files:
+            os.remove(filename)
+            removed += 1
+    return removed
+
+
+def read_utterances(nnet_input_reader, nnet_target_reader):
+    ''' read_utterances() yields (key, nnet_input, nnet_target) for every
+        utterance of nnet_input_reader, nnet_target is None if there are no
+        targets for it. With --sorted-join the two sorted archives are merged
+        in one pass, so only the current utterance is held in memory.
+    '''
+    if args.sorted_join and nnet_target_reader is not None:
+        for utterance in pyKaldiIO.MergeJoin(nnet_input_reader,
+                                             nnet_target_reader):
+            yield utterance
+        return
+    while not nnet_input_reader.Done():
+        key = nnet_input_reader.Key()
+        nnet_target = None
+        if nnet_target_reader is not None and \
+           nnet_target_reader.HasKey(key):
+            nnet_target = nnet_target_reader.Value(key)
+        yield key, nnet_input_reader.Value(), nnet_target
+        nnet_input_reader.Next()
+
+
+def worker(worker_id, task_queue, result_queue):
+    # Each worker owns its shards, so no two processes append to one file.
+    shard_writer = create_shard_writer('%s-w%02d' % (shard_prefix(), worker_id))
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        index, key, nnet_input, nnet_target = task
+        location = write_record(key, nnet_input, nnet_target, shard_writer)
+        result_queue.put((index, location))
+    if shard_writer is not None:
+        shard_writer.close()
+    result_queue.put(None)
+
+
 def main(_):
+    # Workers are forked before the readers open their pipes.
+    workers = []
+    result_queue = multiprocessing.Queue()
+    for i in xrange(args.num_workers):
+        task_queue = multiprocessing.Queue(maxsize=args.queue_size)
+        process = multiprocessing.Process(
+                      target=worker, args=(i, task_queue, result_queue)
+                  )
+        process.daemon = True
+        process.start()
+        workers.append((process, task_queue))
+
     nnet_input_reader = \
         pyKaldiIO.SequentialBaseFloatMatrixReader(args.nnet_input)
 
-    nnet_target_reader = \
-        pyKaldiIO.RandomAccessInt32VectorReader(args.nnet_target) \
-        if args.nnet_target is not None else None
+    if args.nnet_target is None:
+        nnet_target_reader = None
+    elif args.sorted_join:
+        nnet_target_reader = \
+            pyKaldiIO.SequentialInt32VectorReader(args.nnet_target)
+    else:
+        nnet_target_reader = \
+            pyKaldiIO.RandomAccessInt32VectorReader(args.nnet_target)
+
+    shard_writer = create_shard_writer() if not workers else None
+
+    # With --manifest, utterances whose features, labels and conversion
+    # settings are unchanged since the last run keep their records.
+    manifest = None
+    manifest_lines = []
+    if args.manifest:
+        manifest = read_manifest(args.manifest)
+    sharded = args.shard_size > 0 or args.shard_utterances > 0
+    shard_files = set()
 
     with open(args.tfrecords_scp, 'w') as scp:
-        processed = 0
+        # scp lines are written in input order; results coming back from
+        # the workers are held in pending until all earlier ones are done.
+        pending = dict()
+        state = { 'written': 0, 'processed': 0, 'reused': 0 }
+
+        def _flush():
+            while state['written'] in pending and \
+                  pending[state['written']][1] is not None:
+                head, location, digest = pending.pop(state['written'])
+                scp.write('%s %s\n' % (head, location))
+                if manifest is not None:
+                    manifest_lines.append((digest, head, location))
+                elif sharded:
+                    shard_files.add(record_file(location))
+                state['written'] += 1
+
+                state['processed'] += 1
+                if args.report_interval and \
+                   state['processed'] % args.report_interval == 0:
+                    log = 'processed = %d' % (state['processed'])
+                    tf.logging.info(log)
 
-        while not nnet_input_reader.Done():
-            key = nnet_input_reader.Key()
+        def _collect(block):
+            while True:
+                try:
+                    result = result_queue.get(block=block, timeout=1.0)
+                except Queue.Empty:
+                    # Stop waiting if every worker died without saying so.
+                    return not block or \
+                           any(process.is_alive() for process, _ in workers)
+                if result is None:
+                    return False
+                index, location = result
+                head, _, digest = pending[index]
+                pending[index] = (head, location, digest)
+                _flush()
+                if block:
+                    return True
+
+        index = 0
+        for key, nnet_input, nnet_target in \
+            read_utterances(nnet_input_reader, nnet_target_reader):
             skip = False
 
-            if nnet_target_reader is not None and \
-               not nnet_target_reader.HasKey(key):
+            if nnet_target_reader is not None and nnet_target is None:
                 log = 'missing nnet targets for \"%s\" in %s' % \
                       (key, args.nnet_target)
                 tf.logging.info(log)
                 skip = True
 
             if skip:
-                nnet_input_reader.Next()
                 continue
 
-            nnet_target = nnet_target_reader.Value(key) \
-                          if nnet_target_reader is not None else None
-
             if nnet_target is not None and \
                nnet_target.shape[0] == 0:
                 log = 'length of nnet targets for \"%s\" is 0 in %s' % \
@@ -60,12 +326,8 @@ def main(_):
                 skip = True
             
             if skip:
-                nnet_input_reader.Next()
                 continue
 
-            filename = args.tfrecords_dir + '/' + key + '.tfrecords'
-
-            nnet_input = nnet_input_reader.Value()
             # Training with alignments, need to check if the lengths of
             # (feature, label) are consistent.
             if args.check_length and nnet_target is not None:
@@ -91,35 +353,115 @@ def main(_):
 
             
             if skip:
-                nnet_input_reader.Next()
                 continue
 
+            digest = None
+            if manifest is not None:
+                digest = utterance_digest(nnet_input, nnet_target)
+                if key in manifest and manifest[key][0] == digest and \
+                   os.path.exists(record_file(manifest[key][2])):
+                    _, head, location = manifest[key]
+                    pending[index] = (head, location, digest)
+                    state['reused'] += 1
+                    _flush()
+                    index += 1
+                    continue
+
             #tf.logging.info('key = %s nnet_target.shape = %s' % (key, str(nnet_target.shape)))
-            nnet.write_tfrecord(
-                filename=filename,
-                nnet_input=nnet_input,
-                nnet_target=nnet_target,
-            )
+            if args.left_context or args.right_context:
+                nnet_input = nnet.splice_features(nnet_input,
+                                                  args.left_context,
+                                                  args.right_context)
+            if args.subsample:
+                nnet_input = nnet.subsample_features(nnet_input,
+                                                     args.subsample)
 
             num_rows = nnet_input.shape[0]
             num_cols = nnet_input.shape[1]
             has_label = 1 if args.nnet_target else 0
-            scp.write('%s %d %d %d %s\n' %
-                      (key, num_rows, num_cols,
-                       has_label, filename))
-
-            processed += 1
-            if args.report_interval and \
-               processed % args.report_interval == 0:
-                log = 'processed = %d' % (processed)
-                tf.logging.info(log)
+            head = '%s %d %d %d' % (key, num_rows, num_cols, has_label)
+
+            if workers:
+                # Utterances are dealt round-robin so that the contents of
+                # each worker's shards do not depend on scheduling.
+                pending[index] = (head, None, digest)
+                _, task_queue = workers[index % len(workers)]
+                task_queue.put((index, key, nnet_input, nnet_target))
+                _collect(block=False)
+            else:
+                location = write_record(key, nnet_input, nnet_target,
+                                        shard_writer)
+                pending[index] = (head, location, digest)
+                _flush()
+            index += 1
 
-            nnet_input_reader.Next()
+        for _, task_queue in workers:
+            task_queue.put(None)
+        running = len(workers)
+        while running:
+            if not _collect(block=True):
+                running -= 1
+        for process, _ in workers:
+            process.join()
+            if process.exitcode != 0:
+                log = 'worker %d exited with %d' % \
+                      (process.pid, process.exitcode)
+                tf.logging.fatal(log)
+                sys.exit(1)
 
+        if pending:
+            log = 'missing %d converted utterances' % len(pending)
+            tf.logging.fatal(log)
+            sys.exit(1)
+
+    if shard_writer is not None:
+        shard_writer.close()
     nnet_input_reader.Close()
     if nnet_target_reader is not None:
         nnet_target_reader.Close()
 
+    if manifest is None and sharded:
+        # The shards were overwritten from index 0, those left over from an
+        # earlier, larger run are no longer referenced.
+        removed = remove_unreferenced_shards(shard_files)
+        if removed:
+            log = 'removed = %d stale shards' % removed
+            tf.logging.info(log)
+
+    if manifest is not None:
+        compacted = 0
+        if sharded and args.compact_threshold > 0:
+            manifest_lines, compacted = compact_shards(manifest_lines)
+            if compacted:
+                with open(args.tfrecords_scp, 'w') as scp:
+                    for _, head, location in manifest_lines:
+                        scp.write('%s %s\n' % (head, location))
+
+        with open(args.manifest + '.tmp', 'w') as f:
+            for digest, head, location in manifest_lines:
+                f.write('%s %s %s\n' % (digest, head, location))
+        os.rename(args.manifest + '.tmp', args.manifest)
+
+        # Files of the last run that are no longer referenced, including
+        # the shards just compacted, then any other shard of this conversion
+        # left unreferenced, e.g. by a run that crashed.
+        live_files = set( record_file(location)
+                          for _, _, location in manifest_lines )
+        stale_files = set( record_file(location)
+                           for _, _, location in manifest.values() )
+        stale_files -= live_files
+        removed = 0
+        for filename in sorted(stale_files):
+            if os.path.exists(filename):
+                os.remove(filename)
+                removed += 1
+        if sharded:
+            removed += remove_unreferenced_shards(live_files)
+        log = 'reused = %d converted = %d compacted = %d shards' % \
+              (state['reused'], state['written'] - state['reused'], compacted) + \
+              ' removed = %d stale tfrecords files' % removed
+        tf.logging.info(log)
+
 
 def str2bool(v):
     if v.lower() in ('yes', 'true', 't', 'y', '1'):
@@ -146,6 +488,11 @@ if __name__ == '__main__':
     parser.add_argument('--nnet-target', metavar = '<nnet-target-rspecifiers>',
                         help = 'nnet-target rspecifiers.',
                         type = str, default = None)
+    parser.add_argument('--sorted-join', metavar = 'sorted-join',
+                        help = 'whether nnet-input and nnet-target are both '
+                               'archives sorted by key, read in one pass '
+                               'instead of holding nnet-target in memory.',
+                        type = str2bool, default = 'false')
     parser.add_argument('--target-length-cutoff', metavar = 'target length cut off',
                         help = 'filter short length audio',
                         type = int, default=1)
@@ -155,6 +502,51 @@ if __name__ == '__main__':
     parser.add_argument('--report-interval', metavar = 'report-interval',
                         help='progress report interval.',
                         type = int, default = 100)
+    parser.add_argument('--shard-size', metavar = 'shard-size',
+                        help='target size of each tfrecords shard in MB, '
+                             '0 to write one tfrecords file per utterance.',
+                        type = float, default = 0)
+    parser.add_argument('--shard-utterances', metavar = 'shard-utterances',
+                        help='maximum number of utterances in each tfrecords '
+                             'shard, 0 for no limit.',
+                        type = int, default = 0)
+    parser.add_argument('--record-format', metavar = 'record-format',
+                        help='record format version, 1 for SequenceExample '
+                             'with one feature per frame, 2 for raw float32 '
+                             'bytes of the whole utterance.',
+                        type = int, choices = [1, 2], default = 1)
+    parser.add_argument('--left-context', metavar = 'left-context',
+                        help='left context to splice at conversion time, '
+                             'must match left_context of the nnet config.',
+                        type = int, default = 0)
+    parser.add_argument('--right-context', metavar = 'right-context',
+                        help='right context to splice at conversion time, '
+                             'must match right_context of the nnet config.',
+                        type = int, default = 0)
+    parser.add_argument('--subsample', metavar = 'subsample',
+                        help='subsampling factor applied at conversion time, '
+                             'must match subsample of the nnet config.',
+                        type = int, default = 0)
+    parser.add_argument('--num-workers', metavar = 'num-workers',
+                        help='number of processes serializing and writing '
+                             'tfrecords, 0 to convert in the main process.',
+                        type = int, default = 0)
+    parser.add_argument('--manifest', metavar = 'manifest',
+                        help='manifest of (key, feature hash, label hash, '
+                             'record) kept across runs for incremental '
+                             'conversion: unchanged utterances keep their '
+                             'records and stale records are removed.',
+                        type = str, default = None)
+    parser.add_argument('--compact-threshold', metavar = 'compact-threshold',
+                        help='with --manifest, shards whose live records '
+                             'take less than this fraction of their size '
+                             'are rewritten into new shards, 0 to never '
+                             'compact.',
+                        type = float, default = 0.5)
+    parser.add_argument('--queue-size', metavar = 'queue-size',
+                        help='maximum number of utterances queued for each '
+                             'worker.',
+                        type = int, default = 16)
 
     args = parser.parse_args()
 
@@ -38,8 +38,10 @@ def main(_):
     filename, tfrecord, _ = \
         nnet.dataset_from_tfrecords(
             tfrecords_scp=args.tfrecords_scp,
-            left_context=nnet_config.get('left_context'),
-            right_context=nnet_config.get('right_context'),
+            left_context=0 if nnet_config.get('splice_in_graph') else \
+                         nnet_config.get('left_context'),
+            right_context=0 if nnet_config.get('splice_in_graph') else \
+                          nnet_config.get('right_context'),
             shuffle=False,
         )
 
@@ -52,14 +54,17 @@ def main(_):
     graph = nnet.create_graph_for_decoding(
                 pipeline=pipeline,
                 nnet_config=nnet_config,
+                graph_def=nnet.read_frozen_graph(args.nnet_in) \
+                          if args.frozen_graph else None,
             )
 
     sess.run(pipeline_initializer)
     sess.run(tf.global_variables_initializer())
     sess.run(tf.local_variables_initializer())
 
-    saver = tf.train.Saver(tf.trainable_variables())
-    saver.restore(sess, args.nnet_in)
+    if not args.frozen_graph:
+        saver = tf.train.Saver(tf.trainable_variables())
+        saver.restore(sess, args.nnet_in)
 
     nodes = { 'filename' : graph['filename'],
               'decoded' :  graph['decoded'] }
@@ -68,12 +73,9 @@ def main(_):
         processed = 0
         while True:
             values = sess.run(nodes)
-            filename = values['filename']
+            key = values['filename']
             decoded = values['decoded']
 
-            key = os.path.basename(filename)
-            key, _ = os.path.splitext(key)
-
             output_writer.Write(key, decoded)
 
             processed += 1
@@ -119,6 +121,9 @@ if __name__ == '__main__':
     # switches
     parser.add_argument('--report-interval', metavar = 'report-interval',
                         type = int, help='progress report interval.', default = 100)
+    parser.add_argument('--frozen-graph', metavar = 'frozen-graph',
+                        help='whether nnet-in is a graph from nnet-freeze.py.',
+                        type = str2bool, default = 'false')
 
     args = parser.parse_args()
 
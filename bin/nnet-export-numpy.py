@@ -0,0 +1,171 @@
+# Copyright 2018 Mobvoi Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+
+
+#!/usr/bin/python2
+
+import argparse
+import nnet
+import numpy
+import pyKaldiIO
+import re
+import sys
+import tensorflow as tf
+
+tf.logging.set_verbosity(tf.logging.INFO)
+
+
+
+def numpy_param_names(variables, nnet_config):
+    ''' numpy_param_names() maps the trainable variables of an lstm / blstm
+        model to the parameter names of pyKaldiIO.LstmNnet, e.g.
+        'drnn0/lstm_cell/kernel:0' to 'drnn0/kernel'. The output layer is
+        made of unnamed tf.Variable()s, which are told apart by the order
+        they are created in.
+    '''
+    num_experts = nnet_config.get('num_experts')
+    output_names = [ 'W_prior', 'b_prior', 'W', 'b' ] \
+                   if num_experts else [ 'W', 'b' ]
+
+    names = dict()
+    unnamed = []
+    for var in variables:
+        scopes = var.op.name.split('/')
+        match = re.match(r'^Variable(_(\d+))?$', scopes[-1])
+        if len(scopes) == 1 and match:
+            unnamed.append((int(match.group(2) or 0), var))
+            continue
+        layer = [ s for s in scopes
+                  if re.match(r'^(drnn|fd|bd)\d+$', s) or
+                     s.startswith('drnn_bn') ]
+        if not layer:
+            log = 'unexpected variable %s' % var.op.name
+            tf.logging.fatal(log)
+            sys.exit(1)
+        param = 'projection/kernel' if 'projection' in scopes \
+                else scopes[-1]
+        names[var] = layer[0] + '/' + param
+
+    if len(unnamed) != len(output_names):
+        log = 'expected %d output layer variables, got %d' % \
+              (len(output_names), len(unnamed))
+        tf.logging.fatal(log)
+        sys.exit(1)
+    for name, (_, var) in zip(output_names, sorted(unnamed)):
+        names[var] = name
+
+    return names
+
+
+def main(_):
+    nnet_config = nnet.parse_config(args.nnet_config)
+    nnet_type = nnet_config.get('nnet_type')
+    if nnet_type != 'lstm' and nnet_type != 'blstm':
+        log = 'nnet_type %s is not supported' % nnet_type
+        tf.logging.fatal(log)
+        sys.exit(1)
+    nnet_config['is_training'] = False
+
+    left_context = nnet_config.get('left_context') or 0
+    right_context = nnet_config.get('right_context') or 0
+    subsample = nnet_config.get('subsample') or 0
+    input_dim = nnet_config.get('input_dim')
+    if not nnet_config.get('splice_in_graph'):
+        input_dim *= (1 + left_context + right_context)
+
+    nnet_input = tf.placeholder(tf.float32, [None, input_dim])
+    pipeline = { 'filename' : tf.constant(''),
+                 'nnet_input' : nnet_input,
+                 'sequence_length' : tf.shape(nnet_input)[0] }
+    graph = \
+        nnet.create_graph_for_inference(
+            pipeline=pipeline,
+            nnet_config=nnet_config,
+        )
+
+    config = tf.ConfigProto()
+    config.gpu_options.allow_growth = True  # Alway use minimum memory.
+    sess = tf.Session(config = config)
+
+    saver = tf.train.Saver(tf.trainable_variables())
+    saver.restore(sess, args.nnet_in)
+
+    variables = tf.trainable_variables()
+    names = numpy_param_names(variables, nnet_config)
+    values = sess.run(variables)
+    arrays = dict()
+    for var, value in zip(variables, values):
+        arrays[names[var]] = value
+        log = '%s -> %s %s' % (var.op.name, names[var], value.shape)
+        tf.logging.info(log)
+    for key in pyKaldiIO.LstmNnet.CONFIG_KEYS:
+        value = nnet_config.get(key)
+        arrays['config/' + key] = numpy.array('' if value is None else value)
+    if args.class_prior is not None:
+        arrays['class_prior'] = nnet.get_class_prior(args.class_prior)
+
+    with open(args.nnet_out, 'wb') as fo:
+        numpy.savez(fo, **arrays)
+    log = 'wrote %s' % args.nnet_out
+    tf.logging.info(log)
+
+    if args.check_frames > 0:
+        feats = numpy.random.randn(args.check_frames,
+                                   nnet_config.get('input_dim'))
+        feats = feats.astype(numpy.float32)
+        tf_input = feats
+        if not nnet_config.get('splice_in_graph'):
+            if left_context or right_context:
+                tf_input = nnet.splice_features(tf_input,
+                                                left_context, right_context)
+            if subsample:
+                tf_input = nnet.subsample_features(tf_input, subsample)
+        tf_logits = sess.run(graph['logits'],
+                             feed_dict={ nnet_input : tf_input })
+        np_logits = pyKaldiIO.LstmNnet(args.nnet_out).Compute(feats)
+
+        diff = numpy.max(numpy.abs(tf_logits - np_logits))
+        log = 'max abs diff of logits between tensorflow and numpy = %g' % diff
+        tf.logging.info(log)
+        if diff > args.check_tolerance:
+            log = 'max abs diff exceeds %g' % args.check_tolerance
+            tf.logging.fatal(log)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    # positional args.
+    parser.add_argument('nnet_config', metavar = '<nnet-config>',
+                        type = str, help = 'nnet-config.')
+    parser.add_argument('nnet_in', metavar = '<nnet-in>',
+                        type = str, help = 'nnet-in.')
+    parser.add_argument('nnet_out', metavar = '<nnet-out>',
+                        type = str, help = '.npz for bin/nnet-forward-numpy.py.')
+        # switches
+    parser.add_argument('--class-prior', metavar = 'class-prior',
+                        type = str, help='class prior stored with the model, '
+                        'applied by bin/nnet-forward-numpy.py.',
+                        default = None)
+    parser.add_argument('--check-frames', metavar = 'check-frames',
+                        type = int, help='if > 0, compare the numpy outputs '
+                        'of this many random frames with tensorflow.',
+                        default = 0)
+    parser.add_argument('--check-tolerance', metavar = 'check-tolerance',
+                        type = float, help='max abs diff of logits allowed '
+                        'by --check-frames.', default = 1e-3)
+
+    args = parser.parse_args()
+
+    tf.app.run(main=main, argv=[sys.argv[0]])
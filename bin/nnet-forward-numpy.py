@@ -0,0 +1,141 @@
+# Copyright 2018 Mobvoi Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+
+
+#!/usr/bin/python2
+
+# nnet-forward-numpy.py is nnet-forward.py without tensorflow: it reads kaldi
+# features, without context, and runs the .npz model written by
+# nnet-export-numpy.py (or nnet-quantize.py) in numpy. With --best-path it
+# writes the best path CTC labels like nnet-decode.py instead.
+
+import argparse
+import numpy
+import pyKaldiIO
+import time
+
+
+def best_path(nnet_output):
+    ''' best_path() is CTC greedy decoding, with the blank as the last
+        target like in tf.nn.ctc_beam_search_decoder().
+    '''
+    labels = numpy.argmax(nnet_output, axis=1)
+    keep = numpy.ones(labels.shape, dtype=bool)
+    keep[1:] = labels[1:] != labels[:-1]
+    labels = labels[keep]
+    return labels[labels != nnet_output.shape[1] - 1].astype(numpy.int32)
+
+
+def main():
+    nnet = pyKaldiIO.LstmNnet(args.nnet_in)
+    if args.apply_log:
+        args.apply_softmax = True
+
+    class_prior = None
+    if args.apply_class_prior:
+        if nnet.class_prior is None:
+            pyKaldiIO.LogError('%s has no class prior, see --class-prior of '
+                               'nnet-export-numpy.py.' % args.nnet_in)
+        class_prior = nnet.class_prior
+
+    feature_reader = pyKaldiIO.SequentialBaseFloatMatrixReader(args.feature_rspecifier)
+    if args.best_path:
+        nnet_output_writer = pyKaldiIO.Int32VectorWriter(args.nnet_output)
+    else:
+        nnet_output_writer = pyKaldiIO.BaseFloatMatrixWriter(args.nnet_output)
+
+    processed = 0
+    frames = 0
+    compute_time = 0.0
+    try:
+        while not feature_reader.Done():
+            key = feature_reader.Key()
+            feats = feature_reader.Value()
+            start = time.time()
+            nnet_output = nnet.Compute(feats,
+                                       apply_softmax=args.apply_softmax,
+                                       smooth_factor=args.smooth_factor)
+            compute_time += time.time() - start
+            frames += feats.shape[0]
+            if args.apply_log:
+                nnet_output = numpy.log(nnet_output)
+
+            if class_prior is not None:
+                nnet_output = nnet_output - class_prior
+
+            if args.best_path:
+                nnet_output = best_path(nnet_output)
+
+            nnet_output_writer.Write(key, nnet_output)
+            feature_reader.Next()
+
+            processed += 1
+            if args.report_interval and \
+               processed % args.report_interval == 0:
+                pyKaldiIO.LogInfo('processed = %d' % processed)
+
+    except KeyboardInterrupt:
+        pyKaldiIO.LogError('interrupted by user')
+
+    pyKaldiIO.LogInfo('done, processed = %d' % processed)
+    # Time of the nnet alone, without reading and writing.
+    pyKaldiIO.LogInfo('compute time = %.2f s for %d frames, %.1f frames/s'
+                      % (compute_time, frames,
+                         frames / max(compute_time, 1e-6)))
+    feature_reader.Close()
+    nnet_output_writer.Close()
+
+
+def str2bool(v):
+    if v.lower() in ('yes', 'true', 't', 'y', '1'):
+        return True
+    elif v.lower() in ('no', 'false', 'f', 'n', '0'):
+        return False
+    else:
+        raise argparse.ArgumentTypeError('Boolean value expected.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    # positional args.
+    parser.add_argument('feature_rspecifier', metavar = '<feature-rspecifier>',
+                        type = str, help = 'rspecifier for the features.')
+    parser.add_argument('nnet_in', metavar = '<nnet-in>',
+                        type = str, help = '.npz from nnet-export-numpy.py.')
+    parser.add_argument('nnet_output', metavar = '<nnet-output-wspecifier>',
+                        type = str, help='wspecifier for nnet-output.')
+        # switches
+    parser.add_argument('--apply-softmax', metavar = 'apply-softmax',
+                        help='whether to apply softmax.',
+                        type = str2bool, default = 'true')
+    parser.add_argument('--apply-log', metavar = 'apply-log',
+                        help='whether to apply log on top of softmax',
+                        type = str2bool, default = 'true')
+    parser.add_argument('--apply-class-prior', metavar = 'apply-class-prior',
+                        help='whether to subtract the class prior stored '
+                        'with the model.',
+                        type = str2bool, default = 'false')
+    parser.add_argument('--best-path', metavar = 'best-path',
+                        help='whether to write the best path CTC labels '
+                        'as int32 vectors instead of the nnet output.',
+                        type = str2bool, default = 'false')
+    parser.add_argument('--smooth-factor', metavar = 'smooth-factor',
+                        type = float, help='smooth factor of the softmax.',
+                        default = 1.0)
+    parser.add_argument('--report-interval', metavar = 'report-interval',
+                        type = int, help='progress report interval.', default = 100)
+
+    args = parser.parse_args()
+
+    main()
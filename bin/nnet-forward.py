@@ -21,11 +21,84 @@ import os
 import pyKaldiIO
 import sys
 import tensorflow as tf
+import time
 
 tf.logging.set_verbosity(tf.logging.INFO)
 
 
 
+def forward_streaming(sess, pipeline, streamer, nnet_output_writer,
+                      class_prior, frame_shift):
+    ''' forward_streaming() feeds each utterance to streamer in chunks of
+        args.chunk_size frames, as if they arrived in real time with
+        frame_shift ms per frame, and reports the latency of the chunks.
+    '''
+    nodes = { 'filename' : pipeline['filename'],
+              'nnet_input' : pipeline['nnet_input'] }
+    latencies = []
+    total_time = 0.0
+    total_frames = 0
+    try:
+        processed = 0
+        while True:
+            values = sess.run(nodes)
+            key = values['filename']
+            nnet_input = values['nnet_input']
+
+            nnet_output = []
+            start = time.time()
+            for i in xrange(0, nnet_input.shape[0], args.chunk_size):
+                chunk = nnet_input[i:i + args.chunk_size]
+                # The chunk is complete once its last frame has arrived.
+                arrival = start + \
+                          (i + chunk.shape[0]) * frame_shift / 1000.0
+                if args.real_time and arrival > time.time():
+                    time.sleep(arrival - time.time())
+                begin = time.time()
+                nnet_output.append(streamer.accept(key, chunk))
+                end = time.time()
+                total_time += end - begin
+                latencies.append(end - (arrival if args.real_time else begin))
+            streamer.finish(key)
+            total_frames += nnet_input.shape[0]
+
+            nnet_output = numpy.concatenate(nnet_output)
+            if args.apply_log:
+                nnet_output = numpy.log(nnet_output)
+
+            if class_prior is not None:
+                nnet_output = nnet_output - class_prior
+
+            nnet_output_writer.Write(key, nnet_output)
+
+            processed += 1
+            if args.report_interval and \
+               processed % args.report_interval == 0:
+                log = 'processed = %d' % (processed)
+                tf.logging.info(log)
+
+    except tf.errors.OutOfRangeError:
+        log = 'done'
+        tf.logging.info(log)
+
+    except KeyboardInterrupt:
+        log = 'interrupted by user'
+        tf.logging.fatal(log)
+        sys.exit(1)
+
+    if latencies:
+        latencies = numpy.array(latencies) * 1000.0
+        log = 'chunks = %d, chunk = %.1f ms, latency (ms): mean = %.2f' % \
+              (len(latencies), args.chunk_size * frame_shift,
+               numpy.mean(latencies)) + \
+              ', p50 = %.2f, p90 = %.2f, p99 = %.2f, max = %.2f' % \
+              tuple(numpy.percentile(latencies, [ 50, 90, 99, 100 ]))
+        tf.logging.info(log)
+        log = 'real time factor = %f' % \
+              (total_time / (total_frames * frame_shift / 1000.0))
+        tf.logging.info(log)
+
+
 def main(_):
     nnet_output_writer = \
         pyKaldiIO.BaseFloatMatrixWriter(args.nnet_output)
@@ -38,11 +111,21 @@ def main(_):
     left_context = nnet_config.get('left_context')
     right_context = nnet_config.get('right_context')
     subsample = nnet_config.get('subsample')
+    # The graph splices / subsamples the raw features itself, except for
+    # streaming, which is fed with spliced chunks.
+    if nnet_config.get('splice_in_graph') and not args.chunk_size:
+        left_context, right_context, subsample = 0, 0, 0
     nnet_config['is_training'] = False
     if args.apply_log:
         args.apply_softmax=True
 
-    class_prior = None if args.class_prior is None else \
+    if args.frozen_graph and (args.chunk_size > 0 or args.batch_size > 1):
+        log = '--frozen-graph does not support --chunk-size / --batch-size'
+        tf.logging.fatal(log)
+        sys.exit(1)
+
+    # A frozen graph has the log softmax and the class prior folded in.
+    class_prior = None if args.class_prior is None or args.frozen_graph else \
                   nnet.get_class_prior(args.class_prior)
 
     filename, tfrecord, _ = \
@@ -54,52 +137,125 @@ def main(_):
             shuffle=False,
         )
 
-    pipeline_initializer, pipeline = \
-        nnet.create_pipeline_sequential(
-            filename=filename,
-            tfrecord=tfrecord,
-        )
+    if args.chunk_size > 0:
+        pipeline_initializer, pipeline = \
+            nnet.create_pipeline_sequential(
+                filename=filename,
+                tfrecord=tfrecord,
+            )
 
-    graph = \
-        nnet.create_graph_for_inference(
+        graph = \
+            nnet.create_graph_for_streaming(
+                nnet_config=nnet_config,
+                smooth_factor=args.smooth_factor
+            )
+
+        sess.run(pipeline_initializer)
+        sess.run(tf.global_variables_initializer())
+        sess.run(tf.local_variables_initializer())
+
+        saver = tf.train.Saver(tf.trainable_variables())
+        saver.restore(sess, args.nnet_in)
+
+        forward_streaming(
+            sess=sess,
             pipeline=pipeline,
-            nnet_config=nnet_config,
-            smooth_factor=args.smooth_factor
+            streamer=nnet.LSTMStreamer(sess, graph, args.apply_softmax),
+            nnet_output_writer=nnet_output_writer,
+            class_prior=class_prior,
+            frame_shift=args.frame_shift * max(subsample or 0, 1),
         )
+        nnet_output_writer.Close()
+        return
+
+    if args.batch_size > 1:
+        pipeline_initializer, pipeline = \
+            nnet.create_pipeline_sorted_batch(
+                filename=filename,
+                tfrecord=tfrecord,
+                sequence_lengths=nnet.read_sequence_lengths(
+                                     args.tfrecords_scp, subsample),
+                batch_size=args.batch_size,
+                window_size=args.sort_window,
+            )
+
+        graph = \
+            nnet.create_graph_for_batch_inference(
+                pipeline=pipeline,
+                nnet_config=nnet_config,
+                smooth_factor=args.smooth_factor
+            )
+    else:
+        pipeline_initializer, pipeline = \
+            nnet.create_pipeline_sequential(
+                filename=filename,
+                tfrecord=tfrecord,
+            )
+
+        if args.frozen_graph:
+            graph = \
+                nnet.create_graph_from_frozen(
+                    pipeline=pipeline,
+                    graph_def=nnet.read_frozen_graph(args.nnet_in),
+                )
+        else:
+            graph = \
+                nnet.create_graph_for_inference(
+                    pipeline=pipeline,
+                    nnet_config=nnet_config,
+                    smooth_factor=args.smooth_factor
+                )
 
     sess.run(pipeline_initializer)
     sess.run(tf.global_variables_initializer())
     sess.run(tf.local_variables_initializer())
 
-    saver = tf.train.Saver(tf.trainable_variables())
-    saver.restore(sess, args.nnet_in)
+    if not args.frozen_graph:
+        saver = tf.train.Saver(tf.trainable_variables())
+        saver.restore(sess, args.nnet_in)
 
     nodes = { 'filename' : graph['filename'] }
     nodes['nnet_output'] = graph['nnet_output'] \
                            if args.apply_softmax else graph['logits']
+    if args.batch_size > 1:
+        nodes['index'] = graph['index']
+        nodes['sequence_length'] = graph['sequence_length']
+
+    def _write(key, nnet_output):
+        if args.apply_log and not args.frozen_graph:
+            nnet_output = numpy.log(nnet_output)
+
+        if class_prior is not None:
+            nnet_output = nnet_output - class_prior
+
+        nnet_output_writer.Write(key, nnet_output)
 
     try:
         processed = 0
+        # Batched outputs are held here until all earlier ones are written,
+        # so the output order is the same as with one utterance per run.
+        pending = dict()
         while True:
             values = sess.run(nodes)
-            filename = values['filename']
-            nnet_output = values['nnet_output']
-            if args.apply_log:
-                nnet_output = numpy.log(nnet_output)
-
-            if class_prior is not None:
-                nnet_output = nnet_output - class_prior
-
-            key = os.path.basename(filename)
-            key, _ = os.path.splitext(key)
-
-            nnet_output_writer.Write(key, nnet_output)
-
-            processed += 1
-            if args.report_interval and \
-               processed % args.report_interval == 0:
-                log = 'processed = %d' % (processed)
-                tf.logging.info(log)
+            if args.batch_size > 1:
+                for i in xrange(len(values['index'])):
+                    length = values['sequence_length'][i]
+                    pending[values['index'][i]] = \
+                        (values['filename'][i],
+                         values['nnet_output'][i, :length])
+            else:
+                pending[processed] = \
+                    (values['filename'], values['nnet_output'])
+
+            while processed in pending:
+                key, nnet_output = pending.pop(processed)
+                _write(key, nnet_output)
+
+                processed += 1
+                if args.report_interval and \
+                   processed % args.report_interval == 0:
+                    log = 'processed = %d' % (processed)
+                    tf.logging.info(log)
     
     except tf.errors.OutOfRangeError:
         log = 'done'
@@ -146,9 +302,33 @@ if __name__ == '__main__':
     parser.add_argument('--class-prior', metavar = 'class-prior',
                         type = str, help='class prior to scale the softmax output',
                         default = None)
+    parser.add_argument('--batch-size', metavar = 'batch-size',
+                        type = int, help='number of utterances per run, '
+                        'batched by length; 1 to run one utterance at a time.',
+                        default = 1)
+    parser.add_argument('--sort-window', metavar = 'sort-window',
+                        type = int, help='number of consecutive utterances '
+                        'sorted by length for --batch-size > 1.', default = 1024)
+    parser.add_argument('--chunk-size', metavar = 'chunk-size',
+                        type = int, help='stream utterances through a '
+                        'unidirectional lstm in chunks of this many frames, '
+                        'carrying the states; 0 to run whole utterances.',
+                        default = 0)
+    parser.add_argument('--frame-shift', metavar = 'frame-shift',
+                        type = float, help='frame shift in ms of the input '
+                        'features, for streaming latencies.', default = 10.0)
+    parser.add_argument('--real-time', metavar = 'real-time',
+                        help='whether to feed chunks no faster than real time '
+                        'when streaming, so latencies include waiting.',
+                        type = str2bool, default = 'false')
     parser.add_argument('--smooth-factor', metavar ='smooth factor',
                         type = float, help='smooth factor for softmax', 
                         default = 1.0)
+    parser.add_argument('--frozen-graph', metavar = 'frozen-graph',
+                        help='whether nnet-in is a graph from nnet-freeze.py, '
+                        'whose nnet output replaces --apply-log, '
+                        '--class-prior and --smooth-factor.',
+                        type = str2bool, default = 'false')
 
 
     args = parser.parse_args()
@@ -0,0 +1,96 @@
+# Copyright 2018 Mobvoi Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#  http://www.apache.org/licenses/LICENSE-2.0
+# 
+# THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+
+
+#!/usr/bin/python2
+
+import argparse
+import nnet
+import os
+import sys
+import tensorflow as tf
+
+tf.logging.set_verbosity(tf.logging.INFO)
+
+
+def main(_):
+    config = tf.ConfigProto()
+    config.gpu_options.allow_growth = True  # Alway use minimum memory.
+    sess = tf.Session(config = config)
+
+    nnet_config = nnet.parse_config(args.nnet_config)
+    nnet_config['is_training'] = False
+
+    class_prior = None if args.class_prior is None else \
+                  nnet.get_class_prior(args.class_prior)
+
+    nnet.create_graph_for_export(
+        nnet_config=nnet_config,
+        smooth_factor=args.smooth_factor,
+        class_prior=class_prior,
+        apply_log=args.apply_log,
+    )
+
+    saver = tf.train.Saver(tf.trainable_variables())
+    saver.restore(sess, args.nnet_in)
+
+    graph_def = nnet.freeze_graph(sess)
+    log = 'ops before freezing = %d, after = %d' % \
+          (len(sess.graph.as_graph_def().node), len(graph_def.node))
+    tf.logging.info(log)
+
+    tf.train.write_graph(
+        graph_def,
+        os.path.dirname(args.graph_out) or '.',
+        os.path.basename(args.graph_out),
+        as_text=False,
+    )
+    log = 'wrote %s' % args.graph_out
+    tf.logging.info(log)
+
+
+def str2bool(v):
+    if v.lower() in ('yes', 'true', 't', 'y', '1'):
+        return True
+    elif v.lower() in ('no', 'false', 'f', 'n', '0'):
+        return False
+    else:
+        raise argparse.ArgumentTypeError('Boolean value expected.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    # positional args.
+    parser.add_argument('nnet_config', metavar = '<nnet-config>',
+                        type = str, help = 'nnet-config.')
+    parser.add_argument('nnet_in', metavar = '<nnet-in>',
+                        type = str, help = 'nnet-in.')
+    parser.add_argument('graph_out', metavar = '<graph-out>',
+                        type = str, help = 'frozen graph for --frozen-graph '
+                        'of nnet-forward.py / nnet-decode.py.')
+        # switches
+    parser.add_argument('--apply-log', metavar = 'apply-log',
+                        help='whether the nnet output is the log softmax '
+                        'minus the class prior, or the softmax.',
+                        type = str2bool, default = 'true')
+    parser.add_argument('--class-prior', metavar = 'class-prior',
+                        type = str, help='class prior to scale the softmax output',
+                        default = None)
+    parser.add_argument('--smooth-factor', metavar ='smooth factor',
+                        type = float, help='smooth factor for softmax', 
+                        default = 1.0)
+
+    args = parser.parse_args()
+
+    tf.app.run(main=main, argv=[sys.argv[0]])
@@ -35,14 +35,21 @@ def main(_):
         left_context = nnet_config.get('left_context')
         right_context = nnet_config.get('right_context')
         subsample = nnet_config.get('subsample')
-
-        filename, tfrecord, input_dim = \
-            nnet.dataset_from_tfrecords(
-                tfrecords_scp=args.tfrecords_scp,
+        # The graph splices / subsamples the raw features itself.
+        if nnet_config.get('splice_in_graph'):
+            left_context, right_context, subsample = 0, 0, 0
+
+        filename, tfrecord, input_dim, _ = \
+            nnet.read_dataset(
+                data=args.tfrecords_scp,
+                nnet_target=args.nnet_target,
                 left_context=left_context,
                 right_context=right_context,
                 subsample=subsample,
+                num_parallel_calls=args.num_parallel_calls,
+                num_parallel_reads=args.num_parallel_reads,
                 shuffle=False,
+                target_length_cutoff=args.target_length_cutoff,
             )
 
         if args.objective == 'ctc':
@@ -105,7 +112,8 @@ if __name__ == '__main__':
 
     # positional args.
     parser.add_argument('tfrecords_scp', metavar = '<tfrecords.scp>',
-                        type = str, help = 'tfrecords.scp.')
+                        type = str, help = 'tfrecords.scp, or the features '
+                        'rspecifier (scp:feats.scp) with --nnet-target.')
     parser.add_argument('nnet_config', metavar = '<nnet-config>',
                         type = str, help = 'nnet-config.')
     parser.add_argument('nnet_out', metavar = '<nnet-out>',
@@ -121,9 +129,19 @@ if __name__ == '__main__':
     parser.add_argument('--batch-size', metavar = 'batch-size',
                         type = int, help='batch-size.', default = 256)
     parser.add_argument('--batch-threads', metavar = 'batch-threads',
-                        type = int, help='batch-threads.', default = 8)
+                        type = int, help='number of batches prefetched.', default = 8)
     parser.add_argument('--num-parallel-calls', metavar = 'num-parallel-calls',
                         type = int, help='num-parallel-calls.', default = 32)
+    parser.add_argument('--nnet-target', metavar = 'nnet-target',
+                        type = str, help='rspecifier of the int32 vector '
+                        'labels, to read kaldi features directly instead '
+                        'of tfrecords.', default = None)
+    parser.add_argument('--target-length-cutoff', metavar = 'target-length-cutoff',
+                        type = int, help='with --nnet-target, skip utterances '
+                        'with this many labels or fewer, like '
+                        'convert-to-tfrecords.py.', default = 1)
+    parser.add_argument('--num-parallel-reads', metavar = 'num-parallel-reads',
+                        type = int, help='number of tfrecords files read in parallel.', default = 8)
     parser.add_argument('--report-interval', metavar = 'report-interval',
                         type = int, help='progress report interval.', default = 100)
 
@@ -0,0 +1,66 @@
+# Copyright 2018 Mobvoi Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+
+
+#!/usr/bin/python2
+
+# nnet-quantize.py quantizes the weight matrices of the .npz model written by
+# nnet-export-numpy.py to int8, with one scale per output channel.
+# This shrinks the model file about 4x; pyKaldiIO.LstmNnet dequantizes the
+# weights once when reading the model and computes in float32.
+
+import argparse
+import numpy
+import pyKaldiIO
+from pyKaldiIO.nnet_lstm import Dequantize
+from pyKaldiIO.nnet_lstm import IsQuantizable
+from pyKaldiIO.nnet_lstm import Quantize
+
+
+def main():
+    npz = numpy.load(args.nnet_in)
+    arrays = dict()
+    float_bytes = 0
+    quantized_bytes = 0
+    for key in npz.files:
+        value = npz[key]
+        if not IsQuantizable(key) or value.dtype == numpy.int8:
+            arrays[key] = value
+            continue
+        quantized, scale = Quantize(value)
+        arrays[key] = quantized
+        arrays[key + '/scale'] = scale
+        float_bytes += value.nbytes
+        quantized_bytes += quantized.nbytes + scale.nbytes
+        error = numpy.max(numpy.abs(Dequantize(quantized, scale) - value))
+        pyKaldiIO.LogInfo('%s %s, max abs error = %g'
+                          % (key, value.shape, error))
+
+    with open(args.nnet_out, 'wb') as fo:
+        numpy.savez(fo, **arrays)
+    pyKaldiIO.LogInfo('quantized %d bytes of weights to %d bytes'
+                      % (float_bytes, quantized_bytes))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    # positional args.
+    parser.add_argument('nnet_in', metavar = '<nnet-in>',
+                        type = str, help = '.npz from nnet-export-numpy.py.')
+    parser.add_argument('nnet_out', metavar = '<nnet-out>',
+                        type = str, help = 'quantized .npz.')
+
+    args = parser.parse_args()
+
+    main()
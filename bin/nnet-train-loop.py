@@ -0,0 +1,347 @@
+# Copyright 2018 Mobvoi Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+
+
+#!/usr/bin/python2
+
+import argparse
+import math
+import nnet
+import os
+import sys
+import tensorflow as tf
+
+tf.logging.set_verbosity(tf.logging.INFO)
+
+
+def create_dataset(tfrecords_scp, nnet_target, nnet_config, shuffle, seed):
+    left_context = nnet_config.get('left_context')
+    right_context = nnet_config.get('right_context')
+    subsample = nnet_config.get('subsample')
+    # The graph splices / subsamples the raw features itself.
+    if nnet_config.get('splice_in_graph'):
+        left_context, right_context, subsample = 0, 0, 0
+
+    _, tfrecord, input_dim, sequence_lengths = \
+        nnet.read_dataset(
+            data=tfrecords_scp,
+            nnet_target=nnet_target,
+            left_context=left_context,
+            right_context=right_context,
+            subsample=subsample,
+            num_parallel_calls=args.num_parallel_calls,
+            num_parallel_reads=args.num_parallel_reads,
+            shuffle=shuffle,
+            seed=seed,
+            target_length_cutoff=args.target_length_cutoff,
+        )
+
+    bucket_boundaries = \
+        nnet.bucket_boundaries_from_lengths(sequence_lengths) \
+        if args.max_frames_per_batch else None
+
+    dataset = \
+        nnet.batch_sequence_dataset(
+            dataset=tfrecord,
+            input_dim=input_dim,
+            batch_size=args.batch_size,
+            batch_threads=args.batch_threads,
+            bucket_boundaries=bucket_boundaries,
+            frames_per_batch=args.max_frames_per_batch,
+            max_sequence_length=max(sequence_lengths),
+            max_batch_size=args.max_batch_size,
+            shuffle=shuffle,
+            seed=seed,
+        )
+
+    return dataset, input_dim
+
+
+def main(_):
+    try:
+        config = tf.ConfigProto()
+        config.gpu_options.allow_growth = True  # Alway use minimum memory.
+        if args.seed is not None:
+            tf.set_random_seed(args.seed)
+
+        sess = tf.Session(config = config)
+        nnet_config = nnet.parse_config(args.nnet_config)
+
+        # Both are fed per epoch: the seed when initializing the training
+        # iterator, is_training = False while validating.
+        seed = tf.placeholder_with_default(
+                   tf.constant(args.seed, dtype=tf.int64),
+                   shape=[],
+                   name='seed'
+               )
+        is_training = tf.placeholder_with_default(
+                          True,
+                          shape=[],
+                          name='is_training'
+                      )
+        nnet_config['is_training'] = is_training
+
+        nnet_type = nnet_config.get('nnet_type')
+        if args.objective != 'ctc':
+            log = 'unsupported objective: %s' % args.objective
+            tf.logging.fatal(log)
+            sys.exit(1)
+        if nnet_type != 'blstm' and nnet_type != 'cudnnlstm' and nnet_type != 'lstm':
+            log = 'unsupported nnet_type: %s' % nnet_type
+            tf.logging.fatal(log)
+            sys.exit(1)
+
+        tr_dataset, tr_input_dim = \
+            create_dataset(args.tr_tfrecords_scp, args.tr_nnet_target,
+                           nnet_config,
+                           shuffle=args.shuffle, seed=seed)
+        cv_dataset, cv_input_dim = \
+            create_dataset(args.cv_tfrecords_scp, args.cv_nnet_target,
+                           nnet_config,
+                           shuffle=False, seed=None)
+        if tr_input_dim != cv_input_dim:
+            log = 'inconsistent nnet_input dimension in tr / cv tfrecords:' + \
+                  ' %d vs. %d' % (tr_input_dim, cv_input_dim)
+            tf.logging.fatal(log)
+            sys.exit(1)
+
+        pipeline_initializers, pipeline = \
+            nnet.create_pipeline_reinitializable(
+                { 'tr' : tr_dataset, 'cv' : cv_dataset }
+            )
+        graph = \
+            nnet.create_graph_for_training_ctc(
+                pipeline=pipeline,
+                nnet_config=nnet_config,
+                learn_rate=args.learn_rate,
+                clip_norm=args.clip_norm,
+                optimizer=args.optimizer,
+            )
+
+        # Only trainable variables are carried from one epoch to the next,
+        # as with separate nnet-train.py runs; the rest (optimizer slots,
+        # batch norm statistics, ...) start afresh every epoch.
+        trainable = set(tf.trainable_variables())
+        reset = tf.variables_initializer(
+                    [ v for v in tf.global_variables() if v not in trainable ]
+                )
+
+        sess.run(tf.global_variables_initializer())
+        sess.run(tf.local_variables_initializer())
+
+        saver = tf.train.Saver(tf.trainable_variables(), max_to_keep=None)
+        if not os.path.isdir(args.dir):
+            os.makedirs(args.dir)
+
+        def _validate():
+            sess.run(pipeline_initializers['cv'])
+            cv_loss, cv_eval = \
+                nnet.validate(
+                    sess=sess,
+                    graph=graph,
+                    evaluate=True,
+                    report_interval=args.report_interval,
+                    feed_dict={ is_training : False },
+                )
+            return cv_loss if args.cv_goal == 'loss' else cv_eval
+
+        # Iteration 0.
+        tf.logging.info('iteration 0')
+        if args.nnet_in is not None:
+            saver.restore(sess, args.nnet_in)
+            nnet_best = args.nnet_in
+        else:
+            nnet_best = '%s/nnet.0' % args.dir
+            tf.logging.info('saving nnet to "%s"', nnet_best)
+            saver.save(sess, nnet_best)
+        cv_goal_best = _validate()
+        log = 'cv_goal_best = %f' % cv_goal_best
+        tf.logging.info(log)
+
+        learn_rate = args.learn_rate
+        halving = False
+        for iteration in xrange(1, args.max_iters + 1):
+            nnet_out = '%s/nnet.%d' % (args.dir, iteration)
+            log = 'iteration %d, training with learn_rate = %f' % \
+                  (iteration, learn_rate)
+            tf.logging.info(log)
+
+            sess.run(reset)
+            sess.run(pipeline_initializers['tr'], feed_dict={ seed : iteration })
+            nnet.train(
+                sess=sess,
+                graph=graph,
+                report_interval=args.report_interval,
+                feed_dict={ graph['lrate'] : learn_rate },
+            )
+            tf.logging.info('saving nnet to "%s"', nnet_out)
+            saver.save(sess, nnet_out)
+
+            cv_goal_val = _validate()
+            rel_impr = (cv_goal_best - cv_goal_val) / cv_goal_best
+            log = 'cv_goal_val = %f cv_goal_best = %f relative improvement = %f' % \
+                  (cv_goal_val, cv_goal_best, rel_impr)
+            tf.logging.info(log)
+
+            # accept or reject?
+            if cv_goal_val < cv_goal_best or \
+               iteration <= args.keep_lr_iters or \
+               iteration <= args.min_iters:
+                nnet_best = nnet_out
+                cv_goal_best = cv_goal_val
+                tf.logging.info('nnet accepted (%s)', os.path.basename(nnet_out))
+            else:
+                tf.logging.info('nnet rejected (%s)', os.path.basename(nnet_out))
+                saver.restore(sess, nnet_best)
+
+            # continue with original learn-rate.
+            if iteration <= args.keep_lr_iters:
+                continue
+
+            # stopping criterion.
+            if halving and rel_impr < args.end_halving_impr:
+                if iteration <= args.min_iters:
+                    log = 'supposed to finish, but we continue as min_iters = %d' % \
+                          args.min_iters
+                    tf.logging.info(log)
+                    continue
+                log = 'finished, too small rel. improvement %f < %f' % \
+                      (rel_impr, args.end_halving_impr)
+                tf.logging.info(log)
+                break
+
+            # start learning-rate fade-out when improvement is low.
+            if not halving and rel_impr < args.start_halving_impr:
+                log = 'start halving learning rate, small rel. improvement %f < %f' % \
+                      (rel_impr, args.start_halving_impr)
+                tf.logging.info(log)
+                halving = True
+
+            # reduce the learning-rate.
+            if halving:
+                learn_rate = max(learn_rate * args.halving_factor,
+                                 args.min_learning_rate)
+
+        with open('%s/final.nnet' % args.dir, 'w') as f:
+            f.write('%s\n' % os.path.basename(nnet_best))
+        log = 'training finished, the final model is %s' % nnet_best
+        tf.logging.info(log)
+
+    except KeyboardInterrupt:
+        log = 'interrupted by user'
+        tf.logging.fatal(log)
+        sys.exit(1)
+
+
+def str2bool(v):
+    if v.lower() in ('yes', 'true', 't', 'y', '1'):
+        return True
+    elif v.lower() in ('no', 'false', 'f', 'n', '0'):
+        return False
+    else:
+        raise argparse.ArgumentTypeError('Boolean value expected.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    # positional args.
+    parser.add_argument('tr_tfrecords_scp', metavar = '<tr-tfrecords.scp>',
+                        type = str, help = 'tfrecords.scp for training, or '
+                        'the features rspecifier with --tr-nnet-target.')
+    parser.add_argument('cv_tfrecords_scp', metavar = '<cv-tfrecords.scp>',
+                        type = str, help = 'tfrecords.scp for validation, or '
+                        'the features rspecifier with --cv-nnet-target.')
+    parser.add_argument('nnet_config', metavar = '<nnet-config>',
+                        type = str, help = 'nnet-config.')
+    parser.add_argument('dir', metavar = '<dir>',
+                        type = str, help = 'directory for nnet.<iter> and final.nnet.')
+
+    # switches
+    parser.add_argument('--nnet-in', metavar = 'nnet-in',
+                        help='nnet to start from, randomly initialized if not given.',
+                        type = str, default = None)
+    parser.add_argument('--objective', metavar = 'objective',
+                        help='objective function.',
+                        type = str, default = 'ctc')
+    parser.add_argument('--optimizer', metavar = 'optimizer',
+                        help='optimizer to be used.',
+                        type = str, default = 'momentum')
+    parser.add_argument('--learn-rate', metavar = 'learn-rate',
+                        type = float, help='initial learning rate.', default = 0.008)
+    parser.add_argument('--max-iters', metavar = 'max-iters',
+                        type = int, help='maximum number of epochs.', default = 50)
+    parser.add_argument('--min-iters', metavar = 'min-iters',
+                        type = int, help='keep training without weight rejection '
+                        'for this many epochs.', default = 0)
+    parser.add_argument('--keep-lr-iters', metavar = 'keep-lr-iters',
+                        type = int, help='fix learning rate and disable weight '
+                        'rejection for this many initial epochs.', default = 0)
+    parser.add_argument('--start-halving-impr', metavar = 'start-halving-impr',
+                        type = float, help='relative improvement below which '
+                        'learning rate halving starts.', default = 0.001)
+    parser.add_argument('--end-halving-impr', metavar = 'end-halving-impr',
+                        type = float, help='relative improvement below which '
+                        'training stops once halving.', default = 0.0001)
+    parser.add_argument('--halving-factor', metavar = 'halving-factor',
+                        type = float, help='learning rate halving factor.', default = 0.5)
+    parser.add_argument('--min-learning-rate', metavar = 'min-learning-rate',
+                        type = float, help='minimum learning rate.', default = 0.00001)
+    parser.add_argument('--cv-goal', metavar = 'cv-goal',
+                        help='validation criterion for accepting epochs.',
+                        type = str, choices = ['loss', 'eval'], default = 'eval')
+    parser.add_argument('--batch-size', metavar = 'batch-size',
+                        type = int, help='batch size.', default = 256)
+    parser.add_argument('--batch-threads', metavar = 'batch-threads',
+                        type = int, help='number of batches prefetched.', default = 8)
+    parser.add_argument('--max-frames-per-batch', metavar = 'max-frames-per-batch',
+                        type = int, help='padded frames per batch, batching by '
+                        'length buckets from tfrecords.scp; 0 to use --batch-size.',
+                        default = 0)
+    parser.add_argument('--max-batch-size', metavar = 'max-batch-size',
+                        type = int, help='maximum batch size with '
+                        '--max-frames-per-batch.', default = 512)
+    parser.add_argument('--seed', metavar = 'seed',
+                        type = int, help='seed for initialization; epoch <iter> '
+                        'shuffles training data with seed <iter>.', default = 777)
+    parser.add_argument('--num-parallel-calls', metavar = 'num-parallel-calls',
+                        type = int, help='num-parallel-calls.', default = 32)
+    parser.add_argument('--tr-nnet-target', metavar = 'tr-nnet-target',
+                        type = str, help='rspecifier of the int32 vector '
+                        'labels for training, to read kaldi features directly '
+                        'instead of tfrecords.', default = None)
+    parser.add_argument('--cv-nnet-target', metavar = 'cv-nnet-target',
+                        type = str, help='rspecifier of the int32 vector '
+                        'labels for validation, to read kaldi features '
+                        'directly instead of tfrecords.', default = None)
+    parser.add_argument('--target-length-cutoff', metavar = 'target-length-cutoff',
+                        type = int, help='with --tr-nnet-target / '
+                        '--cv-nnet-target, skip utterances with this many '
+                        'labels or fewer, like convert-to-tfrecords.py.',
+                        default = 1)
+    parser.add_argument('--num-parallel-reads', metavar = 'num-parallel-reads',
+                        type = int, help='number of tfrecords files read in parallel.', default = 8)
+    parser.add_argument('--report-interval', metavar = 'report-interval',
+                        type = int, help='progress report interval.', default = 100)
+    parser.add_argument('--shuffle', metavar = 'do shuffle in the training',
+                        help='whether to shuffle training data.',
+                        type = str2bool, default = 'true')
+    parser.add_argument('--clip-norm', metavar = 'gradient clip norm',
+                        type = float, help='gradient clip norm', default=5.0)
+
+    args = parser.parse_args()
+
+    log = ' '.join(sys.argv)
+    tf.logging.info(log)
+
+    tf.app.run(main=main, argv=[sys.argv[0]])
@@ -38,16 +38,30 @@ def main(_):
         left_context = nnet_config.get('left_context')
         right_context = nnet_config.get('right_context')
         subsample = nnet_config.get('subsample')
-
-        filename, tfrecord, input_dim = \
-            nnet.dataset_from_tfrecords(
-                tfrecords_scp=args.tfrecords_scp,
+        # The graph splices / subsamples the raw features itself.
+        if nnet_config.get('splice_in_graph'):
+            left_context, right_context, subsample = 0, 0, 0
+
+        # Bucket boundaries are in frames after subsampling, as are the
+        # sequence lengths coming out of the dataset.
+        filename, tfrecord, input_dim, sequence_lengths = \
+            nnet.read_dataset(
+                data=args.tfrecords_scp,
+                nnet_target=args.nnet_target,
                 left_context=left_context,
                 right_context=right_context,
                 subsample=subsample,
+                num_parallel_calls=args.num_parallel_calls,
+                num_parallel_reads=args.num_parallel_reads,
                 shuffle=args.shuffle,
                 seed=args.seed,
+                target_length_cutoff=args.target_length_cutoff,
             )
+        bucket_boundaries = \
+            [ int(b) for b in args.bucket_boundaries.split(',') if b ]
+        if not bucket_boundaries and args.max_frames_per_batch:
+            bucket_boundaries = \
+                nnet.bucket_boundaries_from_lengths(sequence_lengths)
 
         if args.objective == 'ctc':
             if nnet_type == 'blstm' or nnet_type == 'cudnnlstm' or nnet_type == 'lstm':
@@ -58,6 +72,12 @@ def main(_):
                         batch_size=args.batch_size,
                         batch_threads=args.batch_threads,
                         num_epochs=1,
+                        bucket_boundaries=bucket_boundaries,
+                        frames_per_batch=args.max_frames_per_batch,
+                        max_sequence_length=max(sequence_lengths),
+                        max_batch_size=args.max_batch_size,
+                        shuffle=args.shuffle,
+                        seed=args.seed,
                     )
                 graph = \
                     nnet.create_graph_for_training_ctc(
@@ -114,7 +134,8 @@ if __name__ == '__main__':
 
     # positional args.
     parser.add_argument('tfrecords_scp', metavar = '<tfrecords.scp>',
-                        type = str, help = 'tfrecords.scp.')
+                        type = str, help = 'tfrecords.scp, or the features '
+                        'rspecifier (scp:feats.scp) with --nnet-target.')
     parser.add_argument('nnet_config', metavar = '<nnet-config>',
                         type = str, help = 'nnet-config.')
     parser.add_argument('nnet_in', metavar = '<nnet-in>',
@@ -137,11 +158,33 @@ if __name__ == '__main__':
     parser.add_argument('--batch-size', metavar = 'batch-size',
                         type = int, help='batch size.', default = 256)
     parser.add_argument('--batch-threads', metavar = 'batch-threads',
-                        type = int, help='batch threads.', default = 8)
+                        type = int, help='number of batches prefetched.', default = 8)
+    parser.add_argument('--bucket-boundaries', metavar = 'bucket-boundaries',
+                        type = str, help='comma-separated sequence lengths '
+                        'bounding the length buckets, empty for no bucketing.',
+                        default = '')
+    parser.add_argument('--max-frames-per-batch', metavar = 'max-frames-per-batch',
+                        type = int, help='padded frames per batch, batching by '
+                        'length buckets (from tfrecords.scp unless '
+                        '--bucket-boundaries is given); 0 to use --batch-size.',
+                        default = 0)
+    parser.add_argument('--max-batch-size', metavar = 'max-batch-size',
+                        type = int, help='maximum batch size with '
+                        '--max-frames-per-batch.', default = 512)
     parser.add_argument('--seed', metavar = 'seed',
                         type = int, help='seed for shuffling training data.', default = 777)
     parser.add_argument('--num-parallel-calls', metavar = 'num-parallel-calls',
                         type = int, help='num-parallel-calls.', default = 32)
+    parser.add_argument('--nnet-target', metavar = 'nnet-target',
+                        type = str, help='rspecifier of the int32 vector '
+                        'labels, to read kaldi features directly instead '
+                        'of tfrecords.', default = None)
+    parser.add_argument('--target-length-cutoff', metavar = 'target-length-cutoff',
+                        type = int, help='with --nnet-target, skip utterances '
+                        'with this many labels or fewer, like '
+                        'convert-to-tfrecords.py.', default = 1)
+    parser.add_argument('--num-parallel-reads', metavar = 'num-parallel-reads',
+                        type = int, help='number of tfrecords files read in parallel.', default = 8)
     parser.add_argument('--report-interval', metavar = 'report-interval',
                         type = int, help='progress report interval.', default = 100)
     parser.add_argument('--shuffle', metavar = 'do shuffle in the training',
@@ -15,12 +15,37 @@
 from config import parse_config
 from funcs import train
 from funcs import validate
+from graph import create_graph_for_batch_inference
 from graph import create_graph_for_decoding
+from graph import create_graph_for_export
 from graph import create_graph_for_inference
+from graph import create_graph_for_streaming
 from graph import create_graph_for_training_ctc
 from graph import create_graph_for_validation_ctc
+from graph import create_graph_from_frozen
+from graph import freeze_graph
+from graph import read_frozen_graph
+from kaldi import dataset_from_kaldi
+from kaldi import kaldi_sequence_lengths
+from kaldi import read_feats_scp
+from kaldi import read_dataset
+from kaldi import read_kaldi_utterances
+from pipeline import batch_sequence_dataset
+from pipeline import bucket_batch_sizes
+from pipeline import bucket_boundaries_from_lengths
+from pipeline import create_pipeline_reinitializable
 from pipeline import create_pipeline_sequence_batch
 from pipeline import create_pipeline_sequential
+from pipeline import create_pipeline_sorted_batch
+from streaming import LSTMStreamer
+from tfrecord import RECORD_FORMAT_RAW
+from tfrecord import RECORD_FORMAT_SEQUENCE
+from tfrecord import TFRecordShardWriter
 from tfrecord import dataset_from_tfrecords
+from tfrecord import read_sequence_lengths
+from tfrecord import read_tfrecords_scp
+from tfrecord import serialize_tfrecord
+from tfrecord import splice_features
+from tfrecord import subsample_features
 from tfrecord import write_tfrecord
 from class_prior import get_class_prior
@@ -99,6 +99,11 @@ def create_logits_blstm(nnet_input, sequence_length, nnet_config):
         dropout_rate = 1.0
         log = 'create_logits_blstm(): is not in training, turn off dropout'
         tf.logging.info(log)
+    elif isinstance(is_training, tf.Tensor):
+        # Fed at run time, e.g. to validate with the training graph.
+        dropout_rate = tf.cond(is_training,
+                               lambda: tf.constant(float(dropout_rate)),
+                               lambda: tf.constant(1.0))
     
 
     seed = None
@@ -20,7 +20,8 @@ import sys
 import tensorflow as tf
 
 
-def train(sess, graph, evaluate = False, report_interval = None):
+def train(sess, graph, evaluate = False, report_interval = None,
+          feed_dict = None):
     step = 0
     processed = 0
     loss = 0.0
@@ -38,7 +39,7 @@ def train(sess, graph, evaluate = False, report_interval = None):
 
     try:
         while True:
-            values = sess.run(nodes)
+            values = sess.run(nodes, feed_dict=feed_dict)
             batch_size = values['size']
             batch_loss = values['eval_loss']
 
@@ -83,10 +84,11 @@ def train(sess, graph, evaluate = False, report_interval = None):
     log = 'tr_loss = %f' % loss
     tf.logging.info(log)
 
-    return True
+    return loss
 
 
-def validate(sess, graph, evaluate = False, report_interval = None):
+def validate(sess, graph, evaluate = False, report_interval = None,
+             feed_dict = None):
     step = 0
     processed = 0
     loss = 0.0
@@ -101,7 +103,7 @@ def validate(sess, graph, evaluate = False, report_interval = None):
 
     try:
         while True:
-            values = sess.run(nodes)
+            values = sess.run(nodes, feed_dict=feed_dict)
             batch_size = values['size']
             batch_loss = values['eval_loss']
 
@@ -148,5 +150,6 @@ def validate(sess, graph, evaluate = False, report_interval = None):
     if evaluate:
         log = 'cv_eval = %f' % acc
         tf.logging.info(log)
+        return loss, acc
 
-    return True
+    return loss, None
@@ -48,6 +48,63 @@ def get_optimizer(string, learning_rate, momentum=0.9):
         return None
 
 
+def splice_batch(nnet_input, sequence_length, left_context, right_context):
+    ''' splice_batch() splices padded [batch, time, dim] sequences into
+        [batch, time, (left_context + 1 + right_context) * dim], repeating
+        the first and last valid frames of each sequence like _splice() in
+        tfrecord.py, so frames within sequence_length are identical.
+    '''
+    shape = tf.shape(nnet_input)
+    batch_size, max_time, input_dim = shape[0], shape[1], shape[2]
+    context = left_context + 1 + right_context
+
+    # indices[b, t, c] = clip(t + c - left_context, 0, sequence_length[b] - 1)
+    indices = tf.expand_dims(tf.range(max_time), 1) + \
+              tf.expand_dims(tf.range(-left_context, right_context + 1), 0)
+    last = tf.reshape(tf.maximum(sequence_length - 1, 0), [-1, 1, 1])
+    indices = tf.minimum(tf.maximum(tf.expand_dims(indices, 0), 0), last)
+    batch_indices = \
+        tf.tile(
+            tf.reshape(tf.range(batch_size), [-1, 1, 1]),
+            [1, max_time, context],
+        )
+    spliced = tf.gather_nd(nnet_input, tf.stack([batch_indices, indices], -1))
+    spliced = tf.reshape(spliced, [batch_size, max_time, context * input_dim])
+    if nnet_input.shape[-1].value is not None:
+        spliced.set_shape([None, None, context * nnet_input.shape[-1].value])
+    return spliced
+
+
+def subsample_batch(nnet_input, sequence_length, factor):
+    ''' subsample_batch() keeps frames 0, factor, 2 * factor, ... of padded
+        [batch, time, dim] sequences like _subsample() in tfrecord.py.
+    '''
+    nnet_input = nnet_input[:, ::factor, :]
+    sequence_length = sequence_length // factor
+    return nnet_input, sequence_length
+
+
+def transform_input(nnet_input, sequence_length, nnet_config):
+    ''' transform_input() splices / subsamples the batched nnet input in the
+        graph when splice_in_graph is set in nnet_config, in which case the
+        dataset must be created without left_context / right_context /
+        subsample.
+    '''
+    if not nnet_config.get('splice_in_graph'):
+        return nnet_input, sequence_length
+
+    left_context = nnet_config.get('left_context') or 0
+    right_context = nnet_config.get('right_context') or 0
+    subsample = nnet_config.get('subsample') or 0
+    if left_context or right_context:
+        nnet_input = splice_batch(nnet_input, sequence_length,
+                                  left_context, right_context)
+    if subsample:
+        nnet_input, sequence_length = \
+            subsample_batch(nnet_input, sequence_length, subsample)
+    return nnet_input, sequence_length
+
+
 def create_graph_for_validation_ctc(pipeline,
                                     nnet_config):
     graph = dict()
@@ -56,6 +113,8 @@ def create_graph_for_validation_ctc(pipeline,
     graph['nnet_input'] = nnet_input
 
     sequence_length = pipeline['sequence_length']
+    nnet_input, sequence_length = \
+        transform_input(nnet_input, sequence_length, nnet_config)
     graph['sequence_length'] = sequence_length
 
     nnet_type = nnet_config.get('nnet_type')
@@ -174,8 +233,10 @@ def create_graph_for_training_ctc(pipeline,
                 nnet_config=nnet_config,
             )
 
-    lrate = tf.constant(
-                learn_rate,
+    # Defaults to learn_rate, but can be fed to change it between epochs.
+    lrate = tf.placeholder_with_default(
+                tf.constant(learn_rate, dtype=tf.float32),
+                shape=[],
                 name='lrate'
             )
 
@@ -226,6 +287,8 @@ def create_graph_for_inference(pipeline,
     if nnet_type == 'blstm' or nnet_type == 'cudnnlstm' or nnet_type == 'lstm':
         nnet_input = tf.expand_dims(nnet_input, 0)
         sequence_length = tf.expand_dims(sequence_length, 0)
+        nnet_input, sequence_length = \
+            transform_input(nnet_input, sequence_length, nnet_config)
         logits, _, _ = create_logits(
                      nnet_input=nnet_input,
                      sequence_length=sequence_length,
@@ -241,8 +304,190 @@ def create_graph_for_inference(pipeline,
     return graph
 
 
+def create_graph_for_batch_inference(pipeline,
+                                     nnet_config,
+                                     smooth_factor=1.0):
+    ''' create_graph_for_batch_inference() is create_graph_for_inference()
+        for padded batches, e.g. from create_pipeline_sorted_batch(). Frames
+        of graph['nnet_output'][i] beyond graph['sequence_length'][i] are
+        padding.
+    '''
+    graph = dict()
+
+    graph['index'] = pipeline['index']
+    graph['filename'] = pipeline['filename']
+    nnet_input = pipeline['nnet_input']
+    graph['nnet_input'] = nnet_input
+    sequence_length = pipeline['sequence_length']
+    nnet_input, sequence_length = \
+        transform_input(nnet_input, sequence_length, nnet_config)
+    graph['sequence_length'] = sequence_length
+
+    nnet_type = nnet_config.get('nnet_type')
+    create_logits = get_create_logits(nnet_type)
+    logits, _, _ = create_logits(
+                 nnet_input=nnet_input,
+                 sequence_length=sequence_length,
+                 nnet_config=nnet_config,
+             )
+    graph['logits'] = logits
+    graph['nnet_output'] = tf.nn.softmax(smooth_factor * logits)
+
+    for key, val in graph.iteritems():
+        tf.add_to_collection(key, val)
+
+    return graph
+
+
+def create_graph_for_streaming(nnet_config,
+                               smooth_factor=1.0):
+    ''' create_graph_for_streaming() is for chunk-by-chunk inference of
+        unidirectional lstm models. graph['nnet_input'] takes chunks of
+        spliced / subsampled features of shape (num_streams, chunk_size, dim)
+        with graph['sequence_length'], graph['initial_states'] takes the
+        states left by the previous chunks (graph['final_states']), as one
+        (c, h) pair of (num_streams, size) arrays per layer.
+    '''
+    graph = dict()
+
+    nnet_type = nnet_config.get('nnet_type')
+    if nnet_type != 'lstm':
+        log = 'unsupported nnet_type for streaming: %s' % nnet_type
+        tf.logging.fatal(log)
+        sys.exit(1)
+
+    input_dim = nnet_config.get('input_dim') * \
+                (1 + (nnet_config.get('left_context') or 0) +
+                 (nnet_config.get('right_context') or 0))
+    nnet_input = tf.placeholder(tf.float32, [None, None, input_dim],
+                                name='nnet_input')
+    graph['nnet_input'] = nnet_input
+    sequence_length = tf.placeholder(tf.int32, [None],
+                                     name='sequence_length')
+    graph['sequence_length'] = sequence_length
+
+    initial_states = lstm.create_lstm_state_placeholders(nnet_config)
+    logits, _, _, final_states = \
+        lstm.create_logits_lstm_with_states(
+            nnet_input=nnet_input,
+            sequence_length=sequence_length,
+            nnet_config=nnet_config,
+            initial_states=initial_states,
+        )
+    graph['initial_states'] = initial_states
+    graph['final_states'] = final_states
+    graph['logits'] = logits
+    graph['nnet_output'] = tf.nn.softmax(smooth_factor * logits)
+
+    return graph
+
+
+FROZEN_GRAPH_INPUT = 'nnet_input'
+FROZEN_GRAPH_OUTPUTS = [ 'logits', 'nnet_output' ]
+
+
+def create_graph_for_export(nnet_config,
+                            smooth_factor=1.0,
+                            class_prior=None,
+                            apply_log=True):
+    ''' create_graph_for_export() is create_graph_for_inference() fed by a
+        placeholder of one utterance of features, as stored in the
+        tfrecords, named FROZEN_GRAPH_INPUT. The outputs are named
+        FROZEN_GRAPH_OUTPUTS, with graph['nnet_output'] being
+        log_softmax(smooth_factor * logits) - class_prior if apply_log,
+        softmax(smooth_factor * logits) otherwise.
+    '''
+    input_dim = nnet_config.get('input_dim')
+    if not nnet_config.get('splice_in_graph'):
+        input_dim *= 1 + (nnet_config.get('left_context') or 0) + \
+                     (nnet_config.get('right_context') or 0)
+    nnet_input = tf.placeholder(tf.float32, [None, input_dim],
+                                name=FROZEN_GRAPH_INPUT)
+    pipeline = { 'filename' : tf.constant(''),
+                 'nnet_input' : nnet_input,
+                 'sequence_length' : tf.shape(nnet_input)[0] }
+    graph = create_graph_for_inference(pipeline, nnet_config, smooth_factor)
+
+    logits = graph['logits']
+    if apply_log:
+        nnet_output = tf.nn.log_softmax(smooth_factor * logits)
+        if class_prior is not None:
+            nnet_output -= tf.constant(class_prior, tf.float32)
+    else:
+        nnet_output = graph['nnet_output']
+    graph['logits'] = tf.identity(logits, name='logits')
+    graph['nnet_output'] = tf.identity(nnet_output, name='nnet_output')
+
+    return graph
+
+
+def freeze_graph(sess):
+    ''' freeze_graph() turns the variables of the graph from
+        create_graph_for_export() into constants and folds the constant
+        subexpressions, keeping only what FROZEN_GRAPH_OUTPUTS need.
+    '''
+    # Only needed here, so that importing nnet does not load graph_transforms.
+    from tensorflow.tools.graph_transforms import TransformGraph
+
+    graph_def = \
+        tf.graph_util.convert_variables_to_constants(
+            sess,
+            sess.graph.as_graph_def(),
+            FROZEN_GRAPH_OUTPUTS,
+        )
+    return TransformGraph(
+               graph_def,
+               [ FROZEN_GRAPH_INPUT ],
+               FROZEN_GRAPH_OUTPUTS,
+               [ 'fold_constants(ignore_errors=true)',
+                 'merge_duplicate_nodes',
+                 'sort_by_execution_order' ],
+           )
+
+
+def read_frozen_graph(filename):
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(filename, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+    return graph_def
+
+
+def import_frozen_graph(nnet_input, graph_def):
+    return tf.import_graph_def(
+               graph_def,
+               input_map={ FROZEN_GRAPH_INPUT : nnet_input },
+               return_elements=[ name + ':0' for name in FROZEN_GRAPH_OUTPUTS ],
+               name='frozen',
+           )
+
+
+def create_graph_from_frozen(pipeline,
+                             graph_def):
+    ''' create_graph_from_frozen() is create_graph_for_inference() with the
+        frozen graph_def from freeze_graph() in place of the model, so no
+        variables need to be restored.
+    '''
+    graph = dict()
+
+    graph['filename'] = pipeline['filename']
+    graph['nnet_input'] = pipeline['nnet_input']
+    graph['sequence_length'] = pipeline['sequence_length']
+
+    graph['logits'], graph['nnet_output'] = \
+        import_frozen_graph(pipeline['nnet_input'], graph_def)
+
+    for key, val in graph.iteritems():
+        tf.add_to_collection(key, val)
+
+    return graph
+
+
 def create_graph_for_decoding(pipeline,
-                              nnet_config):
+                              nnet_config,
+                              graph_def=None):
+    ''' create_graph_for_decoding() takes the logits from the frozen
+        graph_def from freeze_graph() in place of the model if given.
+    '''
     graph = dict()
 
     filename = pipeline['filename']
@@ -254,23 +499,29 @@ def create_graph_for_decoding(pipeline,
 
     nnet_type = nnet_config.get('nnet_type')
     create_logits = get_create_logits(nnet_type)
-    if nnet_type == 'blstm' or nnet_type == 'lstm':
+    if graph_def is not None:
+        logits, _ = import_frozen_graph(nnet_input, graph_def)
+        logits = tf.expand_dims(logits, 0)
+        sequence_length = tf.shape(logits)[1:2]
+    elif nnet_type == 'blstm' or nnet_type == 'lstm':
         nnet_input = tf.expand_dims(nnet_input, 0)
         sequence_length = tf.expand_dims(sequence_length, 0)
-        logits = create_logits(
+        nnet_input, sequence_length = \
+            transform_input(nnet_input, sequence_length, nnet_config)
+        logits, _, _ = create_logits(
                      nnet_input=nnet_input,
                      sequence_length=sequence_length,
                      nnet_config=nnet_config,
                  )
-        # Convert from [batch, time, target] to [time, batch, target]
-        logits = tf.transpose(logits, (1, 0, 2))
-        decoded, log_probabilities = \
-            tf.nn.ctc_beam_search_decoder(
-                inputs=logits,
-                sequence_length=sequence_length,
-                merge_repeated=True
-            )
-        logits = tf.squeeze(logits, 0)
+    # Convert from [batch, time, target] to [time, batch, target]
+    logits = tf.transpose(logits, (1, 0, 2))
+    decoded, log_probabilities = \
+        tf.nn.ctc_beam_search_decoder(
+            inputs=logits,
+            sequence_length=sequence_length,
+            merge_repeated=True
+        )
+    logits = tf.squeeze(logits, 1)
     graph['logits'] = logits
     graph['nnet_output'] = tf.nn.softmax(logits)
     graph['decoded'] = decoded[0].values
@@ -0,0 +1,297 @@
+# Copyright 2018 Mobvoi Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+
+
+# Copyright 2018 Mobvoi Inc. All Rights Reserved.
+# Author: cfyeh@mobvoi.com (Ching-Feng Yeh)
+
+#!/usr/bin/python2
+
+import numpy as np
+import pyKaldiIO
+import sys
+import tensorflow as tf
+import thread
+import threading
+from tfrecord import _postprocess
+from tfrecord import dataset_from_tfrecords
+from tfrecord import read_sequence_lengths
+
+
+def read_feats_scp(feats_rspecifier):
+    ''' read_feats_scp() returns [ (key, rxfilename) ] of the scp of
+        feats_rspecifier, e.g. scp:feats.scp. The scp is the offset index of
+        the archives, so that utterances can be read in any order.
+    '''
+    rspecifier_type, rxfilename, _ = \
+        pyKaldiIO.ClassifyRspecifier(feats_rspecifier)
+    if rspecifier_type != pyKaldiIO.RspecifierType.kScriptRspecifier:
+        log = 'expecting an scp rspecifier for features, got \"%s\",' % \
+              feats_rspecifier + \
+              ' e.g. use copy-feats ark:- ark,scp:feats.ark,feats.scp'
+        tf.logging.fatal(log)
+        sys.exit(1)
+
+    script_input = pyKaldiIO.Input(rxfilename)
+    entries = []
+    while True:
+        line = script_input.Stream().Readline()
+        if not line:
+            break
+        token = line.rstrip().split()
+        if not token:
+            continue
+        if len(token) != 2:
+            log = 'invalid line in %s: \"%s\"' % (rxfilename, line.rstrip())
+            tf.logging.fatal(log)
+            sys.exit(1)
+        entries.append((token[0], token[1]))
+    script_input.Close()
+    return entries
+
+
+def read_kaldi_utterances(feats_rspecifier, labels_rspecifier=None,
+                          target_length_cutoff=1):
+    ''' read_kaldi_utterances() returns the utterances that
+        dataset_from_kaldi() reads, in order, each with the matrix sizes read
+        from the headers in the archives and the length of its labels (if
+        any), and the rxfilename of the labels, e.g. labels.ark:123, so that
+        they can be read without the label reader. Utterances are skipped for
+        the same reasons as in
+        bin/convert-to-tfrecords.py: missing or empty labels, labels not
+        shorter than the features, or not longer than target_length_cutoff.
+        Pass the result to both dataset_from_kaldi() and
+        kaldi_sequence_lengths(), so that it is only read once.
+    '''
+    label_reader = None
+    if labels_rspecifier:
+        label_reader = pyKaldiIO.RandomAccessInt32VectorReader(labels_rspecifier)
+
+    # One Input for all the headers, so that the archives stay open and
+    # reading a header is just a seek.
+    data_input = pyKaldiIO.Input()
+    utterances = []
+    for key, rxfilename in read_feats_scp(feats_rspecifier):
+        target_length = None
+        label_rxfilename = None
+        if label_reader is not None:
+            if not label_reader.HasKey(key):
+                log = 'missing nnet targets for \"%s\" in %s' % \
+                      (key, labels_rspecifier)
+                tf.logging.info(log)
+                continue
+            target_length = len(label_reader.Value(key))
+            if target_length == 0:
+                log = 'length of nnet targets for \"%s\" is 0 in %s' % \
+                      (key, labels_rspecifier)
+                tf.logging.info(log)
+                continue
+            label_rxfilename = label_reader.Rxfilename(key)
+            if label_rxfilename is None:
+                log = 'expecting an scp, or an unsorted archive in a regular' + \
+                      ' file for nnet targets, got \"%s\"' % labels_rspecifier
+                tf.logging.fatal(log)
+                sys.exit(1)
+
+        if not data_input.Open(rxfilename):
+            log = 'failed to open \"%s\" for \"%s\"' % (rxfilename, key)
+            tf.logging.fatal(log)
+            sys.exit(1)
+        num_rows, num_cols = \
+            pyKaldiIO.ReadMatrixShape(data_input.Stream(),
+                                      data_input.IsBinary())
+
+        if target_length is not None and target_length >= num_rows:
+            log = 'num_rows = %d target_length = %d for \"%s\" in %s' % \
+                  (num_rows, target_length, key, labels_rspecifier)
+            tf.logging.info(log)
+            continue
+
+        if target_length is not None and \
+           target_length <= target_length_cutoff:
+            log = 'target_length = %d for \"%s \" in %s is too short' % \
+                  (target_length, key, labels_rspecifier)
+            tf.logging.info(log)
+            continue
+
+        utterance = dict()
+        utterance['key'] = key
+        utterance['rxfilename'] = rxfilename
+        utterance['num_rows'] = num_rows
+        utterance['num_cols'] = num_cols
+        utterance['target_length'] = target_length
+        utterance['label_rxfilename'] = label_rxfilename
+        utterances.append(utterance)
+    data_input.Close()
+    if label_reader is not None:
+        label_reader.Close()
+    return utterances
+
+
+def kaldi_sequence_lengths(utterances, subsample=0):
+    ''' kaldi_sequence_lengths() returns the lengths of the sequences that
+        dataset_from_kaldi() produces for utterances, in the order it
+        produces them when not shuffling.
+    '''
+    sequence_lengths = []
+    for utterance in utterances:
+        if subsample:
+            sequence_lengths.append(utterance['num_rows'] // subsample)
+        else:
+            sequence_lengths.append(utterance['num_rows'])
+    return sequence_lengths
+
+
+def dataset_from_kaldi(feats_rspecifier,
+                       labels_rspecifier = None,
+                       left_context = 0,
+                       right_context = 0,
+                       subsample = 0,
+                       shuffle = False,
+                       seed = None,
+                       num_parallel_calls = 32,
+                       target_length_cutoff = 1,
+                       utterances = None):
+    ''' dataset_from_kaldi() is dataset_from_tfrecords() reading kaldi
+        features and labels directly, without converting them to tfrecords,
+        and returns (key, dataset, input_dim) in the same way.
+
+        feats_rspecifier has to be an scp (e.g. scp:feats.scp), whose
+        offsets are used to read the utterances in any order, with
+        num_parallel_calls parallel reads. Labels from labels_rspecifier (e.g.
+        ark:labels.ark) are read on demand in the same way, at the offsets
+        found by read_kaldi_utterances(). Each reading thread keeps its own
+        archives open, so the threads share no reader and take no lock while
+        reading. utterances is from read_kaldi_utterances(), which is called
+        here if it is None.
+    '''
+    if utterances is None:
+        utterances = read_kaldi_utterances(feats_rspecifier, labels_rspecifier,
+                                           target_length_cutoff)
+    if not utterances:
+        log = 'no utterances found in %s' % feats_rspecifier
+        tf.logging.fatal(log)
+        sys.exit(1)
+
+    input_dim = utterances[0]['num_cols']
+    for utterance in utterances:
+        if input_dim != utterance['num_cols']:
+            log = 'inconsistent nnet_input dimension in %s:' % \
+                  feats_rspecifier + \
+                  ' %d vs. %d for \"%s\"' % (input_dim, utterance['num_cols'],
+                                            utterance['key'])
+            tf.logging.fatal(log)
+            sys.exit(1)
+
+    has_label = labels_rspecifier is not None
+    key_list = [ utterance['key'] for utterance in utterances ]
+
+    # tf.py_func() runs on the threads of tensorflow, which may not keep a
+    # python thread state between calls, so the Inputs are kept by thread id
+    # rather than in a threading.local(). The lock only guards the dict, each
+    # Input is used by its own thread alone.
+    inputs = dict()
+    inputs_lock = threading.Lock()
+
+    def _input(name):
+        input_id = (thread.get_ident(), name)
+        with inputs_lock:
+            if input_id not in inputs:
+                inputs[input_id] = pyKaldiIO.Input()
+            return inputs[input_id]
+
+    def _load(index):
+        utterance = utterances[index]
+        nnet_input = \
+            pyKaldiIO.ReadKaldiObject(utterance['rxfilename'],
+                                      pyKaldiIO.HolderType.kFloatMatrixHolder,
+                                      _input('feats'))
+        nnet_input = np.asarray(nnet_input, dtype=np.float32)
+        if not has_label:
+            return nnet_input
+        nnet_target = \
+            pyKaldiIO.ReadKaldiObject(utterance['label_rxfilename'],
+                                      pyKaldiIO.HolderType.kInt32VectorHolder,
+                                      _input('labels'))
+        return nnet_input, np.asarray(nnet_target, dtype=np.int64)
+
+    def _parse(index):
+        sequence = dict()
+        if has_label:
+            nnet_input, nnet_target = \
+                tf.py_func(_load, [index], [tf.float32, tf.int64])
+            nnet_target.set_shape([None])
+            sequence['nnet_target'] = nnet_target
+        else:
+            nnet_input = tf.py_func(_load, [index], tf.float32)
+        nnet_input.set_shape([None, input_dim])
+        sequence['nnet_input'] = nnet_input
+
+        return _postprocess(sequence, input_dim,
+                            left_context, right_context, subsample)
+
+    key = tf.data.Dataset.from_tensor_slices(key_list)
+    index = tf.data.Dataset.range(len(utterances))
+    if shuffle:
+        index = index.shuffle(buffer_size=len(utterances), seed=seed)
+    dataset = index.map(_parse, num_parallel_calls=num_parallel_calls)
+    input_dim *= (1 + left_context + right_context)
+    return key, dataset, input_dim
+
+
+def read_dataset(data,
+                 nnet_target = None,
+                 left_context = 0,
+                 right_context = 0,
+                 subsample = 0,
+                 shuffle = False,
+                 seed = None,
+                 num_parallel_calls = 32,
+                 num_parallel_reads = 8,
+                 target_length_cutoff = 1):
+    ''' read_dataset() returns (key, dataset, input_dim, sequence_lengths)
+        for the bin/nnet-*.py scripts: data is a tfrecords.scp, or with
+        nnet_target (the labels rspecifier) the rspecifier of kaldi features
+        read by dataset_from_kaldi(). sequence_lengths are as from
+        read_sequence_lengths(), computed along with the dataset.
+    '''
+    if not nnet_target:
+        key, dataset, input_dim = \
+            dataset_from_tfrecords(
+                tfrecords_scp=data,
+                left_context=left_context,
+                right_context=right_context,
+                subsample=subsample,
+                shuffle=shuffle,
+                seed=seed,
+                num_parallel_calls=num_parallel_calls,
+                num_parallel_reads=num_parallel_reads,
+            )
+        sequence_lengths = read_sequence_lengths(data, subsample)
+        return key, dataset, input_dim, sequence_lengths
+
+    utterances = read_kaldi_utterances(data, nnet_target, target_length_cutoff)
+    key, dataset, input_dim = \
+        dataset_from_kaldi(
+            feats_rspecifier=data,
+            labels_rspecifier=nnet_target,
+            left_context=left_context,
+            right_context=right_context,
+            subsample=subsample,
+            shuffle=shuffle,
+            seed=seed,
+            num_parallel_calls=num_parallel_calls,
+            utterances=utterances,
+        )
+    sequence_lengths = kaldi_sequence_lengths(utterances, subsample)
+    return key, dataset, input_dim, sequence_lengths
@@ -122,15 +122,119 @@ def create_logits_cudnnlstm(nnet_input, sequence_length, nnet_config):
     return logits
 
 
+def create_lstm_cells(input_dim, nnet_config, dropout_rate=1.0):
+    """Create the cells of a unidirectional-lstm model
+
+    Args:
+        input_dim: input dimension including context (int)
+        nnet_config: nnet config (dict)
+        dropout_rate: keep probability of the cell outputs (float or tensor)
+
+    Return:
+        cells: one cell per layer (list of tf.contrib.rnn.RNNCell)
+    """
+    num_layers = nnet_config.get('num_layers')
+    num_neurons = nnet_config.get('num_neurons')
+    num_projects = nnet_config.get('num_projects')
+
+    # Building LSTMs
+    with tf.variable_scope("irnn"):
+        cells=[]
+        for i in xrange(num_layers):
+            if i==0 and input_dim != num_projects:
+                 cells.append(
+                   tf.contrib.rnn.DropoutWrapper(
+                     tf.contrib.rnn.LSTMCell(
+                      num_units=num_neurons,
+                      num_proj=num_projects,
+                      use_peepholes=True,
+                      state_is_tuple=True,
+                      ),
+                    output_keep_prob=dropout_rate)
+                 )
+            else:
+                cells.append(
+                   tf.contrib.rnn.DropoutWrapper(
+                    tf.contrib.rnn.ResidualWrapper(
+                    tf.contrib.rnn.LSTMCell(
+                        num_units=num_neurons,
+                        num_proj=num_projects,
+                        use_peepholes=True,
+                        state_is_tuple=True,
+                    )
+                    ),
+                    output_keep_prob=dropout_rate)
+                )
+
+    return cells
+
+
+def create_lstm_state_placeholders(nnet_config):
+    """Create placeholders for the states of a unidirectional-lstm model
+
+    Args:
+        nnet_config: nnet config (dict)
+
+    Return:
+        states: one LSTMStateTuple of [batch_size, size] placeholders per
+            layer, to be passed as initial_states (list)
+    """
+    num_layers = nnet_config.get('num_layers')
+    num_neurons = nnet_config.get('num_neurons')
+    num_projects = nnet_config.get('num_projects')
+    output_dim = num_neurons if num_projects is None else num_projects
+
+    states = \
+        [ tf.contrib.rnn.LSTMStateTuple(
+              c=tf.placeholder(tf.float32, [None, num_neurons],
+                               name='state_c_' + str(i)),
+              h=tf.placeholder(tf.float32, [None, output_dim],
+                               name='state_h_' + str(i)),
+          ) for i in xrange(num_layers) ]
+
+    return states
+
+
 def create_logits_lstm(nnet_input, sequence_length, nnet_config):
     """Create logits for a simple unidirectional-lstm model
 
     Args:
         nnet_input: nnet input (tf tensor)
+        sequence_length: sequence lengths (tf tensor)
+        nnet_config: nnet config (dict)
+
+    Return:
+        logits: logits (tf tensor)
+        encoder: final states of the last layer (tf tensor)
+        reg_loss: (loss, weight) of regularization terms (list)
+    """
+    logits, encoder, reg_loss, _ = \
+        create_logits_lstm_with_states(
+            nnet_input=nnet_input,
+            sequence_length=sequence_length,
+            nnet_config=nnet_config,
+        )
+    return logits, encoder, reg_loss
+
+
+def create_logits_lstm_with_states(nnet_input, sequence_length, nnet_config,
+                                   initial_states=None):
+    """Create logits for a simple unidirectional-lstm model, starting from
+    initial_states and also returning the final states, e.g. for carrying
+    the states from one chunk of a stream to the next.
+
+    Args:
+        nnet_input: nnet input (tf tensor)
+        sequence_length: sequence lengths (tf tensor)
         nnet_config: nnet config (dict)
+        initial_states: one LSTMStateTuple per layer, zero states if None
+            (list)
 
     Return:
         logits: logits (tf tensor)
+        encoder: final states of the last layer (tf tensor)
+        reg_loss: (loss, weight) of regularization terms (list)
+        final_states: one LSTMStateTuple per layer (list)
     """
     input_dim = nnet_config.get('input_dim')
     log = 'create_logits_lstm(): input_dim = %d' % input_dim
@@ -173,9 +277,15 @@ def create_logits_lstm(nnet_input, sequence_length, nnet_config):
     if num_experts is not None:
         log = 'create_logits_lstm(): num_experts = %d' % num_experts
         tf.logging.info(log)
-    weight_orth = nnet_config.get('weight_orth')
-    log = 'create_logits_lstm(): weight_orth = %f' % weight_orth
+    moe_temp = nnet_config.get('moe_temp')
+    if moe_temp is None:
+        moe_temp = 10.0
+    log = 'create_logits_lstm(): moe_temp = %f' % moe_temp
     tf.logging.info(log)
+    weight_orth = nnet_config.get('weight_orth')
+    if weight_orth is not None:
+        log = 'create_logits_lstm(): weight_orth = %f' % weight_orth
+        tf.logging.info(log)
     weight_ornn = nnet_config.get('weight_ornn')
     if weight_ornn is not None:
         log = 'create_logits_lstm(): weight_ornn = %f' % weight_ornn
@@ -201,6 +311,11 @@ def create_logits_lstm(nnet_input, sequence_length, nnet_config):
         dropout_rate = 1.0
         log = 'create_logits_lstm(): is not in training, turn off dropout'
         tf.logging.info(log)
+    elif isinstance(is_training, tf.Tensor):
+        # Fed at run time, e.g. to validate with the training graph.
+        dropout_rate = tf.cond(is_training,
+                               lambda: tf.constant(float(dropout_rate)),
+                               lambda: tf.constant(1.0))
 
     seed = None
 
@@ -230,35 +345,9 @@ def create_logits_lstm(nnet_input, sequence_length, nnet_config):
     #    nnet_input = tf.concat([sil, nnet_input], 1)
     #    sequence_length = sequence_length + 1
 
-    # Building LSTMs
-    with tf.variable_scope("irnn"):
-        cells=[]
-        for i in xrange(num_layers):
-            if i==0 and input_dim != num_projects:
-                 cells.append(
-                   tf.contrib.rnn.DropoutWrapper(
-                     tf.contrib.rnn.LSTMCell(
-                      num_units=num_neurons,
-                      num_proj=num_projects,
-                      use_peepholes=True,
-                      state_is_tuple=True,
-                      ),
-                    output_keep_prob=dropout_rate)
-                 )
-            else:
-                cells.append(
-                   tf.contrib.rnn.DropoutWrapper(
-                    tf.contrib.rnn.ResidualWrapper(
-                    tf.contrib.rnn.LSTMCell(
-                        num_units=num_neurons,
-                        num_proj=num_projects,
-                        use_peepholes=True,
-                        state_is_tuple=True,
-                    )
-                    ),
-                    output_keep_prob=dropout_rate)
-                )
+    cells = create_lstm_cells(input_dim, nnet_config, dropout_rate)
 
+    if initial_states is None:
         initial_states = \
             [ cells[i].zero_state(
                 batch_size=batch_size,
@@ -267,6 +356,7 @@ def create_logits_lstm(nnet_input, sequence_length, nnet_config):
 
 
     drnn_input=nnet_input
+    final_states = []
     for i in xrange(num_layers):
         if i==0 and use_bn:
             drnn_input = \
@@ -276,7 +366,7 @@ def create_logits_lstm(nnet_input, sequence_length, nnet_config):
                     name="drnn_bn_0_"+str(i)
                 )
 
-        output, _ = \
+        output, state = \
             tf.nn.dynamic_rnn(
                 cell=cells[i],
                 inputs=drnn_input,
@@ -285,6 +375,7 @@ def create_logits_lstm(nnet_input, sequence_length, nnet_config):
                 dtype=tf.float32,
                 scope="drnn"+str(i)
             )
+        final_states.append(state)
         if use_bn:
             output = \
                 tf.layers.batch_normalization(
@@ -319,14 +410,14 @@ def create_logits_lstm(nnet_input, sequence_length, nnet_config):
 
     output = tf.reshape(output, [-1, output_dim])
 
-    y_dist = None
     if num_experts is not None and num_experts!=0:
-        y, y_dist = create_moe(output, \
+        y = create_moe(output, \
                       output_dim, \
                       num_targets, \
-                      num_experts
+                      num_experts,
+                      moe_temp,
+                      dropout_rate
                      ) 
-        y_dist  = weight_orth * y_dist
     else:
         # Feed-forward for the last layer
         stddev = 1.0 / math.sqrt(float(output_dim))
@@ -345,27 +436,15 @@ def create_logits_lstm(nnet_input, sequence_length, nnet_config):
 
     logits = y
 
-    reg_loss = ploss
-
-    if y_dist is not None:
-        if reg_loss is not None:
-            reg_loss += y_dist
-        else:
-            reg_loss = y_dist
+    ## encoder
+    encoder = tf.concat(final_states[-1], 1)
 
+    reg_loss = []
+    if ploss is not None:
+        reg_loss.append((ploss, weight_ornn))
     if fp_loss is not None:
-        if reg_loss is not None:
-            reg_loss += fp_loss
-        else:
-            reg_loss = fp_loss
-
+        reg_loss.append((fp_loss, weight_fpro))
     if ploss2 is not None:
-        if reg_loss is not None:
-            reg_loss += ploss2
-        else:
-            reg_loss = ploss2
-
-    return logits, reg_loss
-
-
+        reg_loss.append((ploss2, weight_ornn_next))
 
+    return logits, encoder, reg_loss, final_states
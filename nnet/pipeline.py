@@ -21,15 +21,66 @@ import math
 import tensorflow as tf
 
 
-def create_pipeline_sequence_batch(dataset,
-                                   input_dim,
-                                   batch_size=64,
-                                   batch_threads=8,
-                                   num_epochs=1):
-    ''' create_pipeline_sequence_batch() is for recurrent models such as
-        RNN / LSTM / ..., and mostly for training / validation.
-        The shape of the returned pipeline['nnet_input'] is
-        (batch_size, max_seq_len, dim)
+def bucket_boundaries_from_lengths(sequence_lengths, bucket_ratio=1.1):
+    ''' bucket_boundaries_from_lengths() returns bucket boundaries covering
+        sequence_lengths (e.g. num_rows from tfrecords.scp), growing by
+        bucket_ratio so that padding within a bucket stays below about
+        (bucket_ratio - 1) of its frames.
+    '''
+    min_length = max(1, min(sequence_lengths))
+    max_length = max(sequence_lengths)
+    boundaries = []
+    boundary = min_length + 1
+    while boundary <= max_length:
+        boundaries.append(boundary)
+        boundary = max(boundary + 1, int(boundary * bucket_ratio))
+    return boundaries or [ max_length + 1 ]
+
+
+def bucket_batch_sizes(bucket_boundaries,
+                       frames_per_batch=0,
+                       batch_size=64,
+                       max_sequence_length=None,
+                       max_batch_size=None):
+    ''' bucket_batch_sizes() returns the batch size of each of the
+        len(bucket_boundaries) + 1 buckets. With frames_per_batch, a bucket
+        holds as many sequences as fit in frames_per_batch padded frames at
+        its longest length (the last bucket is bounded by
+        max_sequence_length), but no more than max_batch_size; otherwise
+        every bucket uses batch_size.
+    '''
+    if not frames_per_batch:
+        return [ batch_size ] * (len(bucket_boundaries) + 1)
+
+    upper_bounds = [ boundary - 1 for boundary in bucket_boundaries ]
+    upper_bounds.append(max(max_sequence_length or 0, bucket_boundaries[-1]))
+    batch_sizes = [ max(1, frames_per_batch // upper) for upper in upper_bounds ]
+    if max_batch_size:
+        batch_sizes = [ min(size, max_batch_size) for size in batch_sizes ]
+    return batch_sizes
+
+
+def batch_sequence_dataset(dataset,
+                           input_dim,
+                           batch_size=64,
+                           batch_threads=8,
+                           num_epochs=1,
+                           bucket_boundaries=None,
+                           frames_per_batch=0,
+                           max_sequence_length=None,
+                           max_batch_size=None,
+                           shuffle=False,
+                           seed=None,
+                           shuffle_batches=32):
+    ''' batch_sequence_dataset() pads sequences of dataset into batches
+        of shape (batch_size, max_seq_len, dim).
+
+        With bucket_boundaries, sequences are grouped by sequence_length
+        into buckets so that each batch only pads to lengths of its own
+        bucket, and batch sizes follow bucket_batch_sizes(). When shuffle is
+        set, the batches of all buckets are shuffled within a buffer of
+        shuffle_batches batches (sequences are shuffled by the dataset).
+        Up to batch_threads batches are prefetched ahead of the model.
     '''
 
     padded_shapes = dict()
@@ -43,22 +94,174 @@ def create_pipeline_sequence_batch(dataset,
     padding_values['sequence_length'] = tf.constant(-1, dtype=tf.int32)
     padding_values['target_length'] = tf.constant(-1, dtype=tf.int32)
 
+    if bucket_boundaries:
+        batch_sizes = \
+            bucket_batch_sizes(
+                bucket_boundaries=bucket_boundaries,
+                frames_per_batch=frames_per_batch,
+                batch_size=batch_size,
+                max_sequence_length=max_sequence_length,
+                max_batch_size=max_batch_size,
+            )
+        log = 'bucket boundaries = %s batch sizes = %s' % \
+              (str(bucket_boundaries), str(batch_sizes))
+        tf.logging.info(log)
+        dataset = \
+            dataset.apply(
+                tf.contrib.data.bucket_by_sequence_length(
+                    element_length_func=lambda seq: seq['sequence_length'],
+                    bucket_boundaries=bucket_boundaries,
+                    bucket_batch_sizes=batch_sizes,
+                    padded_shapes=padded_shapes,
+                    padding_values=padding_values,
+                )
+            )
+        if shuffle:
+            dataset = dataset.shuffle(buffer_size=shuffle_batches, seed=seed)
+    else:
+        dataset = \
+            dataset.padded_batch(
+                batch_size=batch_size,
+                padded_shapes=padded_shapes,
+                padding_values=padding_values,
+            )
+    dataset = dataset.prefetch(buffer_size=batch_threads)
+    return dataset
+
+
+def _create_pipeline_from_batch(batch):
+    pipeline = dict()
+    pipeline['nnet_input'] = batch['nnet_input']
+    pipeline['sequence_length'] = tf.cast(batch['sequence_length'], tf.int32)
+    pipeline['nnet_target'] = batch['nnet_target']
+    pipeline['target_length'] = tf.cast(batch['target_length'], tf.int32)
+
+    return pipeline
+
+
+def create_pipeline_sequence_batch(dataset,
+                                   input_dim,
+                                   batch_size=64,
+                                   batch_threads=8,
+                                   num_epochs=1,
+                                   bucket_boundaries=None,
+                                   frames_per_batch=0,
+                                   max_sequence_length=None,
+                                   max_batch_size=None,
+                                   shuffle=False,
+                                   seed=None,
+                                   shuffle_batches=32):
+    ''' create_pipeline_sequence_batch() is for recurrent models such as
+        RNN / LSTM / ..., and mostly for training / validation.
+        The shape of the returned pipeline['nnet_input'] is
+        (batch_size, max_seq_len, dim)
+        See batch_sequence_dataset() for the arguments.
+    '''
+
     dataset = \
-        dataset.padded_batch(
+        batch_sequence_dataset(
+            dataset=dataset,
+            input_dim=input_dim,
             batch_size=batch_size,
-            padded_shapes=padded_shapes,
-            padding_values=padding_values,
+            batch_threads=batch_threads,
+            num_epochs=num_epochs,
+            bucket_boundaries=bucket_boundaries,
+            frames_per_batch=frames_per_batch,
+            max_sequence_length=max_sequence_length,
+            max_batch_size=max_batch_size,
+            shuffle=shuffle,
+            seed=seed,
+            shuffle_batches=shuffle_batches,
         )
     iterator = dataset.make_initializable_iterator()
     batch = iterator.get_next()
 
     initializer = iterator.initializer
-    
+
+    pipeline = _create_pipeline_from_batch(batch)
+
+    return initializer, pipeline
+
+
+def create_pipeline_reinitializable(datasets):
+    ''' create_pipeline_reinitializable() is for running several batched
+        datasets (see batch_sequence_dataset()), e.g. training and
+        validation, through one pipeline and hence one graph. It returns
+        (initializers, pipeline), where initializers[name] switches the
+        pipeline to datasets[name].
+    '''
+
+    names = sorted(datasets.keys())
+    iterator = \
+        tf.data.Iterator.from_structure(
+            datasets[names[0]].output_types,
+            datasets[names[0]].output_shapes,
+        )
+    batch = iterator.get_next()
+
+    initializers = dict()
+    for name in names:
+        initializers[name] = iterator.make_initializer(datasets[name])
+
+    pipeline = _create_pipeline_from_batch(batch)
+
+    return initializers, pipeline
+
+
+def create_pipeline_sorted_batch(filename,
+                                 tfrecord,
+                                 sequence_lengths,
+                                 batch_size=16,
+                                 window_size=1024):
+    ''' create_pipeline_sorted_batch() is for batched inference. Every
+        window_size consecutive sequences are sorted by sequence_lengths (in
+        dataset order, see read_sequence_lengths()) and padded into batches
+        of up to batch_size sequences of similar length. The shape of the
+        returned pipeline['nnet_input'] is (batch_size, max_seq_len, dim),
+        and pipeline['index'] gives the position of each sequence in the
+        dataset, so that the original order can be restored.
+    '''
+
+    batch_ids = [ 0 ] * len(sequence_lengths)
+    window_sizes = []
+    for start in xrange(0, len(sequence_lengths), window_size):
+        end = min(start + window_size, len(sequence_lengths))
+        window = sorted(xrange(start, end), key=lambda i: sequence_lengths[i])
+        for i in xrange(0, len(window), batch_size):
+            for index in window[i:i + batch_size]:
+                batch_ids[index] = len(window_sizes)
+            window_sizes.append(len(window[i:i + batch_size]))
+    batch_ids = tf.constant(batch_ids, dtype=tf.int64)
+    window_sizes = tf.constant(window_sizes, dtype=tf.int64)
+
+    index = tf.data.Dataset.range(len(sequence_lengths))
+    dataset = tf.data.Dataset.zip((index, filename, tfrecord))
+    # A batch is complete once its last sequence arrives, which is at most
+    # window_size sequences after its first one.
+    dataset = \
+        dataset.apply(
+            tf.contrib.data.group_by_window(
+                key_func=lambda i, f, t: tf.gather(batch_ids, i),
+                reduce_func=lambda batch_id, window: \
+                    window.padded_batch(
+                        batch_size=batch_size,
+                        padded_shapes=window.output_shapes,
+                    ),
+                window_size_func=lambda batch_id: \
+                    tf.gather(window_sizes, batch_id),
+            )
+        )
+    dataset = dataset.prefetch(buffer_size=2)
+    iterator = dataset.make_initializable_iterator()
+    index, filename, tfrecord = iterator.get_next()
+
+    initializer = iterator.initializer
+
     pipeline = dict()
-    pipeline['nnet_input'] = batch['nnet_input']
-    pipeline['sequence_length'] = tf.cast(batch['sequence_length'], tf.int32)
-    pipeline['nnet_target'] = batch['nnet_target']
-    pipeline['target_length'] = tf.cast(batch['target_length'], tf.int32)
+    pipeline['index'] = index
+    pipeline['filename'] = filename
+    pipeline['nnet_input'] = tfrecord['nnet_input']
+    pipeline['sequence_length'] = tf.cast(tfrecord['sequence_length'], tf.int32)
 
     return initializer, pipeline
 
@@ -0,0 +1,63 @@
+# Copyright 2018 Mobvoi Inc.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#  http://www.apache.org/licenses/LICENSE-2.0
+# 
+# THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+
+
+#!/usr/bin/python2
+
+import numpy as np
+import tensorflow as tf
+
+
+class LSTMStreamer(object):
+    ''' LSTMStreamer runs a graph from create_graph_for_streaming() chunk by
+        chunk, keeping the lstm states of each stream between calls.
+    '''
+    def __init__(self, sess, graph, apply_softmax=True):
+        self.sess = sess
+        self.graph = graph
+        self.nnet_output = graph['nnet_output'] \
+                           if apply_softmax else graph['logits']
+        self.states = dict()
+
+    def _zero_states(self):
+        return [ tf.contrib.rnn.LSTMStateTuple(
+                     c=np.zeros([1, state.c.shape[1].value], np.float32),
+                     h=np.zeros([1, state.h.shape[1].value], np.float32),
+                 ) for state in self.graph['initial_states'] ]
+
+    def accept(self, stream_id, chunk):
+        ''' accept() feeds a (num_frames, dim) chunk of stream_id and returns
+            its (num_frames, num_targets) nnet output.
+        '''
+        states = self.states.get(stream_id)
+        if states is None:
+            states = self._zero_states()
+
+        feed_dict = dict()
+        feed_dict[self.graph['nnet_input']] = chunk[np.newaxis]
+        feed_dict[self.graph['sequence_length']] = [ chunk.shape[0] ]
+        for placeholder, value in zip(self.graph['initial_states'], states):
+            feed_dict[placeholder.c] = value.c
+            feed_dict[placeholder.h] = value.h
+
+        nnet_output, self.states[stream_id] = \
+            self.sess.run(
+                [ self.nnet_output, self.graph['final_states'] ],
+                feed_dict=feed_dict,
+            )
+        return nnet_output[0]
+
+    def finish(self, stream_id):
+        ''' finish() drops the states of stream_id.
+        '''
+        self.states.pop(stream_id, None)
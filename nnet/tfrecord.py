@@ -18,13 +18,21 @@
 #!/usr/bin/python2
 
 import math
-import random
+import numpy as np
+import os
 import sys
-import time
 import tensorflow as tf
 from operator import itemgetter
 
 
+# Record format versions stored in tfrecords.scp (format=<version>).
+#   1: tf.train.SequenceExample with one FloatList / Int64List per frame.
+#   2: tf.train.Example with the whole nnet_input as raw little-endian
+#      float32 bytes and nnet_target as raw little-endian int32 bytes.
+RECORD_FORMAT_SEQUENCE = 1
+RECORD_FORMAT_RAW = 2
+
+
 def _splice(nnet_input, left_context, right_context):
     res = []
     num_rows = tf.shape(nnet_input)[0]
@@ -51,47 +59,221 @@ def _subsample(nnet_input, factor):
     return subsampled_input
 
 
+def _postprocess(sequence, input_dim, left_context, right_context, subsample):
+    ''' _postprocess() splices and subsamples sequence['nnet_input'] of one
+        parsed utterance and adds its sequence_length (and target_length).
+    '''
+    if left_context or right_context:
+        sequence['nnet_input'] = _splice(sequence['nnet_input'], left_context, right_context)
+        sequence['nnet_input'].set_shape([None, input_dim * (1 + left_context + right_context)])
+
+    if subsample:
+        sequence['nnet_input'] = _subsample(sequence['nnet_input'], subsample)
+
+    sequence['sequence_length'] = tf.shape(sequence['nnet_input'])[0]
+    if 'nnet_target' in sequence:
+        sequence['target_length'] = tf.shape(sequence['nnet_target'])[0]
+
+    return sequence
+
+
+def splice_features(nnet_input, left_context, right_context):
+    ''' splice_features() is the numpy counterpart of _splice(), padding
+        with copies of the first and last frames.
+    '''
+    num_rows = nnet_input.shape[0]
+    padded_input = np.concatenate(
+                       [ nnet_input[:1] ] * left_context +
+                       [ nnet_input ] +
+                       [ nnet_input[-1:] ] * right_context
+                   )
+    return np.concatenate(
+               [ padded_input[i:i + num_rows]
+                 for i in xrange(left_context + right_context + 1) ],
+               axis=1,
+           )
+
+
+def subsample_features(nnet_input, factor):
+    ''' subsample_features() is the numpy counterpart of _subsample().
+    '''
+    return nnet_input[0:(nnet_input.shape[0] // factor) * factor:factor]
+
+
+def read_tfrecords_scp(tfrecords_scp):
+    ''' read_tfrecords_scp() parses tfrecords.scp into a list of entries.
+        Each line is either
+
+            <key> <num_rows> <num_cols> <has_label> <tfrecord> [options]
+
+        for one tfrecord file per utterance, or
+
+            <key> <num_rows> <num_cols> <has_label> <shard> <offset> <length> [options]
+
+        for utterances packed into shards, where <offset> is the byte offset
+        of the record in <shard> and <length> is the size of its payload.
+        Trailing options are <name>=<value> pairs: format=2 for the record
+        format version (1 if absent), and context=<left>,<right> and
+        subsample=<factor> for features spliced / subsampled at conversion
+        time, in which case <num_rows> and <num_cols> are the stored sizes.
+    '''
+    entries = []
+    for line in open(tfrecords_scp, 'r'):
+        token = line.rstrip().split()
+        if not token:
+            continue
+        location = [ t for t in token[4:] if '=' not in t ]
+        options = dict( t.split('=', 1) for t in token[4:] if '=' in t )
+        if len(token) < 5 or len(location) not in (1, 3):
+            log = 'invalid line in %s: \"%s\"' % (tfrecords_scp, line.rstrip())
+            tf.logging.fatal(log)
+            sys.exit(1)
+        entry = dict()
+        entry['key'] = token[0]
+        entry['num_rows'] = int(token[1])
+        entry['num_cols'] = int(token[2])
+        entry['has_label'] = int(token[3])
+        entry['tfrecord'] = location[0]
+        if len(location) == 3:
+            entry['offset'] = int(location[1])
+            entry['length'] = int(location[2])
+        else:
+            entry['offset'] = None
+            entry['length'] = None
+        entry['format'] = int(options.pop('format', RECORD_FORMAT_SEQUENCE))
+        entry['context'] = tuple( int(c) for c in
+                                  options.pop('context', '0,0').split(',') )
+        entry['subsample'] = int(options.pop('subsample', 0))
+        entry['options'] = options
+        entries.append(entry)
+    return entries
+
+
+def _sort_entries(entries):
+    ''' _sort_entries() returns (entries, shard_list), with entries in the
+        order dataset_from_tfrecords() reads them when not shuffling:
+        sharded records are read back in the order they were written, i.e.
+        by shard (in order of first appearance) and then by offset.
+        shard_list is None for per-utterance tfrecords.
+    '''
+    if not entries or entries[0]['offset'] is None:
+        return entries, None
+
+    shard_index = dict()
+    for entry in entries:
+        if entry['tfrecord'] not in shard_index:
+            shard_index[entry['tfrecord']] = len(shard_index)
+    entries = sorted(entries,
+                     key=lambda e: (shard_index[e['tfrecord']], e['offset']))
+    shard_list = sorted(shard_index.keys(), key=lambda s: shard_index[s])
+    return entries, shard_list
+
+
+def read_sequence_lengths(tfrecords_scp, subsample=0):
+    ''' read_sequence_lengths() returns the lengths of the sequences that
+        dataset_from_tfrecords() produces for tfrecords_scp, in the order it
+        produces them when not shuffling.
+    '''
+    entries, _ = _sort_entries(read_tfrecords_scp(tfrecords_scp))
+    sequence_lengths = []
+    for entry in entries:
+        if subsample and not entry['subsample']:
+            sequence_lengths.append(entry['num_rows'] // subsample)
+        else:
+            sequence_lengths.append(entry['num_rows'])
+    return sequence_lengths
+
+
 def dataset_from_tfrecords(tfrecords_scp,
                            left_context = 0,
                            right_context = 0,
                            subsample = 0,
                            shuffle = False,
                            seed = None,
-                           num_parallel_calls = 32):
-    tfrecord_list = []
-    input_dim = None
-    has_label = None
-    for line in open(tfrecords_scp, 'r'):
-        token = line.rstrip().split()
-        fid_ = token[0]
-        num_rows_ = int(token[1])
-        num_cols_ = int(token[2])
-        has_label_ = int(token[3])
-        tfrecord_ = token[4]
-        tfrecord_list.append(tfrecord_)
-        if input_dim is None:
-            input_dim = num_cols_
-        if has_label is None:
-            has_label = has_label_
-        if input_dim != num_cols_:
+                           num_parallel_calls = 32,
+                           num_parallel_reads = 8,
+                           shuffle_buffer = 1024):
+    ''' dataset_from_tfrecords() returns (key, tfrecord, input_dim), where
+        key is a dataset of utterance keys in the order the parsed sequences
+        come out of tfrecord (only meaningful when shuffle is False).
+
+        Per-utterance tfrecords are read num_parallel_reads files at a time.
+        Sharded tfrecords are streamed shard by shard; when shuffling, the
+        shard order is shuffled, num_parallel_reads shards are interleaved
+        and records are shuffled within a buffer of shuffle_buffer records.
+        Records are parsed with num_parallel_calls parallel calls. seed may
+        be a tf.int64 scalar tensor, so that re-initializing an iterator with
+        a different seed gives a different shuffle.
+
+        Features spliced / subsampled at conversion time are used as they
+        are, provided they match left_context, right_context and subsample.
+    '''
+    entries = read_tfrecords_scp(tfrecords_scp)
+    if not entries:
+        log = 'no tfrecords found in %s' % tfrecords_scp
+        tf.logging.fatal(log)
+        sys.exit(1)
+
+    input_dim = entries[0]['num_cols']
+    has_label = entries[0]['has_label']
+    record_format = entries[0]['format']
+    context = entries[0]['context']
+    stored_subsample = entries[0]['subsample']
+    sharded = entries[0]['offset'] is not None
+    for entry in entries:
+        if input_dim != entry['num_cols']:
             log = 'inconsistent nnet_input dimension in tfrecords:' + \
-                  ' %d vs. %d' % (input_dim, num_cols_)
+                  ' %d vs. %d' % (input_dim, entry['num_cols'])
             tf.logging.fatal(log)
             sys.exit(1)
-        if has_label != has_label_:
+        if has_label != entry['has_label']:
             log = 'inconsistent has_label in tfrecords:' + \
-                  ' %d vs. %d' % (has_label, has_label_)
+                  ' %d vs. %d' % (has_label, entry['has_label'])
+            tf.logging.fatal(log)
+            sys.exit(1)
+        if record_format != entry['format']:
+            log = 'inconsistent record format in tfrecords:' + \
+                  ' %d vs. %d' % (record_format, entry['format'])
+            tf.logging.fatal(log)
+            sys.exit(1)
+        if context != entry['context'] or \
+           stored_subsample != entry['subsample']:
+            log = 'inconsistent context / subsample in tfrecords:' + \
+                  ' %s / %d vs. %s / %d' % (str(context), stored_subsample,
+                                           str(entry['context']),
+                                           entry['subsample'])
+            tf.logging.fatal(log)
+            sys.exit(1)
+        if sharded != (entry['offset'] is not None):
+            log = 'mixed sharded and per-utterance tfrecords in %s' % \
+                  tfrecords_scp
+            tf.logging.fatal(log)
+            sys.exit(1)
+
+    if context != (0, 0) or stored_subsample:
+        if context != (left_context or 0, right_context or 0) or \
+           max(stored_subsample, 1) != max(subsample or 0, 1):
+            log = 'tfrecords in %s are spliced with context = %s and' % \
+                  (tfrecords_scp, str(context)) + \
+                  ' subsample = %d, but the nnet expects %s and %d' % \
+                  (stored_subsample, str((left_context, right_context)),
+                   subsample or 0)
             tf.logging.fatal(log)
             sys.exit(1)
+        # Already done at conversion time.
+        left_context = 0
+        right_context = 0
+        subsample = 0
 
-    if shuffle:
-        if seed is None:
-            seed = time.time()
-        random.seed(seed)
-        random.shuffle(tfrecord_list)
+    entries, shard_list = _sort_entries(entries)
+    key_list = [ entry['key'] for entry in entries ]
+    tfrecord_list = [ entry['tfrecord'] for entry in entries ]
 
     
     def _parse(example_proto):
+        if record_format == RECORD_FORMAT_RAW:
+            return _parse_raw(example_proto)
+
         sequence_features = dict()
 
         nnet_input = tf.FixedLenSequenceFeature(shape=[input_dim], dtype=tf.float32)
@@ -105,32 +287,71 @@ def dataset_from_tfrecords(tfrecords_scp,
                           example_proto, sequence_features=sequence_features
                       )
 
-        if left_context or right_context:
-            sequence['nnet_input'] = _splice(sequence['nnet_input'], left_context, right_context)
-            sequence['nnet_input'].set_shape([None, input_dim * (1 + left_context + right_context)])
-
-        if subsample:
-            sequence['nnet_input'] = _subsample(sequence['nnet_input'], subsample)
+        return _postprocess(sequence, input_dim,
+                            left_context, right_context, subsample)
 
-        sequence['sequence_length'] = tf.shape(sequence['nnet_input'])[0]
+    def _parse_raw(example_proto):
+        features = dict()
+        features['nnet_input'] = tf.FixedLenFeature([], dtype=tf.string)
         if has_label:
-            sequence['target_length'] = tf.shape(sequence['nnet_target'])[0]
+            features['nnet_target'] = tf.FixedLenFeature([], dtype=tf.string)
 
-        return sequence
+        example = tf.parse_single_example(example_proto, features=features)
 
-    filename = tf.data.Dataset.from_tensor_slices(tfrecord_list)
-    tfrecord = tf.data.TFRecordDataset(tfrecord_list).map(
-                              _parse, num_parallel_calls=num_parallel_calls)
+        sequence = dict()
+        nnet_input = tf.decode_raw(example['nnet_input'], tf.float32,
+                                   little_endian=True)
+        sequence['nnet_input'] = tf.reshape(nnet_input, [-1, input_dim])
+        if has_label:
+            nnet_target = tf.decode_raw(example['nnet_target'], tf.int32,
+                                        little_endian=True)
+            sequence['nnet_target'] = tf.cast(nnet_target, tf.int64)
+
+        return _postprocess(sequence, input_dim,
+                            left_context, right_context, subsample)
+
+    key = tf.data.Dataset.from_tensor_slices(key_list)
+    if sharded:
+        shards = tf.data.Dataset.from_tensor_slices(shard_list)
+        if shuffle:
+            shards = shards.shuffle(buffer_size=len(shard_list), seed=seed)
+        records = shards.apply(
+                      tf.contrib.data.parallel_interleave(
+                          tf.data.TFRecordDataset,
+                          cycle_length=num_parallel_reads if shuffle else 1,
+                          sloppy=shuffle,
+                          prefetch_input_elements=num_parallel_reads,
+                      )
+                  )
+        if shuffle:
+            records = records.shuffle(buffer_size=shuffle_buffer, seed=seed)
+    else:
+        # Each file holds a single record, so a deterministic interleave
+        # reads num_parallel_reads files at once and keeps the list order.
+        files = tf.data.Dataset.from_tensor_slices(tfrecord_list)
+        if shuffle:
+            files = files.shuffle(buffer_size=len(tfrecord_list), seed=seed)
+        records = files.apply(
+                      tf.contrib.data.parallel_interleave(
+                          tf.data.TFRecordDataset,
+                          cycle_length=num_parallel_reads,
+                          sloppy=False,
+                          prefetch_input_elements=num_parallel_reads,
+                      )
+                  )
+    tfrecord = records.map(_parse, num_parallel_calls=num_parallel_calls)
     input_dim *= (1 + left_context + right_context)
-    return filename, tfrecord, input_dim
+    return key, tfrecord, input_dim
+
 
+def serialize_tfrecord(nnet_input, nnet_target=None,
+                       record_format=RECORD_FORMAT_SEQUENCE):
+    if record_format == RECORD_FORMAT_RAW:
+        return _serialize_raw(nnet_input, nnet_target)
 
-def write_tfrecord(filename, nnet_input, nnet_target=None):
     num_rows = nnet_input.shape[0]
     num_cols = nnet_input.shape[1]
 
-    writer = tf.python_io.TFRecordWriter(filename)
-
     feature_list = dict()
 
     feature = [
@@ -152,10 +373,102 @@ def write_tfrecord(filename, nnet_input, nnet_target=None):
                   feature_lists=tf.train.FeatureLists(feature_list=feature_list)
               )
 
-    writer.write(example.SerializeToString())
+    return example.SerializeToString()
+
+
+def _serialize_raw(nnet_input, nnet_target=None):
+    num_rows = nnet_input.shape[0]
+    num_cols = nnet_input.shape[1]
+
+    feature = dict()
+    feature['nnet_input'] = tf.train.Feature(
+        bytes_list=tf.train.BytesList(
+            value=[np.ascontiguousarray(nnet_input, dtype='<f4').tobytes()]
+        )
+    )
+    feature['num_rows'] = tf.train.Feature(
+        int64_list=tf.train.Int64List(value=[num_rows])
+    )
+    feature['num_cols'] = tf.train.Feature(
+        int64_list=tf.train.Int64List(value=[num_cols])
+    )
+
+    if nnet_target is not None:
+        feature['nnet_target'] = tf.train.Feature(
+            bytes_list=tf.train.BytesList(
+                value=[np.ascontiguousarray(nnet_target, dtype='<i4').tobytes()]
+            )
+        )
+
+    example = tf.train.Example(features=tf.train.Features(feature=feature))
+
+    return example.SerializeToString()
+
+
+def write_tfrecord(filename, nnet_input, nnet_target=None,
+                   record_format=RECORD_FORMAT_SEQUENCE):
+    writer = tf.python_io.TFRecordWriter(filename)
+    writer.write(serialize_tfrecord(nnet_input, nnet_target, record_format))
     writer.close()
 
 
+class TFRecordShardWriter(object):
+    ''' TFRecordShardWriter packs serialized records into shard files
+        <tfrecords_dir>/<prefix>-<index>.tfrecords, starting a new shard once
+        the current one reaches shard_size bytes or shard_utterances records
+        (0 means no limit). Shards are numbered from 0, overwriting those of
+        an earlier run, unless skip_existing, where indices whose shard exists
+        are skipped, e.g. to keep the records an earlier run still refers to.
+    '''
+    def __init__(self, tfrecords_dir, prefix='shard',
+                 shard_size=0, shard_utterances=0, skip_existing=False):
+        self.tfrecords_dir = tfrecords_dir
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.shard_utterances = shard_utterances
+        self.skip_existing = skip_existing
+        self.index = 0
+        self.writer = None
+        self.shard = None
+        self.offset = 0
+        self.num_records = 0
+
+    def _next_shard(self):
+        self.close()
+        while True:
+            shard = '%s/%s-%05d.tfrecords' % \
+                    (self.tfrecords_dir, self.prefix, self.index)
+            self.index += 1
+            if not self.skip_existing or not os.path.exists(shard):
+                break
+        self.shard = shard
+        self.writer = tf.python_io.TFRecordWriter(shard)
+        self.offset = 0
+        self.num_records = 0
+
+    def write(self, record):
+        ''' write() appends one serialized record and returns
+            (shard, offset, length) for tfrecords.scp.
+        '''
+        if self.writer is None or \
+           (self.shard_size and self.offset >= self.shard_size) or \
+           (self.shard_utterances and \
+            self.num_records >= self.shard_utterances):
+            self._next_shard()
+        offset = self.offset
+        self.writer.write(record)
+        # Each record is framed by a uint64 length, a uint32 crc of the
+        # length, the payload and a uint32 crc of the payload.
+        self.offset += len(record) + 16
+        self.num_records += 1
+        return self.shard, offset, len(record)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
 if __name__=="__main__":
   tfrecord_scp = sys.argv[1]
   output=dataset_from_tfrecords(tfrecord_scp)
@@ -12,19 +12,27 @@
 # MERCHANTABLITY OR NON-INFRINGEMENT.
 
 
+from io_funcs import ClassifyRspecifier
 from io_funcs import LogError
 from io_funcs import LogInfo
 from io_funcs import LogWarning
+from io_funcs import RspecifierType
 from kaldi_io import DEVNULL
 from kaldi_io import Input
 from kaldi_io import Output
+from kaldi_holder import HolderType
+from kaldi_matrix import ReadMatrixShape
 from kaldi_table import BaseFloatMatrixWriter
 from kaldi_table import BaseFloatVectorWriter
 from kaldi_table import Int32VectorWriter
+from kaldi_table import MergeJoin
 from kaldi_table import RandomAccessFloatVectorReader
 from kaldi_table import RandomAccessInt32VectorReader
+from kaldi_table import RandomAccessPosteriorArrayReader
 from kaldi_table import RandomAccessPosteriorReader
+from kaldi_table import ReadKaldiObject
 from kaldi_table import SequentialBaseFloatMatrixReader
+from kaldi_table import SequentialInt32VectorReader
 from kaldi_table import SequentialNnetExampleReader
 from nnet_randomizer import FloatVectorRandomizer
 from nnet_randomizer import Int32VectorRandomizer
@@ -32,3 +40,4 @@ from nnet_randomizer import MatrixRandomizer
 from nnet_randomizer import NnetDataRandomizerOptions
 from nnet_randomizer import RandomizerMask
 from nnet_nnet1 import Nnet as Nnet1Nnet
+from nnet_lstm import Nnet as LstmNnet
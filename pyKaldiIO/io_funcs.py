@@ -15,6 +15,7 @@
 
 import inspect
 import logging
+import numpy
 import os
 import struct
 import sys
@@ -111,29 +112,20 @@ def ReadToken(stream, binary, remove_tail_space = True):
     Returns:
         A string read from the input stream.
     """
-    res = []
     if not binary :
         while True:
             c = stream.Peek(1)
             if not c:
-                return ''.join(res)
+                return ''
             if c == ' ' or c == '\n':
                 stream.Read(1)
             else:
                 break
-    while True:
-        c = stream.Peek(1)
-        if not c:
-            return ''.join(res)
-        if c == ' ' or c == '\n':
-            break
-        else:
-            res.append(c)
-            stream.Read(1)
+    res = stream.ReadWord()
     if remove_tail_space:
         if stream.Peek(1) == ' ':
             stream.Read(1)
-    return ''.join(res)
+    return res
 
 
 def ExpectToken(stream, binary, token):
@@ -163,6 +155,11 @@ def WriteToken(stream, binary, data):
     return True
 
 
+# Binary layout of an int32 written by WriteBasicType(), i.e. its size as a
+# char followed by the value.
+INT32_DTYPE = numpy.dtype([ ('size', 'i1'), ('value', '<i4') ])
+
+
 class BasicType(Enum):
     """Enumerations for basic types in C/C++.
     """
@@ -194,19 +191,20 @@ def ReadBasicType(stream, binary, ctype):
     if ctype == BasicType.notype:
         LogError('Invalid basic type \"%s\"' % ctype)
     if binary:
-        len_c_in = stream.Read(1)
         # TODO(cfyeh): implement other basic types.
         if ctype == BasicType.cint32:
-            res = struct.unpack('i', stream.Read(4))[0]
+            fmt = 'i'
         elif ctype == BasicType.cuint8:
-            res = struct.unpack('B', stream.Read(1))[0]
+            fmt = 'B'
         elif ctype == BasicType.cuint16:
-            res = struct.unpack('H', stream.Read(2))[0]
+            fmt = 'H'
         elif ctype == BasicType.cfloat:
-            res = struct.unpack('f', stream.Read(4))[0]
+            fmt = 'f'
         else:
             LogError('Type \"%s\" not implemented yet.' % ctype)
-        return res
+        # The size as a char, then the value, in one read.
+        data = stream.Read(1 + struct.calcsize(fmt))
+        return struct.unpack_from(fmt, data, 1)[0]
     else:
         # TODO(cfyeh): implement text mode.
         LogError('Text mode not implemented yet.')
@@ -216,6 +214,22 @@ def ReadInt32(stream, binary):
     return ReadBasicType(stream, binary, BasicType.cint32)
 
 
+def ReadInt32Array(stream, count):
+    """Read count int32s written by WriteBasicType() in one read.
+
+    Args:
+        stream: An opened KaldiInputStream.
+        count: The number of int32s.
+
+    Returns:
+        A numpy int32 array.
+    """
+    data = stream.ReadArray(INT32_DTYPE, count)
+    if (data['size'] != 4).any():
+        LogError('Expected int32s of size 4.')
+    return data['value'].astype(numpy.int32)
+
+
 def ReadUint8(stream, binary):
     return ReadBasicType(stream, binary, BasicType.cuint8)
 
@@ -328,6 +342,15 @@ class RspecifierOptions(object):
         self.background = False  # For sequential readers, if the background
                                  # option ("bg") is provided, it will read ahead
                                  # to the next object in a background thread.
+        self.reorder = False  # For sequential readers of scp files, if the
+                              # reorder option ("ro") is provided, objects
+                              # are read in the order of (archive, offset)
+                              # within a window of scp lines, and returned in
+                              # the order of the scp file.
+        self.index = False  # For random-access readers of archives in
+                            # regular files, if the index option ("idx") is
+                            # provided, the offsets of the keys are stored
+                            # in "<archive>.idx" and reused by later readers.
 
 
 class RspecifierType(Enum):
@@ -350,7 +373,8 @@ def ClassifyRspecifier(rspecifier):
     Note:
         We also allow the meaningless prefixes b, and t, plus the options
         o (once), no (not-once), s (sorted) and ns (not-sorted), p (permissive)
-        and np (not-permissive). So the following would be valid:
+        and np (not-permissive), and, unlike Kaldi, ro (reorder) and nro
+        (not-reorder). So the following would be valid:
 
         f, o, b, np, ark:rxfilename  ->  RspecifierType.kArchiveRspecifier
 
@@ -392,6 +416,14 @@ def ClassifyRspecifier(rspecifier):
             opts.called_sorted = False
         elif part == 'bg':
             opts.background = True
+        elif part == 'ro':
+            opts.reorder = True
+        elif part == 'nro':
+            opts.reorder = False
+        elif part == 'idx':
+            opts.index = True
+        elif part == 'nidx':
+            opts.index = False
         elif part == 'ark':
             if rspecifier_type == RspecifierType.kNoRspecifier:
                 rspecifier_type = RspecifierType.kArchiveRspecifier
@@ -474,6 +506,9 @@ class WspecifierOptions(object):
         self.binary = True
         self.flush = False
         self.permissive = False  # Will ignore absent scp entries.
+        self.background = False  # If the background option ("bg") is
+                                 # provided, the archive is written by a
+                                 # background thread.
 
 
 class WspecifierType(Enum):
@@ -507,6 +542,9 @@ def ClassifyWspecifier(wspecifier):
         ark,scp,f:filename, wxfilename ->  kBothWspecifier or:
         scp,t,nf:rxfilename -> kScriptWspecifier
 
+        Unlike Kaldi, the background option (bg) writes the archive in a
+        background thread: e.g. ark,bg:- -> kArchiveWspecifier
+
     Improperly formed Wspecifiers will be classified as WspecifierType.kNoWspecifier.
     """
     archive_filename = ''
@@ -529,6 +567,8 @@ def ClassifyWspecifier(wspecifier):
             opts.flush = False
         elif part == 'p':
             opts.permissive = True
+        elif part == 'bg':
+            opts.background = True
         elif part == 'ark':
             if wspecifier_type == WspecifierType.kNoWspecifier:
                 wspecifier_type = WspecifierType.kArchiveWspecifier
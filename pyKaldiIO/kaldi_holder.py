@@ -18,11 +18,13 @@ import numpy
 import struct
 from enum import Enum
 from io_funcs import BasicType
+from io_funcs import INT32_DTYPE
 from io_funcs import InitKaldiOutputStream
 from io_funcs import LogError
 from io_funcs import ReadBasicType
 from io_funcs import ReadFloat
 from io_funcs import ReadInt32
+from io_funcs import ReadInt32Array
 from io_funcs import ReadToken
 from io_funcs import WriteBasicType
 from kaldi_matrix import FloatMatrix
@@ -41,6 +43,97 @@ class HolderType(Enum):
     kPosteriorHolder = 3
     kInt32VectorHolder = 4
     kNnetExampleHolder = 5
+    kPosteriorArrayHolder = 6
+
+
+# Binary layout of a (label, posterior) pair of a Posterior, i.e. two basic
+# types written by WriteBasicType().
+POSTERIOR_PAIR_DTYPE = numpy.dtype([ ('label_size', 'i1'), ('label', '<i4'),
+                                     ('value_size', 'i1'), ('value', '<f4') ])
+
+
+def CheckBasicTypeSizes(data, *fields):
+    for field in fields:
+        if (data[field] != 4).any():
+            LogError('Expected basic types of size 4 in \"%s\".' % field)
+
+
+def ReadPosteriorArrays(stream, binary):
+    """Read a Posterior into flat arrays, the pairs of frame i being
+    labels[offsets[i]:offsets[i + 1]] and values[offsets[i]:offsets[i + 1]].
+
+    Args:
+        stream: An opened KaldiInputStream.
+        binary: If the input stream is in binary.
+
+    Returns:
+        (offsets, labels, values) as numpy int64, int32 and float32 arrays.
+    """
+    if not binary:
+        tokens = stream.Readline().split()
+        offsets = [ 0 ]
+        labels = []
+        values = []
+        i = 0
+        while i < len(tokens):
+            if tokens[i] != '[':
+                LogError('Expecting \"[\", got \"%s\" instead.' % tokens[i])
+            end = tokens.index(']', i)
+            labels.extend(tokens[i + 1:end:2])
+            values.extend(tokens[i + 2:end:2])
+            offsets.append(len(labels))
+            i = end + 1
+        return (numpy.asarray(offsets, numpy.int64),
+                numpy.asarray(labels, numpy.int32),
+                numpy.asarray(values, numpy.float32))
+
+    num_frames = ReadInt32(stream, binary)
+    if num_frames < 0 or num_frames > 10000000:
+        LogError('Got negative or improbably large size \"%d\"' % num_frames)
+    if num_frames == 0:
+        return (numpy.zeros(1, numpy.int64), numpy.zeros(0, numpy.int32),
+                numpy.zeros(0, numpy.float32))
+
+    # Posteriors of alignments have the same number of pairs in every frame,
+    # then the whole record is one array of frames, checked before it is
+    # consumed.
+    header = stream.Peek(INT32_DTYPE.itemsize)
+    if len(header) == INT32_DTYPE.itemsize:
+        num_pairs = int(numpy.frombuffer(bytearray(header),
+                                         INT32_DTYPE)[0]['value'])
+        if num_pairs > 0:
+            frame_dtype = numpy.dtype([ ('size', 'i1'), ('num_pairs', '<i4'),
+                                        ('pairs', POSTERIOR_PAIR_DTYPE,
+                                         (num_pairs,)) ])
+            data = stream.Peek(frame_dtype.itemsize * num_frames)
+            if len(data) == frame_dtype.itemsize * num_frames:
+                frames = numpy.frombuffer(bytearray(data), frame_dtype)
+                pairs = frames['pairs'].reshape(-1)
+                if (frames['size'] == 4).all() and \
+                   (frames['num_pairs'] == num_pairs).all() and \
+                   (pairs['label_size'] == 4).all() and \
+                   (pairs['value_size'] == 4).all():
+                    stream.Read(len(data))
+                    return (numpy.arange(num_frames + 1,
+                                         dtype=numpy.int64) * num_pairs,
+                            pairs['label'].astype(numpy.int32),
+                            pairs['value'].astype(numpy.float32))
+
+    offsets = numpy.zeros(num_frames + 1, numpy.int64)
+    labels = []
+    values = []
+    for i in xrange(num_frames):
+        num_pairs = ReadInt32(stream, binary)
+        if num_pairs < 0:
+            LogError('Got negative size \"%d\"' % num_pairs)
+        pairs = stream.ReadArray(POSTERIOR_PAIR_DTYPE, num_pairs)
+        CheckBasicTypeSizes(pairs, 'label_size', 'value_size')
+        labels.append(pairs['label'])
+        values.append(pairs['value'])
+        offsets[i + 1] = offsets[i] + num_pairs
+    return (offsets,
+            numpy.concatenate(labels).astype(numpy.int32),
+            numpy.concatenate(values).astype(numpy.float32))
 
 
 class FloatMatrixHolder(object):
@@ -102,41 +195,12 @@ class PosteriorHolder(object):
         Returns:
             An boolean variable indicating if the operation is successful.
         """
-        if binary:
-            sz = ReadInt32(stream, binary)
-            if sz < 0 or sz > 10000000:
-                LogError('Got negative or improbably large size \"%d\"' % sz)
-            self.value = []
-            for i in xrange(sz):
-                self.value.append([])
-                sz2 = ReadInt32(stream, binary)
-                if sz2 < 0:
-                    LogError('Got negative size \"%d\"' % sz2)
-                for j in xrange(sz2):
-                    lab = ReadInt32(stream, binary)
-                    val = ReadFloat(stream, binary)
-                    self.value[i].append((lab, val))
-        else:
-            line = stream.Readline()
-            tokens = line.rstrip().split()
-            i = 0
-            self.value = []
-            while True:
-                if i == len(tokens):
-                    break
-                if tokens[i] != '[':
-                    LogError('Expecting \"[\", got \"%s\" instead.'
-                             % tokens[i])
-                self.value.append([])
-                while True:
-                    i += 1
-                    if tokens[i] == ']':
-                        break;
-                    lab = int(tokens[i])
-                    i += 1
-                    val = float(tokens[i])
-                    self.value[-1].append((lab, val))
-                i += 1
+        offsets, labels, values = ReadPosteriorArrays(stream, binary)
+        labels = labels.tolist()
+        values = values.tolist()
+        self.value = [ zip(labels[offsets[i]:offsets[i + 1]],
+                           values[offsets[i]:offsets[i + 1]])
+                       for i in xrange(len(offsets) - 1) ]
         return True
 
     def Value(self):
@@ -155,6 +219,43 @@ class PosteriorHolder(object):
         return True
 
 
+class PosteriorArrayHolder(object):
+    """Like PosteriorHolder, but stores the posteriorgrams in flat numpy
+    arrays (offsets, labels, values) instead of lists of tuples, see
+    ReadPosteriorArrays().
+    """
+    def __init__(self):
+        self.value = None
+
+    def Read(self, stream, binary):
+        """Read posteriorgrams from the given stream.
+
+        Args:
+            stream: An opened KaldiInputStream.
+            binary: If the input stream is in binary.
+
+        Returns:
+            An boolean variable indicating if the operation is successful.
+        """
+        self.value = ReadPosteriorArrays(stream, binary)
+        return True
+
+    def Value(self):
+        """Return the stored (offsets, labels, values).
+        """
+        return self.value
+
+    def Clear(self):
+        """Clear the object.
+        """
+        del self.value
+        self.value = None
+        return True
+
+    def IsReadInBinary(self):
+        return True
+
+
 class BasicVectorHolder(object):
     """A wrapper to store basic type vectors and for I/O in Kaldi format.
     e.g. std::vector<BaseType> in C/C++, BasicType can be int32/float/...
@@ -173,7 +274,10 @@ class BasicVectorHolder(object):
         Returns:
             An boolean variable indicating if the operation is successful.
         """
-        if binary:
+        if binary and self.type == BasicType.cint32:
+            sz = ReadInt32(stream, binary)
+            self.value = ReadInt32Array(stream, sz)
+        elif binary:
             sz = ReadInt32(stream, binary)
             self.value = numpy.empty(sz, numpy.int32)
             for i in xrange(sz):
@@ -237,6 +341,8 @@ def NewHolderByType(holder_type):
         return BasicVectorHolder(BasicType.cint32)
     elif holder_type == HolderType.kNnetExampleHolder:
         return NnetExampleHolder()
+    elif holder_type == HolderType.kPosteriorArrayHolder:
+        return PosteriorArrayHolder()
     else:
         LogError('Unrecognized holder type \"%s\"' % holder_type)
 
@@ -244,10 +350,13 @@ def NewHolderByType(holder_type):
 def WriteInt32VectorToStream(stream, binary, value):
     InitKaldiOutputStream(stream, binary)
     if binary:
-        LogError('binary version not implemented yet.')
-        #WriteBasicType(stream, binary, BasicType.cint32, value.shape[0])
-        #val = value.tolist()
-        #stream.Write(struct.pack('%sd' % len(val), *val))
+        WriteBasicType(stream, binary, BasicType.cint32, value.shape[0])
+        # Each element is written like WriteBasicType(), i.e. its size as a
+        # char followed by the int32.
+        data = numpy.empty(value.shape[0], dtype=INT32_DTYPE)
+        data['size'] = 4
+        data['value'] = value
+        stream.Write(data.tobytes())
     else:
         for i in xrange(value.shape[0]):
             WriteBasicType(stream, binary, BasicType.cint32, value[i])
@@ -14,11 +14,16 @@
 
 #!/usr/bin/python2
 
-import cStringIO
+import Queue
+import collections
 import logging
+import mmap
+import numpy
 import os
+import stat
 import subprocess
 import sys
+import threading
 from io_funcs import ClassifyRxfilename
 from io_funcs import ClassifyWxfilename
 from io_funcs import InitKaldiInputStream
@@ -32,13 +37,125 @@ try:
 except ImportError:
     DEVNULL = open(os.devnull, 'wb')
 
+class PrefetchReader(object):
+    """A file-like object which reads the given pipe or file in a background
+    thread, keeping up to QUEUE_SIZE chunks of at most CHUNK_SIZE bytes read
+    ahead, so that the process writing to the pipe is not blocked while the
+    data already read is parsed.
+    """
+    CHUNK_SIZE = 1024 * 1024
+    QUEUE_SIZE = 16
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.queue = Queue.Queue(maxsize=self.QUEUE_SIZE)
+        self.chunk = ''
+        self.pos = 0
+        self.eof = False
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.ReaderThread)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def ReaderThread(self):
+        fd = self.stream.fileno()
+        try:
+            while not self.closed:
+                data = os.read(fd, self.CHUNK_SIZE)
+                if not data:
+                    break
+                self.Put(data)
+        except (IOError, OSError) as e:
+            self.error = e
+        self.Put('')  # End of stream.
+
+    def Put(self, data):
+        # Gives up once closed, as nobody is going to take from the queue.
+        while not self.closed:
+            try:
+                self.queue.put(data, timeout=1.0)
+                return
+            except Queue.Full:
+                pass
+
+    def NextChunk(self):
+        """Take the next chunk from the queue.
+
+        Returns:
+            False at the end of the stream.
+        """
+        if self.eof:
+            return False
+        data = self.queue.get()
+        if not data:
+            self.eof = True
+            if self.error is not None:
+                LogError('Failed reading in the background: %s' % self.error)
+            return False
+        self.chunk = data
+        self.pos = 0
+        return True
+
+    def read(self, size = -1):
+        res = []
+        while size != 0:
+            if self.pos == len(self.chunk) and not self.NextChunk():
+                break
+            end = len(self.chunk) if size < 0 else \
+                  min(len(self.chunk), self.pos + size)
+            res.append(self.chunk[self.pos:end])
+            if size > 0:
+                size -= end - self.pos
+            self.pos = end
+        return ''.join(res)
+
+    def read1(self, size = -1):
+        # At most the rest of one chunk, only blocks if there is none left.
+        if self.pos == len(self.chunk) and not self.NextChunk():
+            return ''
+        end = len(self.chunk) if size < 0 else \
+              min(len(self.chunk), self.pos + size)
+        res = self.chunk[self.pos:end]
+        self.pos = end
+        return res
+
+    def readline(self):
+        res = []
+        while True:
+            if self.pos == len(self.chunk) and not self.NextChunk():
+                break
+            end = self.chunk.find('\n', self.pos)
+            end = len(self.chunk) if end < 0 else end + 1
+            res.append(self.chunk[self.pos:end])
+            self.pos = end
+            if res[-1].endswith('\n'):
+                break
+        return ''.join(res)
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Queue.Empty:
+                break
+
+
 class KaldiInputStream(object):
     """A wrapper of input stream for Kaldi I/O, providing unified interface
-    for file/std/pipe inputs and support Peek().
+    for file/std/pipe inputs and support Peek(). The stream is read into a
+    bytearray in blocks of BLOCK_SIZE bytes, or in the chunks of the
+    PrefetchReader after StartReaderThread(), and consumed by moving a
+    cursor over it.
     """
+    BLOCK_SIZE = 1024 * 1024
+
     def __init__(self, stream = None):
         self.stream = None
         self.buffer = None
+        self.pos = 0
+        self.prefetch = None
         if stream:
            self.Open(stream)
 
@@ -46,58 +163,122 @@ class KaldiInputStream(object):
         if self.stream:
             self.Close()
         self.stream = stream
-        self.buffer = cStringIO.StringIO()
+        self.buffer = bytearray()
+        self.pos = 0
+        self.prefetch = None
 
     def Close(self):
+        if self.prefetch is not None:
+            self.prefetch.close()
+            self.prefetch = None
         if type(self.stream) is subprocess.Popen:
             self.stream.terminate()
         else:
             self.stream.close()
         self.stream = None
-        del self.buffer
         self.buffer = None
+        self.pos = 0
         return True
 
-    def Peek(self, size = 1):
-        oldpos = self.buffer.tell()
-        self.buffer.seek(0, os.SEEK_END)
-        endpos = self.buffer.tell()
-        diff = endpos - oldpos
-        if diff < size:
-            if type(self.stream) is subprocess.Popen:
-                contents = self.stream.stdout.read(size - diff)
+    def StartReaderThread(self):
+        """Read the stream ahead in a background thread, for pipes and the
+        standard input. Must be called before anything is read.
+        """
+        if self.prefetch is None:
+            self.prefetch = PrefetchReader(self.Source())
+
+    def Source(self):
+        """Return the file-like object to read from.
+        """
+        if self.prefetch is not None:
+            return self.prefetch
+        elif type(self.stream) is subprocess.Popen:
+            return self.stream.stdout
+        else:
+            return self.stream
+
+    def Fill(self, size):
+        """Make sure there are size bytes in the buffer after the cursor.
+
+        Returns:
+            False if the stream ends before that.
+        """
+        if len(self.buffer) - self.pos >= size:
+            return True
+        del self.buffer[:self.pos]
+        self.pos = 0
+        while len(self.buffer) < size:
+            if self.prefetch is not None:
+                data = self.prefetch.read1()
             else:
-                contents = self.stream.read(size - diff)
-            self.buffer.write(contents)
-        self.buffer.seek(oldpos)
-        res = self.buffer.read(size)
-        self.buffer.seek(oldpos)
+                data = self.Source().read(max(size - len(self.buffer),
+                                              self.BLOCK_SIZE))
+            if not data:
+                return False
+            self.buffer += data
+        return True
+
+    def Take(self, end):
+        """Consume the buffer up to end.
+        """
+        res = str(self.buffer[self.pos:end])
+        self.pos = end
+        return res
+
+    def Peek(self, size = 1):
+        self.Fill(size)
+        return str(self.buffer[self.pos:self.pos + size])
+
+    def ReadWord(self):
+        """Read up to, but not including, the next ' ' or '\\n'.
+        """
+        size = 0
+        while True:
+            if not self.Fill(size + 1):
+                return self.Take(len(self.buffer))
+            # Words are short, so only search a little further each time.
+            start = self.pos + size
+            stop = min(len(self.buffer), start + 64)
+            ends = [ self.buffer.find(c, start, stop) for c in ' \n' ]
+            ends = [ end for end in ends if end >= 0 ]
+            if ends:
+                return self.Take(min(ends))
+            size = stop - self.pos
+
+    def ReadArray(self, dtype, count):
+        """Read count elements of the given numpy dtype into a numpy array.
+        """
+        dtype = numpy.dtype(dtype)
+        size = dtype.itemsize * count
+        if not self.Fill(size):
+            LogError('Unexpected end of stream, expected %d bytes, got %d.'
+                     % (size, len(self.buffer) - self.pos))
+        if count == 0:
+            return numpy.empty(0, dtype)
+        # Copied, since the buffer is overwritten by the next Fill().
+        res = numpy.frombuffer(self.buffer, dtype, count, self.pos).copy()
+        self.pos += size
         return res
 
     def Read(self, size = None):
         """Read all contents from stream.
         """
         if size is None:
-            if type(self.stream) is subprocess.Popen:
-                return self.buffer.read() + self.stream.stdout.read()
-            else:
-                return self.buffer.read() + self.stream.read()
-        res = self.buffer.read(size)
-        if len(res) < size:
-            if type(self.stream) is subprocess.Popen:
-                res += self.stream.stdout.read(size - len(res))
-            else:
-                res += self.stream.read(size - len(res))
-        return res
+            while self.Fill(len(self.buffer) - self.pos + 1):
+                pass
+            return self.Take(len(self.buffer))
+        self.Fill(size)
+        return self.Take(min(len(self.buffer), self.pos + size))
 
     def Readline(self):
-        line = self.buffer.readline()
-        if not line.endswith('\n'):
-            if type(self.stream) is subprocess.Popen:
-                line += self.stream.stdout.readline()
-            else:
-                line += self.stream.readline()
-        return line
+        size = 0
+        while True:
+            end = self.buffer.find('\n', self.pos + size)
+            if end >= 0:
+                return self.Take(end + 1)
+            size = len(self.buffer) - self.pos
+            if not self.Fill(size + 1):
+                return self.Take(len(self.buffer))
 
     def Seek(self, offset):
         """Seek to the givne offset position for the stream, for files only.
@@ -111,24 +292,147 @@ class KaldiInputStream(object):
         if type(self.stream) is not file:
             LogError('stream type \"%s\" does not support seek()'
                      % type(self.stream))
-        if self.buffer:
-            del self.buffer
-        self.buffer = cStringIO.StringIO()
+        self.buffer = bytearray()
+        self.pos = 0
         if self.stream.tell() == offset:
             return True
         self.stream.seek(offset)
         return True
 
+    def Tell(self):
+        """Return the current offset position for the stream, for files only.
+        """
+        if type(self.stream) is not file:
+            LogError('stream type \"%s\" does not support tell()'
+                     % type(self.stream))
+        return self.stream.tell() - (len(self.buffer) - self.pos)
+
     def Eof(self):
-        return not self.Peek(1)
+        return not self.Fill(1)
+
+
+class MmapInputStream(object):
+    """A KaldiInputStream for regular files, which memory-maps the whole
+    file. Read() and Peek() slice the mapping directly, and ReadArray()
+    returns numpy arrays that are views into the mapping instead of copies.
+    """
+    def __init__(self, stream = None):
+        self.stream = None
+        self.mmap = None
+        self.pos = 0
+        if stream:
+           self.Open(stream)
+
+    def Open(self, stream):
+        if self.stream:
+            self.Close()
+        self.stream = stream
+        # ACCESS_COPY, so that the arrays returned by ReadArray() are writable
+        # like the ones from KaldiInputStream, without touching the file.
+        self.mmap = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_COPY)
+        self.pos = 0
+
+    def Close(self):
+        # The arrays returned by ReadArray() may still refer to the mapping,
+        # so it is not closed here, but unmapped once the last one is gone.
+        self.stream.close()
+        self.stream = None
+        self.mmap = None
+        return True
+
+    def Peek(self, size = 1):
+        return self.mmap[self.pos:self.pos + size]
+
+    def Read(self, size = None):
+        """Read all contents from stream.
+        """
+        end = len(self.mmap) if size is None else self.pos + size
+        res = self.mmap[self.pos:end]
+        self.pos += len(res)
+        return res
+
+    def Readline(self):
+        end = self.mmap.find('\n', self.pos)
+        end = len(self.mmap) if end < 0 else end + 1
+        return self.Read(end - self.pos)
+
+    def ReadWord(self):
+        """Read up to, but not including, the next ' ' or '\\n'.
+        """
+        end = len(self.mmap)
+        for c in (' ', '\n'):
+            pos = self.mmap.find(c, self.pos, end)
+            if pos >= 0:
+                end = pos
+        return self.Read(end - self.pos)
+
+    def ReadArray(self, dtype, count):
+        """Return a numpy array of count elements of the given dtype, which
+        is a view into the mapping.
+        """
+        dtype = numpy.dtype(dtype)
+        if self.pos + dtype.itemsize * count > len(self.mmap):
+            LogError('Unexpected end of stream, expected %d bytes, got %d.'
+                     % (dtype.itemsize * count, len(self.mmap) - self.pos))
+        res = numpy.frombuffer(self.mmap, dtype, count, self.pos)
+        self.pos += dtype.itemsize * count
+        return res
+
+    def Seek(self, offset):
+        """Seek to the givne offset position for the stream.
+
+        Args:
+            offset: The given offset.
+
+        Returns:
+            A boolean variable indicating if the operation is successful.
+        """
+        if offset < 0 or offset > len(self.mmap):
+            return False
+        self.pos = offset
+        return True
+
+    def Tell(self):
+        return self.pos
+
+    def Eof(self):
+        return self.pos >= len(self.mmap)
+
+
+def NewFileInputStream(stream):
+    """Return a MmapInputStream for regular files, and a KaldiInputStream
+    for the others, e.g. empty files, which can not be memory-mapped, or
+    named pipes.
+    """
+    st = os.fstat(stream.fileno())
+    if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+        try:
+            return MmapInputStream(stream)
+        except EnvironmentError as e:
+            LogWarning('Failed to mmap \"%s\", %s' % (stream.name, e))
+    return KaldiInputStream(stream)
 
 
 class KaldiOutputStream(object):
     """A wrapper of output stream for Kaldi I/O, providing unified interface
     for file/std/pipe outputs.
+
+    Small writes are gathered in a buffer of BUFFER_SIZE bytes, writes at
+    least that large go to the stream as they are. After StartWriterThread()
+    the stream is written by a background thread, so a slow consumer, e.g. a
+    decoder reading from a pipe, only blocks the writer once QUEUE_SIZE
+    buffers are pending.
     """
+    BUFFER_SIZE = 4 * 1024 * 1024
+    QUEUE_SIZE = 16
+
     def __init__(self, stream = None):
         self.stream = None
+        self.buffer = bytearray()
+        self.position = 0
+        self.queue = None
+        self.thread = None
+        self.error = None
         if stream:
            self.Open(stream)
 
@@ -136,8 +440,12 @@ class KaldiOutputStream(object):
         if self.stream:
             self.Close()
         self.stream = stream
+        self.buffer = bytearray()
+        self.position = 0
 
     def Close(self):
+        self.FlushBuffer()
+        self.StopWriterThread()
         if type(self.stream) is subprocess.Popen:
             self.stream.terminate()
         else:
@@ -146,19 +454,90 @@ class KaldiOutputStream(object):
         return True
 
     def Write(self, data):
-        if type(self.stream) is subprocess.Popen:
-            self.stream.stdin.write(data)
+        """Write a str, or any object with the buffer interface whose len()
+        is its size in bytes, e.g. numpy.ndarray.tobytes().
+        """
+        if len(self.buffer) + len(data) > self.BUFFER_SIZE:
+            self.FlushBuffer()
+        if len(data) >= self.BUFFER_SIZE:
+            self.WriteRaw(data)
         else:
-            self.stream.write(data)
+            self.buffer += data
+        self.position += len(data)
         return True
 
+    def Tell(self):
+        # Bytes written since Open(), i.e. the offset in a file opened for
+        # writing.
+        return self.position
+
     def Flush(self):
+        self.FlushBuffer()
+        if self.queue is not None:
+            self.queue.join()
+            self.CheckWriterThread()
         if type(self.stream) is subprocess.Popen:
             self.stream.stdin.flush()
         else:
             self.stream.flush()
         return True
 
+    def FlushBuffer(self):
+        if self.buffer:
+            # The writer thread may still hold the old buffer.
+            self.WriteRaw(self.buffer)
+            self.buffer = bytearray()
+
+    def WriteRaw(self, data):
+        if self.queue is not None:
+            self.CheckWriterThread()
+            self.queue.put(data)
+        elif type(self.stream) is subprocess.Popen:
+            self.stream.stdin.write(data)
+        else:
+            self.stream.write(data)
+
+    def StartWriterThread(self):
+        if self.thread is not None:
+            return
+        self.FlushBuffer()
+        self.queue = Queue.Queue(maxsize=self.QUEUE_SIZE)
+        self.thread = threading.Thread(target=self.WriterThread)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def StopWriterThread(self):
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.queue = None
+        self.thread = None
+        self.CheckWriterThread()
+
+    def WriterThread(self):
+        stream = self.stream.stdin if type(self.stream) is subprocess.Popen \
+                 else self.stream
+        while True:
+            data = self.queue.get()
+            try:
+                # After an error, keep draining the queue so that the
+                # caller never blocks on it.
+                if data is not None and self.error is None:
+                    stream.write(data)
+            except (IOError, OSError) as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+            if data is None:
+                break
+
+    def CheckWriterThread(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            LogError('Failed writing in the background: %s' % error)
+
 
 class FileInputImpl(object):
     """Implementation for regular file inputs, such as feats.scp/feats.ark.
@@ -183,7 +562,7 @@ class FileInputImpl(object):
         mode = 'rt'
         if binary:
             mode = 'rb'
-        self.stream = KaldiInputStream(open(rxfilename, mode))
+        self.stream = NewFileInputStream(open(rxfilename, mode))
         return True
 
     def Stream(self):
@@ -219,6 +598,7 @@ class StandardInputImpl(object):
         if self.stream:
             LogError('Called on already open file.')
         self.stream = KaldiInputStream(sys.stdin)
+        self.stream.StartReaderThread()
         return True
 
     def Stream(self):
@@ -267,6 +647,7 @@ class PipeInputImpl(object):
                                                  stderr=stderr))
             stdin = self.process[-1].stdout
         self.stream = KaldiInputStream(self.process[-1])
+        self.stream.StartReaderThread()
         return True
 
     def Stream(self):
@@ -285,12 +666,19 @@ class PipeInputImpl(object):
 
 class OffsetFileInputImpl(object):
     """Implementation for file inputs with offset, such as file.ark:123.
+
+    An scp usually points into a few archives, so the streams of the last
+    MAX_OPEN_FILES files are kept open, and opening an offset in one of them
+    is only a seek.
     """
+    MAX_OPEN_FILES = 64
+
     def __init__(self) :
         self.stream = None
         self.filename = None
         self.offset = None
         self.binary = None
+        self.streams = collections.OrderedDict()  # (filename, binary) -> stream
 
     def Open(self, rxfilename, binary):
         """Open a KaldiInputStream for the given filename and offset.
@@ -303,19 +691,19 @@ class OffsetFileInputImpl(object):
             A boolean variable indicating if the operation is successful.
         """
         (filename, offset) = self.SplitFilename(rxfilename)
-        if self.stream:
-            if self.filename == filename and self.binary == binary:
-                if not self.Seek(offset):
-                    LogError('Invalid offset = \"%d\"' % offset)
-                return True
-            else:
-                self.Close()
+        stream = self.streams.pop((filename, binary), None)
+        if stream is None:
+            mode = 'rt'
+            if binary:
+                mode = 'rb'
+            stream = NewFileInputStream(open(filename, mode))
+            if len(self.streams) >= self.MAX_OPEN_FILES:
+                _, oldest = self.streams.popitem(last=False)
+                oldest.Close()
+        self.streams[(filename, binary)] = stream
+        self.stream = stream
         self.filename = filename
         self.binary = binary
-        mode = 'rt'
-        if binary:
-            mode = 'rb'
-        self.stream = KaldiInputStream(open(self.filename, mode))
         if not self.Seek(offset):
             LogError('Invalid offset = \"%d\"' % offset)
         return True
@@ -328,7 +716,11 @@ class OffsetFileInputImpl(object):
     def Close(self):
         if not self.stream:
             LogError('File is not opened.')
-        return self.stream.Close()
+        for stream in self.streams.values():
+            stream.Close()
+        self.streams.clear()
+        self.stream = None
+        return True
 
     def MyType(self):
         return InputType.kOffsetFileInput
@@ -567,7 +959,7 @@ class Output(object):
             if not self.Open(wxfilename, binary, write_header):
                 LogError('Failed opening output stream')
 
-    def Open(self, wxfilename, binary, header = False):
+    def Open(self, wxfilename, binary, header = False, background = False):
         if self.IsOpen():
             if not self.Close():
                 LogError('failed to close output stream')
@@ -586,6 +978,8 @@ class Output(object):
             self.impl = None
             return False
         else:
+            if background:
+                self.impl.Stream().StartWriterThread()
             if header:
                 InitKaldiOutputStream(self.impl.Stream(), binary)
             return True
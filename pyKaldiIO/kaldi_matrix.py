@@ -24,6 +24,7 @@ from io_funcs import LogError
 from io_funcs import ReadBasicType
 from io_funcs import ReadFloat
 from io_funcs import ReadInt32
+from io_funcs import ReadInt32Array
 from io_funcs import ReadToken
 from io_funcs import WriteBasicType
 
@@ -36,35 +37,37 @@ class GlobalHeader(object):
         self.num_cols = None  # int32
 
 
-class PerColHeader(object):
-    def __init__(self):
-        self.percentile_0 = None  # uint16
-        self.percentile_25 = None  # uint16
-        self.percentile_75 = None  # uint16
-        self.percentile_100 = None  # uint16
-
+# The arithmetic below follows the types and order of Kaldi's
+# compressed-matrix.cc, so that the results are bit-exact. In CharToFloat()
+# the constants (1/64.0), (1/128.0) and (1/63.0) are doubles there: the
+# difference of percentiles times the byte is float, while the last multiply
+# and the add are in double, rounded to float once on return.
 
 def CharToFloat(p0, p25, p75, p100, value):
+    value = numpy.float32(value)
     if value <= 64:
-        return p0 + (p25 - p0) * value * (1/64.0)
+        return numpy.float32(float(p0) +
+                             float((p25 - p0) * value) * (1/64.0))
     elif value <= 192:
-        return p25 + (p75 - p25) * (value - 64) * (1/128.0)
+        return numpy.float32(float(p25) +
+                             float((p75 - p25) * (value - 64)) * (1/128.0))
     else:
-        return p75 + (p100 - p75) * (value - 192) * (1/63.0)
+        return numpy.float32(float(p75) +
+                             float((p100 - p75) * (value - 192)) * (1/63.0))
 
 
 def Uint16ToFloat(global_header, value):
   # the constant 1.52590218966964e-05 is 1/65535.
-  return global_header.min_value + \
-      global_header.range * 1.52590218966964e-05 * value
+  return numpy.float32(global_header.min_value) + \
+      numpy.float32(global_header.range) * \
+      numpy.float32(1.52590218966964e-05) * numpy.float32(value)
 
 
 class CompressedMatrix(object):
     def __init__(self):
         self.global_header = None
-        self.percol_header = None
-        self.data = None  # a 1-D array [ [col1] [col2] [col3] ... ]
-                          # mat(i, j) = data[j * rows + i]
+        self.percol_header = None  # [ cols x 4 ] uint16 percentiles, CM only.
+        self.data = None  # [ rows x cols ] uint8 for CM / CM3, uint16 for CM2.
 
     def Read(self, stream, binary):
         if binary:
@@ -75,33 +78,25 @@ class CompressedMatrix(object):
                 self.global_header.format = 1
             elif token == 'CM2':
                 self.global_header.format = 2
+            elif token == 'CM3':
+                self.global_header.format = 3
             else:
-                LogError('Unexpected token \"%s\", expecting CM or CM2.'
+                LogError('Unexpected token \"%s\", expecting CM, CM2 or CM3.'
                          % token)
-            data = struct.unpack('f'*2, stream.Read(4*2))
+            data = struct.unpack('ffii', stream.Read(4*4))
             self.global_header.min_value = data[0]
             self.global_header.range = data[1]
-            data = struct.unpack('i'*2, stream.Read(4*2))
-            self.global_header.num_rows = data[0]
-            self.global_header.num_cols = data[1]
+            self.global_header.num_rows = data[2]
+            self.global_header.num_cols = data[3]
             rows = self.global_header.num_rows
             cols = self.global_header.num_cols
-            if self.global_header.format == 1:  # num_rows > 8, in CM1 format.
-                self.percol_header = []
-                data = numpy.frombuffer(bytearray(stream.Read(2*4*cols)),
-                                        numpy.uint16).reshape(cols, 4)
-                for c in xrange(cols):
-                    percol_header = PerColHeader()
-                    percol_header.percentile_0 = data[c, 0]
-                    percol_header.percentile_25 = data[c, 1]
-                    percol_header.percentile_75 = data[c, 2]
-                    percol_header.percentile_100 = data[c, 3]
-                    self.percol_header.append(percol_header)
-                self.data = numpy.frombuffer(bytearray(stream.Read(rows*cols)),
-                                             numpy.uint8).reshape(cols, rows).transpose()
-            elif self.global_header.format == 2:  # num_rows <= 8, in CM2 format.
-                self.data = numpy.frombuffer(bytearray(stream.Read(2*rows*cols)),
-                                             numpy.uint16).reshape(rows, cols)
+            if self.global_header.format == 1:  # one byte with column headers.
+                self.percol_header = stream.ReadArray(numpy.uint16, 4*cols).reshape(cols, 4)
+                self.data = stream.ReadArray(numpy.uint8, rows*cols).reshape(cols, rows).transpose()
+            elif self.global_header.format == 2:  # two bytes.
+                self.data = stream.ReadArray(numpy.uint16, rows*cols).reshape(rows, cols)
+            elif self.global_header.format == 3:  # one byte.
+                self.data = stream.ReadArray(numpy.uint8, rows*cols).reshape(rows, cols)
             else:
                 LogError('Unrecognized format = %s' % self.global_header.format)
         else:
@@ -110,31 +105,91 @@ class CompressedMatrix(object):
                      'use text format, please use \'copy-feats\' in kaldi '
                      'to convert it to binary.')
 
+    def Increment(self):
+        # The step of CM2 / CM3, rounded to float from double like in Kaldi.
+        if self.global_header.format == 2:
+            return numpy.float32(self.global_header.range * (1.0 / 65535.0))
+        else:
+            return numpy.float32(self.global_header.range * (1.0 / 255.0))
+
     def GetNumpyMatrix(self):
+        """Return the decompressed float32 matrix.
+
+        For CM, each column has only 256 possible values, so they are
+        computed once per column and looked up by the bytes of the column.
+        """
+        if self.global_header.format == 1:
+            cols = self.global_header.num_cols
+            percentiles = Uint16ToFloat(self.global_header,
+                                        self.percol_header.astype(numpy.float32))
+            p0, p25, p75, p100 = [ percentiles[:, i] for i in xrange(4) ]
+            value = numpy.arange(256, dtype=numpy.float32)[:, None]
+            # Products in float32, the rest in float64, see CharToFloat().
+            table = numpy.where(
+                value <= 64,
+                p0 + ((p25 - p0) * value).astype(numpy.float64) * (1/64.0),
+                numpy.where(
+                    value <= 192,
+                    p25 + ((p75 - p25) * (value - 64)).astype(numpy.float64) * (1/128.0),
+                    p75 + ((p100 - p75) * (value - 192)).astype(numpy.float64) * (1/63.0)))
+            table = table.astype(numpy.float32)
+            return table[self.data, numpy.arange(cols)]
+        elif self.global_header.format == 2 or self.global_header.format == 3:
+            return numpy.float32(self.global_header.min_value) + \
+                self.data.astype(numpy.float32) * self.Increment()
+        else:
+            LogError('Unrecognized format = %s' % self.global_header.format)
+
+    def GetNumpyMatrixElementwise(self):
+        """GetNumpyMatrix() one element at a time, the way Kaldi does it.
+        Only for reference, it is orders of magnitude slower.
+        """
         rows = self.global_header.num_rows
         cols = self.global_header.num_cols
-        mat = numpy.empty([rows, cols], dtype=float, order='C')
+        mat = numpy.empty([rows, cols], dtype=numpy.float32, order='C')
         if self.global_header.format == 1:
             for c in xrange(cols):
-                p0 = Uint16ToFloat(self.global_header,
-                                   self.percol_header[c].percentile_0)
-                p25 = Uint16ToFloat(self.global_header,
-                                    self.percol_header[c].percentile_25)
-                p75 = Uint16ToFloat(self.global_header,
-                                    self.percol_header[c].percentile_75)
-                p100 = Uint16ToFloat(self.global_header,
-                                     self.percol_header[c].percentile_100)
+                p0 = Uint16ToFloat(self.global_header, self.percol_header[c, 0])
+                p25 = Uint16ToFloat(self.global_header, self.percol_header[c, 1])
+                p75 = Uint16ToFloat(self.global_header, self.percol_header[c, 2])
+                p100 = Uint16ToFloat(self.global_header, self.percol_header[c, 3])
                 for r in xrange(rows):
                     mat[r, c] = CharToFloat(p0, p25, p75, p100, self.data[r, c])
-        elif self.global_header.format == 2:
+        elif self.global_header.format == 2 or self.global_header.format == 3:
+            min_value = numpy.float32(self.global_header.min_value)
+            increment = self.Increment()
             for r in xrange(rows):
                 for c in xrange(cols):
-                    mat[r, c] = Uint16ToFloat(self.global_header, self.data[r, c])
+                    mat[r, c] = min_value + numpy.float32(self.data[r, c]) * increment
         else:
             LogError('Unrecognized format = %s' % self.global_header.format)
         return mat
 
 
+def ReadMatrixShape(stream, binary):
+    """Read the header of a float matrix, or a compressed one, without its
+    data, e.g. to get the number of frames of features.
+
+    Args:
+        stream: An opened KaldiInputStream.
+        binary: If the input stream is in binary.
+
+    Returns:
+        (rows, cols) of the matrix.
+    """
+    if not binary:
+        LogError('Text mode not implemented yet.')
+    token = ReadToken(stream, binary)
+    if token == 'FM':
+        rows, cols = ReadInt32Array(stream, 2).tolist()
+    elif token == 'CM' or token == 'CM2' or token == 'CM3':
+        _, _, rows, cols = struct.unpack('ffii', stream.Read(4*4))
+    else:
+        LogError('Unexpected token \"%s\", expecting FM, CM, CM2 or CM3.'
+                 % token)
+    return rows, cols
+
+
 class FloatMatrix(object):
     """A wrapper of numpy matrix for I/O in Kaldi format.
     """
@@ -167,10 +222,8 @@ class FloatMatrix(object):
                 if token != expect_token:
                     LogError('Expect token \"%s\", got \"%s\"'
                              % (expect_token, token))
-                rows = ReadInt32(stream, binary)
-                cols = ReadInt32(stream, binary)
-                data = stream.Read(4*(rows*cols))
-                self.value = numpy.frombuffer(bytearray(data), numpy.float32).reshape(rows, cols)
+                rows, cols = ReadInt32Array(stream, 2).tolist()
+                self.value = stream.ReadArray(numpy.float32, rows*cols).reshape(rows, cols)
             else:
                 LogError('Unrecognized flag \"%s\"' % peekval)
         else:
@@ -226,8 +279,7 @@ class FloatVector(object):
                     LogError('Expect token \"%s\", got \"%s\"'
                              % (expect_token, token))
                 size = ReadInt32(stream, binary)
-                data = stream.Read(4*size)
-                self.value = numpy.frombuffer(bytearray(data), numpy.float32)
+                self.value = stream.ReadArray(numpy.float32, size)
             else:
                 LogError('Unrecognized flag \"%s\"' % peekval)
         else:
@@ -284,8 +336,7 @@ def WriteFloatMatrixToStream(stream, binary, value):
         stream.Write('%s ' % my_token)
         WriteBasicType(stream, binary, BasicType.cint32, value.shape[0])
         WriteBasicType(stream, binary, BasicType.cint32, value.shape[1])
-        for row in value.tolist():
-            stream.Write(struct.pack('%sf' % len(row), *row))
+        stream.Write(numpy.ascontiguousarray(value, dtype='<f4').tobytes())
     else:
         if not value.shape[0] or not value.shape[1]:
             stream.Write(' []\n')
@@ -305,8 +356,7 @@ def WriteFloatVectorToStream(stream, binary, value):
         my_token = 'FV'
         stream.Write('%s ' % my_token)
         WriteBasicType(stream, binary, BasicType.cint32, value.shape[0])
-        val = value.tolist()
-        stream.Write(struct.pack('%sf' % len(val), *val))
+        stream.Write(numpy.ascontiguousarray(value, dtype='<f4').tobytes())
     else:
         if not value.shape[0]:
             stream.Write(' []\n')
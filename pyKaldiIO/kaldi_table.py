@@ -15,15 +15,21 @@
 #!/usr/bin/python2
 
 import bisect
+import collections
 import logging
 import kaldi_holder
 import kaldi_io
+import os
 from enum import Enum
 from io_funcs import ClassifyRspecifier
+from io_funcs import ClassifyRxfilename
 from io_funcs import ClassifyWspecifier
+from io_funcs import ClassifyWxfilename
 from io_funcs import InitKaldiInputStream
+from io_funcs import InputType
 from io_funcs import LogError
 from io_funcs import LogWarning
+from io_funcs import OutputType
 from io_funcs import ReadToken
 from io_funcs import RspecifierType
 from io_funcs import WspecifierType
@@ -409,6 +415,167 @@ class SequentialTableReaderScriptImpl(object):
         return True
 
 
+class SequentialTableReaderReorderedScriptImpl(object):
+    """SequentialTableReaderReorderedScriptImpl is used instead of
+    SequentialTableReaderScriptImpl with the reorder (ro) option. It reads
+    WINDOW_SIZE scp lines ahead and loads their objects in the order of
+    (archive, offset), so that each archive is read forward even if the scp
+    is shuffled, then returns them in the order of the scp. Up to WINDOW_SIZE
+    objects are held in memory.
+    """
+    WINDOW_SIZE = 256
+
+    def __init__(self, holder_type):
+        """Initialize the reader for the given holder type.
+
+        Args:
+            holder_type: The given holder type.
+        """
+        self.rspecifier = None
+        self.opts = None
+        self.script_rxfilename = None
+        self.script_input = Input()
+        self.data_input = Input()
+        self.type = holder_type
+        self.window = collections.deque()  # (key, holder) in scp order.
+        self.state = SequentialTableReaderStateType.kUninitialized
+
+    def Open(self, rspecifier):
+        """Open a reader for the given rspecifier.
+
+        Args:
+            rspecifier: The given rspecifier.
+
+        Returns:
+            A boolean variable indicating if the operation is successful.
+        """
+        if self.state != SequentialTableReaderStateType.kUninitialized and \
+           self.state != SequentialTableReaderStateType.kError:
+            if not self.Close():
+                LogError('Error closing previous input, rspecifier was \"%s\"'
+                         % self.rspecifier)
+        self.rspecifier = rspecifier
+        (rspecifier_type, rxfilename, opts) = ClassifyRspecifier(rspecifier)
+        self.script_rxfilename = rxfilename
+        self.opts = opts
+        if rspecifier_type != RspecifierType.kScriptRspecifier:
+            LogError('Invalid rspecifier type \"%s\"' % rspecifier_type)
+        self.script_input = Input()
+        if not self.script_input.Open(self.script_rxfilename):
+            LogError('Failed opening script file \"%s\"'
+                     % self.script_rxfilename)
+        if self.script_input.IsBinary():
+            self.SetErrorState()
+            LogError('script file should not be in binary format.')
+        self.state = SequentialTableReaderStateType.kFileStart
+        self.FillWindow()
+        return True
+
+    def IsOpen(self):
+        if self.state == SequentialTableReaderStateType.kEof or \
+           self.state == SequentialTableReaderStateType.kHaveObject:
+            return True
+        elif self.state == SequentialTableReaderStateType.kUninitialized or \
+             self.state == SequentialTableReaderStateType.kError:
+            return False
+        else:
+            LogError('Invalid state \"%s\"' % self.state)
+
+    def Done(self):
+        if self.state == SequentialTableReaderStateType.kHaveObject:
+            return False
+        elif self.state == SequentialTableReaderStateType.kEof or \
+             self.state == SequentialTableReaderStateType.kError:
+            return True
+        else:
+            LogError('Invalid state \"%s\"' % self.state)
+
+    def Key(self):
+        if self.state != SequentialTableReaderStateType.kHaveObject:
+            LogError('Invalid state \"%s\"' % self.state)
+        return self.window[0][0]
+
+    def Value(self):
+        if self.state != SequentialTableReaderStateType.kHaveObject:
+            LogError('Invalid state \"%s\"' % self.state)
+        return self.window[0][1].Value()
+
+    def Next(self):
+        if self.state != SequentialTableReaderStateType.kHaveObject:
+            LogError('Invalid state \"%s\"' % self.state)
+        self.window.popleft()
+        if not self.window:
+            self.FillWindow()
+
+    def Close(self):
+        if not self.IsOpen():
+            LogError('Called on input that was not open.')
+        if self.script_input.IsOpen():
+            self.script_input.Close()
+        if self.data_input.IsOpen():
+            self.data_input.Close()
+        self.window.clear()
+        self.state = SequentialTableReaderStateType.kUninitialized
+        return True
+
+    def SetErrorState(self):
+        self.state = SequentialTableReaderStateType.kError
+        self.script_input.Close()
+        self.data_input.Close()
+        self.window.clear()
+        return True
+
+    def FillWindow(self):
+        """Read the next window of scp lines and load their objects, leaves
+        the state in kHaveObject, or kEof at the end of the scp.
+        """
+        while not self.window and self.script_input.IsOpen():
+            entries = []
+            while len(entries) < self.WINDOW_SIZE:
+                line = self.script_input.Stream().Readline()
+                if not line:
+                    self.script_input.Close()
+                    break
+                token = line.rstrip().split()
+                if len(token) != 2:
+                    LogError('Invalid line \"%s\"' % line)
+                if token[1].endswith(']'):
+                    LogError('Range specifier support not implemented yet.')
+                entries.append((token[0], token[1]))
+            holders = [ None ] * len(entries)
+            order = sorted(xrange(len(entries)),
+                           key=lambda i: self.SortKey(entries[i][1]))
+            for i in order:
+                holder = NewHolderByType(self.type)
+                if self.LoadObject(entries[i][1], holder):
+                    holders[i] = holder
+                elif not self.opts.permissive:
+                    LogError('Failed to load object from \"%s\" to suppress '
+                             'this error, add the permissive (p, ) option to '
+                             'the rspecifier.' % entries[i][1])
+            for (key, _), holder in zip(entries, holders):
+                if holder is not None:
+                    self.window.append((key, holder))
+        if self.window:
+            self.state = SequentialTableReaderStateType.kHaveObject
+        else:
+            self.state = SequentialTableReaderStateType.kEof
+            if self.data_input.IsOpen():
+                self.data_input.Close()
+
+    def LoadObject(self, data_rxfilename, holder):
+        if not self.data_input.Open(data_rxfilename):
+            return False
+        return holder.Read(self.data_input.Stream(),
+                           self.data_input.IsBinary())
+
+    def SortKey(self, data_rxfilename):
+        if ClassifyRxfilename(data_rxfilename) == InputType.kOffsetFileInput:
+            pos = data_rxfilename.rfind(':')
+            return (data_rxfilename[:pos], int(data_rxfilename[pos + 1:]))
+        return (data_rxfilename, 0)
+
+
 class SequentialTableReader(object):
     def __init__(self, rspecifier = None, holder_type = HolderType.kNoHolder):
         self.impl = None
@@ -424,6 +591,9 @@ class SequentialTableReader(object):
         (rspecifier_type, rxfilename, opts) = ClassifyRspecifier(rspecifier)
         if rspecifier_type == RspecifierType.kArchiveRspecifier:
             self.impl = SequentialTableReaderArchiveImpl(holder_type)
+        elif rspecifier_type == RspecifierType.kScriptRspecifier and \
+             opts.reorder:
+            self.impl = SequentialTableReaderReorderedScriptImpl(holder_type)
         elif rspecifier_type == RspecifierType.kScriptRspecifier:
             self.impl = SequentialTableReaderScriptImpl(holder_type)
         else:
@@ -469,6 +639,65 @@ class SequentialTableReader(object):
                      'passed the empty string as an argument to a program?).')
 
 
+def MergeJoin(first, second):
+    """Iterate over two SequentialTableReaders of archives sorted by key, e.g.
+    features and labels, in one forward pass over both.
+
+    Args:
+        first: A SequentialTableReader.
+        second: A SequentialTableReader.
+
+    Yields:
+        (key, first value, second value) for every key of first, where the
+        second value is None if second does not have the key.
+    """
+    first_key = None
+    second_key = None
+    while not first.Done():
+        key = first.Key()
+        if first_key is not None and key <= first_key:
+            LogError('Keys are not sorted: \"%s\" follows \"%s\".'
+                     % (key, first_key))
+        first_key = key
+        while not second.Done() and second.Key() < key:
+            if second_key is not None and second.Key() <= second_key:
+                LogError('Keys are not sorted: \"%s\" follows \"%s\".'
+                         % (second.Key(), second_key))
+            second_key = second.Key()
+            second.Next()
+        value = None
+        if not second.Done() and second.Key() == key:
+            value = second.Value()
+        yield (key, first.Value(), value)
+        first.Next()
+
+
+def ReadKaldiObject(rxfilename, holder_type, data_input = None):
+    """Read the single object at rxfilename, e.g. "feats.ark:123" of an scp,
+    like ReadKaldiObject() in Kaldi.
+
+    Args:
+        rxfilename: The given rxfilename.
+        holder_type: The holder type of the object.
+        data_input: An Input to read with, so that the archives it has open
+            are reused, or None.
+
+    Returns:
+        The object read.
+    """
+    owned = data_input is None
+    if owned:
+        data_input = Input()
+    if not data_input.Open(rxfilename):
+        LogError('Failed to open file \"%s\"' % rxfilename)
+    holder = NewHolderByType(holder_type)
+    if not holder.Read(data_input.Stream(), data_input.IsBinary()):
+        LogError('Failed to load object from \"%s\"' % rxfilename)
+    if owned:
+        data_input.Close()
+    return holder.Value()
+
+
 class RandomAccessTableReaderStateType(Enum):
     """Enumerations for RandomAccessTableReader state types.
     """
@@ -553,6 +782,10 @@ class RandomAccessTableReaderArchiveImplBase(object):
         else:
             LogError('Invalid state \"%s\"' % self.state)
 
+    def Rxfilename(self, key):
+        # Objects are only addressable by offset in archives of regular files.
+        return None
+
     def CloseInternal(self):
         """Called by the child-class virutal Close() functions, does the shared
         parts of the cleanup.
@@ -667,6 +900,283 @@ class RandomAccessTableReaderUnsortedArchiveImpl(
                               # state) and didn't find it.
 
 
+class RandomAccessTableReaderSortedArchiveImpl(
+          RandomAccessTableReaderArchiveImplBase):
+    """RandomAccessTableReaderSortedArchiveImpl is for random-access reading
+    of archives when the user specified the sorted (s) option but not the
+    called-sorted (cs) option. Since the keys are sorted, it only reads the
+    archive as far as the key asked for, and knows a key is not there without
+    reading to the end. The objects it read are kept, in sorted order, so keys
+    may be asked for in any order. With the once option, objects are deleted
+    once their Value() has been returned.
+    """
+    def __init__(self, holder_type):
+        super(RandomAccessTableReaderSortedArchiveImpl, self).__init__(holder_type)
+        self.keys = []
+        self.holders = []
+        self.last_key = None
+
+    def Close(self):
+        self.keys = []
+        self.holders = []
+        self.last_key = None
+        return self.CloseInternal()
+
+    def HasKey(self, key):
+        return self.FindKeyInternal(key) >= 0
+
+    def Value(self, key):
+        idx = self.FindKeyInternal(key)
+        if idx < 0:
+            LogError('No such key \"%s\" in archive \"%s\"'
+                     % (key, self.archive_rxfilename))
+        value = self.holders[idx].Value()
+        if self.opts.once:
+            del self.keys[idx]
+            del self.holders[idx]
+        return value
+
+    def FindKeyInternal(self, key):
+        """Read ahead until the archive is past the key, or at its end.
+
+        Returns:
+            The index of the key in self.keys, -1 if it is not there.
+        """
+        while (self.last_key is None or self.last_key < key) and \
+              self.state == RandomAccessTableReaderStateType.kNoObject:
+            self.ReadNextObject()
+            if self.state == RandomAccessTableReaderStateType.kHaveObject:
+                if self.last_key is not None and self.cur_key <= self.last_key:
+                    LogError('You provided the sorted (s) option but keys in '
+                             'archive \"%s\" are not sorted: \"%s\" follows '
+                             '\"%s\".' % (self.archive_rxfilename,
+                                          self.cur_key, self.last_key))
+                self.last_key = self.cur_key
+                self.keys.append(self.cur_key)
+                self.holders.append(self.holder)
+                self.holder = NewHolderByType(self.type)
+                self.state = RandomAccessTableReaderStateType.kNoObject
+        idx = bisect.bisect_left(self.keys, key)
+        if idx < len(self.keys) and self.keys[idx] == key:
+            return idx
+        return -1
+
+
+class RandomAccessTableReaderDSortedArchiveImpl(
+          RandomAccessTableReaderArchiveImplBase):
+    """RandomAccessTableReaderDSortedArchiveImpl is for random-access reading
+    of archives when the user specified the sorted (s) and called-sorted (cs)
+    options, i.e. the keys of the archive are sorted and HasKey() / Value()
+    are called with keys in sorted order. The archive is then read forward
+    only, keeping just the last object read, so memory does not grow with the
+    archive.
+    """
+    def __init__(self, holder_type):
+        super(RandomAccessTableReaderDSortedArchiveImpl, self).__init__(holder_type)
+        self.last_requested_key = None
+
+    def Close(self):
+        self.last_requested_key = None
+        return self.CloseInternal()
+
+    def HasKey(self, key):
+        return self.FindKeyInternal(key)
+
+    def Value(self, key):
+        if not self.FindKeyInternal(key):
+            LogError('No such key \"%s\" in archive \"%s\"'
+                     % (key, self.archive_rxfilename))
+        return self.holder.Value()
+
+    def FindKeyInternal(self, key):
+        if self.last_requested_key is not None and \
+           key < self.last_requested_key:
+            LogError('You provided the called-sorted (cs) option but called '
+                     'with key \"%s\" after \"%s\".'
+                     % (key, self.last_requested_key))
+        self.last_requested_key = key
+        while True:
+            if self.state == RandomAccessTableReaderStateType.kHaveObject:
+                if self.cur_key >= key:
+                    return self.cur_key == key
+                self.holder.Clear()
+                self.state = RandomAccessTableReaderStateType.kNoObject
+            elif self.state == RandomAccessTableReaderStateType.kNoObject:
+                last_key = self.cur_key
+                self.ReadNextObject()
+                if self.state == RandomAccessTableReaderStateType.kHaveObject and \
+                   last_key is not None and self.cur_key <= last_key:
+                    LogError('You provided the sorted (s) option but keys in '
+                             'archive \"%s\" are not sorted: \"%s\" follows '
+                             '\"%s\".' % (self.archive_rxfilename,
+                                          self.cur_key, last_key))
+            else:  # kEof or kError.
+                return False
+
+
+class RandomAccessTableReaderIndexedArchiveImpl(
+          RandomAccessTableReaderArchiveImplBase):
+    """RandomAccessTableReaderIndexedArchiveImpl is for random-access reading
+    of unsorted archives in regular files. Instead of keeping every object it
+    reads past in memory like RandomAccessTableReaderUnsortedArchiveImpl, it
+    keeps the offset of every key, and reads the objects on demand by seeking
+    to them, caching the last CACHE_SIZE objects it read. Like the unsorted
+    reader, it only reads as far into the archive as the keys asked for so
+    far. With the index option ("idx"), the offsets are stored in the index
+    file "<archive>.idx", which is built by one pass over the archive the
+    first time, and again whenever the archive has changed.
+    """
+    CACHE_SIZE = 64
+
+    def __init__(self, holder_type):
+        super(RandomAccessTableReaderIndexedArchiveImpl, self).__init__(holder_type)
+        self.index = {}
+        self.cache = collections.OrderedDict()
+        self.scan_offset = 0  # Offset of the first key not in the index yet.
+        self.scanned = False  # Whether the index covers the whole archive.
+
+    def Open(self, rspecifier):
+        super(RandomAccessTableReaderIndexedArchiveImpl, self).Open(rspecifier)
+        self.index = {}
+        self.scan_offset = 0
+        self.scanned = False
+        if self.opts.index:
+            index = self.ReadIndex()
+            if index is None:
+                self.Scan(None)
+                self.WriteIndex()
+            else:
+                self.index = index
+                self.scanned = True
+        return True
+
+    def Close(self):
+        self.index = {}
+        self.cache.clear()
+        return self.CloseInternal()
+
+    def HasKey(self, key):
+        if key not in self.index:
+            self.Scan(key)
+        return key in self.index
+
+    def Value(self, key):
+        if key not in self.index:
+            self.Scan(key)
+        if key in self.cache:
+            value = self.cache.pop(key)
+        else:
+            if key not in self.index:
+                LogError('No such key \"%s\" in archive \"%s\"'
+                         % (key, self.archive_rxfilename))
+            stream = self.input.Stream()
+            if not stream.Seek(self.index[key]):
+                LogError('Invalid offset = \"%d\"' % self.index[key])
+            binary = InitKaldiInputStream(stream)
+            if not self.holder.Read(stream, binary):
+                self.holder.Clear()
+                LogError('Failed to read object from archive \"%s\"'
+                         % self.archive_rxfilename)
+            value = self.holder.Value()
+            self.holder.Clear()
+        # The value won't be needed again with the once option.
+        if not self.opts.once:
+            self.CacheValue(key, value)
+        return value
+
+    def Rxfilename(self, key):
+        if not self.HasKey(key):
+            return None
+        return '%s:%d' % (self.archive_rxfilename, self.index[key])
+
+    def CacheValue(self, key, value):
+        self.cache[key] = value
+        if len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last = False)
+
+    def Scan(self, key):
+        """Add the offsets of the keys after the last one in the index, until
+        key is found or the end of the archive. The object of key is cached,
+        as it is most likely the next one asked for. If key is None, the
+        whole archive is read.
+        """
+        if self.scanned:
+            return
+        stream = self.input.Stream()
+        if not stream.Seek(self.scan_offset):
+            LogError('Failed to seek in archive \"%s\"'
+                     % self.archive_rxfilename)
+        while not stream.Eof():
+            cur_key = ReadToken(stream, self.input.IsBinary(), False)
+            c = stream.Peek(1)
+            if c != ' ' and c != '\t' and c != '\n':
+                LogError('Invalid archive file format: expected space after key '
+                         '\"%s\", got character \"%s\" when reading archive \"%s\".'
+                         % (cur_key, c, self.archive_rxfilename))
+            if c != '\n':  # Consume the space or tab.
+                stream.Read(1)
+            if cur_key in self.index:
+                LogError('Duplicate key \"%s\" in archive \"%s\"'
+                         % (cur_key, self.archive_rxfilename))
+            self.index[cur_key] = stream.Tell()
+            binary = InitKaldiInputStream(stream)
+            if not self.holder.Read(stream, binary):
+                self.holder.Clear()
+                LogError('Failed to read object from archive \"%s\"'
+                         % self.archive_rxfilename)
+            self.scan_offset = stream.Tell()
+            if cur_key == key:
+                self.CacheValue(key, self.holder.Value())
+                self.holder.Clear()
+                return
+            self.holder.Clear()
+        self.scanned = True
+
+    def IndexFilename(self):
+        return self.archive_rxfilename + '.idx'
+
+    def IndexHeader(self):
+        # The index is stale if the size or the mtime of the archive changed.
+        st = os.stat(self.archive_rxfilename)
+        return '%d %r' % (st.st_size, st.st_mtime)
+
+    def ReadIndex(self):
+        """Read the index file.
+
+        Returns:
+            A dict from keys to offsets, None if the index file does not
+            exist or is stale.
+        """
+        filename = self.IndexFilename()
+        if not os.path.exists(filename):
+            return None
+        index = {}
+        with open(filename, 'r') as f:
+            if f.readline().rstrip('\n') != self.IndexHeader():
+                return None
+            for line in f:
+                token = line.split()
+                if len(token) != 2:
+                    LogError('Invalid line \"%s\" in index file \"%s\"'
+                             % (line, filename))
+                index[token[0]] = int(token[1])
+        return index
+
+    def WriteIndex(self):
+        # Write to a temporary file first, in case other processes are reading
+        # or writing the same index file.
+        filename = self.IndexFilename()
+        tmp_filename = '%s.%d' % (filename, os.getpid())
+        try:
+            with open(tmp_filename, 'w') as f:
+                f.write(self.IndexHeader() + '\n')
+                for key, offset in self.index.iteritems():
+                    f.write('%s %d\n' % (key, offset))
+            os.rename(tmp_filename, filename)
+        except EnvironmentError as e:
+            LogWarning('Failed to write index file \"%s\", %s' % (filename, e))
+
+
 class RandomAccessTableReaderScriptImpl(object):
     """RandomAccessTableReaderScriptImpl is for random-access reading of
     archives when a script file is specified. For simplicity we just read it in
@@ -801,6 +1311,11 @@ class RandomAccessTableReaderScriptImpl(object):
                             return False
             return True
 
+    def Rxfilename(self, key):
+        if not self.LookupKey(key):
+            return None
+        return self.script[self.last_found][1]
+
     def LookupKey(self, key):
         for i in xrange(2):
             if self.last_found < len(self.script) and \
@@ -836,6 +1351,9 @@ class RandomAccessTableReader(object):
                 else:  # ark,s case
                     self.impl = \
                         RandomAccessTableReaderSortedArchiveImpl(holder_type)
+            elif ClassifyRxfilename(rxfilename) == InputType.kFileInput:
+                self.impl = \
+                    RandomAccessTableReaderIndexedArchiveImpl(holder_type)
             else:
                 self.impl = \
                     RandomAccessTableReaderUnsortedArchiveImpl(holder_type)
@@ -869,6 +1387,16 @@ class RandomAccessTableReader(object):
         self.CheckImpl()
         return self.impl.Value(key)
 
+    def Rxfilename(self, key):
+        """Returns the rxfilename of the object of key, e.g. "labels.ark:123",
+        for ReadKaldiObject() to read it without this reader. None if key is
+        not there, or the archive is not a regular file, or is sorted.
+        """
+        self.CheckImpl()
+        if not IsToken(key):
+            LogError('Invalid key \"%s\"' % key)
+        return self.impl.Rxfilename(key)
+
     def CheckImpl(self):
         if not self.impl:
             LogError('Trying to use empty RandomAccessTableReader (perhaps '
@@ -931,7 +1459,8 @@ class TableWriterArchiveImpl(object):
         self.output = Output()
         success = self.output.Open(self.archive_wxfilename,
                                    self.opts.binary,
-                                   False)
+                                   False,
+                                   self.opts.background)
         if not success:
             self.state = TableWriterStateType.kUninitialized
             LogError('Failed to open stream \"%s\"' % self.archive_wxfilename)
@@ -1004,9 +1533,107 @@ class TableWriterScriptImpl(object):
     pass
 
 
-class TableWriterBothImpl(object):
-    # TODO(cfyeh): implement this.
-    pass
+class TableWriterBothImpl(TableWriterArchiveImpl):
+    """The implementation of TableWriter we use when writing to an archive and
+    an associated scp, e.g. ark,scp:feats.ark,feats.scp. Each scp line points
+    to its object by the byte offset in the archive, e.g. "utt1 feats.ark:5",
+    so the archive must be a regular file.
+    """
+    def __init__(self, holder_type):
+        super(TableWriterBothImpl, self).__init__(holder_type)
+        self.script_wxfilename = None
+        self.script_output = Output()
+
+    def Open(self, wspecifier):
+        """Open a writer for the given wspecifier.
+
+        Args:
+            wspecifier: The given wspecifier.
+
+        Returns:
+            A boolean variable indicating if the operation is successful.
+        """
+        if self.state == TableWriterStateType.kUninitialized:
+            pass
+        elif self.state == TableWriterStateType.kWriteError:
+            LogError('Already open with write error.')
+        elif self.state == TableWriterStateType.kOpen:
+            if not self.Close():
+                LogError('Failed closing previously open stream.')
+        else:
+            LogError('Invalid state \"%s\"' % self.state)
+        self.wspecifier = wspecifier
+        (wspecifier_type, archive_filename, script_filename, opts) = \
+            ClassifyWspecifier(wspecifier)
+        self.archive_wxfilename = archive_filename
+        self.script_wxfilename = script_filename
+        self.opts = opts
+        if wspecifier_type != WspecifierType.kBothWspecifier:
+            LogError('Invalid wspecifier type \"%s\"' % wspecifier_type)
+        if ClassifyWxfilename(self.archive_wxfilename) != \
+           OutputType.kFileOutput:
+            LogError('Archive \"%s\" is not a regular file, offsets in the '
+                     'scp would be meaningless.' % self.archive_wxfilename)
+        self.output = Output()
+        if not self.output.Open(self.archive_wxfilename,
+                                self.opts.binary,
+                                False,
+                                self.opts.background):
+            self.state = TableWriterStateType.kUninitialized
+            LogError('Failed to open stream \"%s\"' % self.archive_wxfilename)
+        self.script_output = Output()
+        if not self.script_output.Open(self.script_wxfilename, False, False):
+            self.output.Close()
+            self.state = TableWriterStateType.kUninitialized
+            LogError('Failed to open stream \"%s\"' % self.script_wxfilename)
+        self.state = TableWriterStateType.kOpen
+        return True
+
+    def Write(self, key, value):
+        if self.state == TableWriterStateType.kOpen:
+            pass
+        elif self.state == TableWriterStateType.kWriteError:
+            LogWarning('Attempting to write to invalid stream.')
+        else:
+            LogError('Invalid state \"%s\"' % self.state)
+        # state is now kOpen or kWriteError.
+        if not IsToken(key):  # e.g. empty string or has spaces...
+            LogError('Using invalid key \"%s\"' % key)
+        self.output.Stream().Write('%s ' % key)
+        offset = self.output.Stream().Tell()
+        if not WriteHolderValueToStream(self.output.Stream(), self.type,
+                                        self.opts.binary, value):
+            LogWarning('Write failure to \"%s\"' % self.archive_wxfilename)
+            self.state = TableWriterStateType.kWriteError
+            return False
+        self.script_output.Stream().Write('%s %s:%d\n'
+                                          % (key, self.archive_wxfilename,
+                                             offset))
+        if self.state == TableWriterStateType.kWriteError:
+            return False
+        if self.opts.flush:
+            self.Flush()
+        return True
+
+    def Flush(self):
+        if self.state == TableWriterStateType.kOpen or \
+           self.state == TableWriterStateType.kWriteError:
+            self.output.Stream().Flush()
+            self.script_output.Stream().Flush()
+        else:
+            LogWarning('Called on not-open writer.')
+
+    def Close(self):
+        if not self.IsOpen() or not self.script_output.IsOpen():
+            LogError('Called on a stream that was not open. %s, %s'
+                     % (self.IsOpen(), self.script_output.IsOpen()))
+        if not self.script_output.Close():
+            LogWarning('Error closing script stream: wspecifier is \"%s\"'
+                       % self.wspecifier)
+            self.output.Close()
+            self.state = TableWriterStateType.kUninitialized
+            return False
+        return super(TableWriterBothImpl, self).Close()
 
 
 class TableWriter(object):
@@ -1079,6 +1706,15 @@ class SequentialBaseFloatVectorReader(SequentialTableReader):
               self).__init__(rspecifier, HolderType.kFloatVectorHolder)
 
 
+class SequentialInt32VectorReader(SequentialTableReader):
+    """A wrapper for SequentialTableReader(HolderType.kInt32VectorHolder).
+    To make the I/O code more consistent with Kaldi code.
+    """
+    def __init__(self, rspecifier):
+        super(SequentialInt32VectorReader,
+              self).__init__(rspecifier, HolderType.kInt32VectorHolder)
+
+
 class SequentialNnetExampleReader(SequentialTableReader):
     """A wrapper for SequentialTableReader(HolderType.kNnetExampleHolder).
     To make the I/O code more consistent with Kaldi code.
@@ -1106,6 +1742,15 @@ class RandomAccessPosteriorReader(RandomAccessTableReader):
               self).__init__(rspecifier, HolderType.kPosteriorHolder)
 
 
+class RandomAccessPosteriorArrayReader(RandomAccessTableReader):
+    """A wrapper for RandomAccessTableReader(HolderType.kPosteriorArrayHolder)
+    To make the I/O code more consistent with Kaldi code.
+    """
+    def __init__(self, rspecifier):
+        super(RandomAccessPosteriorArrayReader,
+              self).__init__(rspecifier, HolderType.kPosteriorArrayHolder)
+
+
 class RandomAccessInt32VectorReader(RandomAccessTableReader):
     """A wrapper for RandomAccessTableReader(HolderType.kInt32VectorHolder)
     To make the I/O code more consistent with Kaldi code.
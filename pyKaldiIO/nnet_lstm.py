@@ -0,0 +1,248 @@
+# Copyright 2018 Mobvoi Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# THIS CODE IS PROVIDED *AS IS* BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, EITHER EXPRESS OR IMPLIED, INCLUDING WITHOUT LIMITATION ANY IMPLIED
+# WARRANTIES OR CONDITIONS OF TITLE, FITNESS FOR A PARTICULAR PURPOSE,
+# MERCHANTABLITY OR NON-INFRINGEMENT.
+
+#!/usr/bin/python2
+
+
+import numpy
+from io_funcs import LogError
+
+
+# Epsilon of tf.layers.batch_normalization().
+BN_EPSILON = 1e-3
+
+
+def Sigmoid(x):
+    # Same as 1 / (1 + exp(-x)), without overflow in exp().
+    return 0.5 * (numpy.tanh(0.5 * x) + 1.0)
+
+
+def IsQuantizable(key):
+    # The matrices of the matrix multiplications: LSTMCell kernels,
+    # projections and the output layer.
+    return key.endswith('kernel') or key in ('W', 'W_prior')
+
+
+def Quantize(matrix):
+    """Quantize matrix to int8 with one scale per column, i.e. per output
+    channel, such that matrix ~= Dequantize(*Quantize(matrix)).
+    """
+    scale = numpy.abs(matrix).max(axis=0) / 127.0
+    scale[scale == 0.0] = 1.0
+    quantized = numpy.round(matrix / scale).astype(numpy.int8)
+    return quantized, scale.astype(numpy.float32)
+
+
+def Dequantize(quantized, scale):
+    return quantized.astype(numpy.float32) * scale
+
+
+def Splice(feats, left_context, right_context):
+    """Splice frames with their context, padding with copies of the first
+    and last frames like splice_features() in nnet/tfrecord.py.
+    """
+    num_rows = feats.shape[0]
+    padded = numpy.concatenate([ feats[:1] ] * left_context +
+                               [ feats ] +
+                               [ feats[-1:] ] * right_context)
+    return numpy.concatenate([ padded[i:i + num_rows]
+                               for i in xrange(left_context + right_context + 1) ],
+                             axis=1)
+
+
+def Subsample(feats, factor):
+    return feats[0:(feats.shape[0] // factor) * factor:factor]
+
+
+class LstmLayer(object):
+    """One tf.contrib.rnn.LSTMCell, run over a whole sequence.
+
+    The input-to-gate products of all the frames are computed with a single
+    matrix multiplication, only the recurrent part is computed per frame.
+    Gates are in the order of LSTMCell, i.e. i, j, f, o.
+    """
+    def __init__(self, params, prefix, forget_bias):
+        self.kernel = params[prefix + '/kernel']
+        self.bias = params[prefix + '/bias']
+        self.forget_bias = numpy.float32(forget_bias)
+        self.num_units = self.bias.shape[0] // 4
+        self.use_peepholes = (prefix + '/w_f_diag') in params
+        if self.use_peepholes:
+            self.w_f_diag = params[prefix + '/w_f_diag']
+            self.w_i_diag = params[prefix + '/w_i_diag']
+            self.w_o_diag = params[prefix + '/w_o_diag']
+        self.projection = params.get(prefix + '/projection/kernel')
+        self.output_dim = self.num_units if self.projection is None \
+                          else self.projection.shape[1]
+        self.input_dim = self.kernel.shape[0] - self.output_dim
+
+    def Forward(self, inputs):
+        if inputs.shape[1] != self.input_dim:
+            LogError('Input dim mismatch, expected %d, got %d.'
+                     % (self.input_dim, inputs.shape[1]))
+        n = self.num_units
+        gates = numpy.dot(inputs, self.kernel[:self.input_dim]) + self.bias
+        recurrent_kernel = self.kernel[self.input_dim:]
+
+        c = numpy.zeros([n], dtype=numpy.float32)
+        m = numpy.zeros([self.output_dim], dtype=numpy.float32)
+        outputs = numpy.empty([inputs.shape[0], self.output_dim],
+                              dtype=numpy.float32)
+        for t in xrange(inputs.shape[0]):
+            g = gates[t] + numpy.dot(m, recurrent_kernel)
+            i, j, f, o = g[:n], g[n:2 * n], g[2 * n:3 * n], g[3 * n:]
+            if self.use_peepholes:
+                c = Sigmoid(f + self.forget_bias + self.w_f_diag * c) * c + \
+                    Sigmoid(i + self.w_i_diag * c) * numpy.tanh(j)
+                m = Sigmoid(o + self.w_o_diag * c) * numpy.tanh(c)
+            else:
+                c = Sigmoid(f + self.forget_bias) * c + \
+                    Sigmoid(i) * numpy.tanh(j)
+                m = Sigmoid(o) * numpy.tanh(c)
+            if self.projection is not None:
+                m = numpy.dot(m, self.projection)
+            outputs[t] = m
+        return outputs
+
+
+class Nnet(object):
+    """NumPy inference of the models of nnet/lstm.py and nnet/bilstm.py.
+
+    The weights and the model config are read from the .npz written by
+    bin/nnet-export-numpy.py, so neither reading the model nor running it
+    needs TensorFlow. Compute() takes the features of one utterance, without
+    context, and returns the logits, or the softmax output.
+    """
+    # Keys of the model config stored in the .npz, each under 'config/<key>'.
+    CONFIG_KEYS = [ 'nnet_type', 'input_dim', 'num_layers', 'num_neurons',
+                    'num_projects', 'num_targets', 'num_experts', 'moe_temp',
+                    'left_context', 'right_context', 'subsample', 'use_bn' ]
+
+    def __init__(self, filename = None):
+        self.params = dict()
+        self.config = dict()
+        self.class_prior = None
+        if filename is not None:
+            self.Read(filename)
+
+    def Read(self, filename):
+        npz = numpy.load(filename)
+        for key in npz.files:
+            if key.startswith('config/'):
+                value = npz[key].item()
+                self.config[key[len('config/'):]] = \
+                    None if value == '' else value
+            elif key == 'class_prior':
+                self.class_prior = npz[key]
+            elif key.endswith('/scale'):
+                continue
+            elif npz[key].dtype == numpy.int8:
+                # Written by bin/nnet-quantize.py. int8 is only the storage
+                # format: numpy has no BLAS-backed int8 matrix multiplication,
+                # so the weights are dequantized once here and computed with
+                # the float32 numpy.dot(), like a float model.
+                self.params[key] = Dequantize(npz[key], npz[key + '/scale'])
+            else:
+                self.params[key] = npz[key].astype(numpy.float32)
+
+        nnet_type = self.config.get('nnet_type')
+        if nnet_type not in ('lstm', 'blstm'):
+            LogError('Unsupported nnet_type %s.' % nnet_type)
+        num_layers = self.config['num_layers']
+        if nnet_type == 'lstm':
+            self.layers = [ LstmLayer(self.params, 'drnn%d' % i, 1.0)
+                            for i in xrange(num_layers) ]
+        else:
+            self.layers = [ (LstmLayer(self.params, 'fd%d' % i, 5.0),
+                             LstmLayer(self.params, 'bd%d' % i, 5.0))
+                            for i in xrange(num_layers) ]
+
+    def InputDim(self):
+        return self.config['input_dim']
+
+    def OutputDim(self):
+        return self.config['num_targets']
+
+    def BatchNorm(self, x, name):
+        # The moving statistics are not saved with the model, so they are
+        # at their initial values, mean 0 and variance 1, as in TensorFlow.
+        gamma = self.params[name + '/gamma']
+        beta = self.params[name + '/beta']
+        return x * (gamma / numpy.sqrt(1.0 + BN_EPSILON)) + beta
+
+    def ForwardLstm(self, x):
+        num_projects = self.config.get('num_projects')
+        use_bn = self.config.get('use_bn')
+        for i, layer in enumerate(self.layers):
+            if i == 0 and use_bn:
+                x = self.BatchNorm(x, 'drnn_bn_0_%d' % i)
+            # Same rule as create_lstm_cells() for the ResidualWrapper.
+            if i == 0 and x.shape[1] != num_projects:
+                x = layer.Forward(x)
+            else:
+                x = layer.Forward(x) + x
+            if use_bn:
+                x = self.BatchNorm(x, 'drnn_bn%d' % i)
+        return x
+
+    def ForwardBlstm(self, x):
+        num_projects = self.config.get('num_projects')
+        input_dim = x.shape[1]
+        for i, (forward, backward) in enumerate(self.layers):
+            output = numpy.concatenate([ forward.Forward(x),
+                                         backward.Forward(x[::-1])[::-1] ],
+                                       axis=1)
+            if i == 0 and num_projects is not None and \
+               input_dim == 2 * num_projects:
+                x = x + output
+            else:
+                x = output
+        return x
+
+    def ForwardOutput(self, x):
+        num_experts = self.config.get('num_experts')
+        if num_experts:
+            num_targets = self.config['num_targets']
+            moe_temp = self.config.get('moe_temp')
+            if moe_temp is None:
+                moe_temp = 10.0
+            y_prior = numpy.dot(x, self.params['W_prior']) + \
+                      self.params['b_prior']
+            y_prior = numpy.exp(y_prior - y_prior.max(axis=1, keepdims=True))
+            y_prior /= y_prior.sum(axis=1, keepdims=True)
+            y_decoder = moe_temp * numpy.tanh(numpy.dot(x, self.params['W']) +
+                                              self.params['b'])
+            y_decoder = y_decoder.reshape([-1, num_experts, num_targets])
+            return numpy.einsum('ne,nek->nk', y_prior, y_decoder)
+        return numpy.dot(x, self.params['W']) + self.params['b']
+
+    def Compute(self, feats, apply_softmax = False, smooth_factor = 1.0):
+        feats = numpy.asarray(feats, dtype=numpy.float32)
+        left_context = self.config.get('left_context') or 0
+        right_context = self.config.get('right_context') or 0
+        subsample = self.config.get('subsample') or 0
+        if left_context or right_context:
+            feats = Splice(feats, left_context, right_context)
+        if subsample:
+            feats = Subsample(feats, subsample)
+
+        if self.config['nnet_type'] == 'lstm':
+            x = self.ForwardLstm(feats)
+        else:
+            x = self.ForwardBlstm(feats)
+        logits = self.ForwardOutput(x).astype(numpy.float32)
+        if not apply_softmax:
+            return logits
+        y = smooth_factor * logits
+        y = numpy.exp(y - y.max(axis=1, keepdims=True))
+        return y / y.sum(axis=1, keepdims=True)
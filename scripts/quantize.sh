@@ -0,0 +1,123 @@
+#!/bin/bash
+
+. path.sh
+
+################################################################################
+# Set up variables.
+################################################################################
+
+feats=  # rspecifier of the features, without context.
+text=  # reference transcriptions.
+graphdir=  # TLG.fst and words.txt, as for scripts/decode_fst.sh.
+nnet_config=
+nnet=  # Optional, if blank then use the final.nnet in upper-level folder.
+dir=
+
+check_frames=100  # frames of random input to compare numpy with tensorflow.
+apply_class_prior=false
+to_character=false
+to_lower=false
+
+acwt=0.9
+min_active=200
+max_active=7000 # max-active
+beam=15.0       # beam used
+lattice_beam=8.0
+max_mem=50000000 # approx. limit to memory consumption during minimization in bytes
+
+echo
+echo "$0 $@"  # Print the command line for logging
+echo
+
+. parse_options.sh || exit 1
+
+[ -z "$feats" ] && echo -e "(ERROR) missing --feats\n" && exit 1
+[ -z "$text" ] && echo -e "(ERROR) missing --text\n" && exit 1
+[ -z "$graphdir" ] && echo -e "(ERROR) missing --graphdir\n" && exit 1
+[ -z "$nnet_config" ] && echo -e "(ERROR) missing --nnet-config\n" && exit 1
+[ -z "$dir" ] && echo -e "(ERROR) missing --dir\n" && exit 1
+
+[ ! -e "$text" ] && echo -e "(ERROR) $text does not exist\n" && exit 1
+[ ! -e "$graphdir/TLG.fst" ] && echo -e "(ERROR) $graphdir/TLG.fst does not exist\n" && exit 1
+[ ! -e "$graphdir/words.txt" ] && echo -e "(ERROR) $graphdir/words.txt does not exist\n" && exit 1
+[ ! -e "$nnet_config" ] && echo -e "(ERROR) $nnet_config does not exist\n" && exit 1
+
+if [ -z "$nnet" ]; then
+  srcdir=$(dirname $dir)
+  nnet=$srcdir/$(cat $srcdir/final.nnet)
+fi
+
+################################################################################
+# Export the model to numpy and quantize it to int8.
+################################################################################
+
+mkdir -p $dir
+if [ ! -e $dir/export.done ]; then
+  echo "[$(date +'%Y/%m/%d %H:%M:%S')] exporting $nnet"
+  python bin/nnet-export-numpy.py \
+    --check-frames=$check_frames \
+    $nnet_config $nnet $dir/float.npz \
+    2> $dir/export.log || exit 1
+  python bin/nnet-quantize.py \
+    $dir/float.npz $dir/int8.npz \
+    2> $dir/quantize.log || exit 1
+  touch $dir/export.done
+else
+  echo "[$(date +'%Y/%m/%d %H:%M:%S')] $dir/export.done exists, skipping"
+fi
+
+################################################################################
+# Compare the WERs of the float and int8 models, decoded with TLG.fst like
+# scripts/decode_fst.sh, and the speed of the nnet.
+################################################################################
+
+for model in float int8; do
+  if [ ! -e $dir/$model.forward.done ]; then
+    echo "[$(date +'%Y/%m/%d %H:%M:%S')] computing the $model nnet output"
+    ( python bin/nnet-forward-numpy.py \
+        --apply-class-prior=$apply_class_prior \
+        "$feats" $dir/$model.npz ark:- |\
+      copy-feats ark:- ark,scp:$dir/$model.post.ark,$dir/$model.post.scp ) \
+      2> $dir/$model.forward.log || exit 1
+    touch $dir/$model.forward.done
+  else
+    echo "[$(date +'%Y/%m/%d %H:%M:%S')] $dir/$model.forward.done exists, skipping"
+  fi
+
+  if [ ! -e $dir/$model.done ]; then
+    echo "[$(date +'%Y/%m/%d %H:%M:%S')] decoding with the $model model"
+    num_targets=$(feat-to-dim scp:$dir/$model.post.scp - 2> /dev/null)
+    ( copy-feats scp:$dir/$model.post.scp ark:- |\
+      select-feats $[$num_targets-1],0-$[$num_targets-2] ark:- ark:- |\
+      latgen-faster \
+        --min-active=$min_active \
+        --max-active=$max_active \
+        --max-mem=$max_mem \
+        --beam=$beam \
+        --lattice-beam=$lattice_beam \
+        --acoustic-scale=$acwt \
+        --allow-partial=true \
+        --word-symbol-table=$graphdir/words.txt \
+        $graphdir/TLG.fst ark:- ark:- |\
+      lattice-best-path \
+        --acoustic-scale=$acwt \
+        --word-symbol-table=$graphdir/words.txt \
+        ark:- ark,t:- |\
+      utils/int2sym.pl -f 2- $graphdir/words.txt |\
+      python bin/compute-wer.py \
+        --to-character=$to_character --to-lower=$to_lower \
+        $text > $dir/$model.wer ) \
+      2> $dir/$model.log || exit 1
+    touch $dir/$model.done
+  else
+    echo "[$(date +'%Y/%m/%d %H:%M:%S')] $dir/$model.done exists, skipping"
+  fi
+done
+
+echo
+for model in float int8; do
+  echo "$model: $(du -h $dir/$model.npz | cut -f1)" \
+       "$(grep -o '[0-9.]* frames/s' $dir/$model.forward.log)" \
+       "$(grep '^summary' $dir/$model.wer)"
+done | tee $dir/report
+echo
@@ -12,7 +12,13 @@ cmvn_ark=
 dir=
 
 check_length=false
+shard_size=0  # target shard size in MB, 0 for one tfrecords file per utterance.
+record_format=2  # 1 for per-frame SequenceExample, 2 for raw float32 bytes.
+left_context=0  # splice at conversion time, must match the nnet config.
+right_context=0
+subsample=0
 nj=8
+num_workers=0  # serializing processes per job, 0 to convert in the main process.
 cmd=run.pl
 
 echo
@@ -64,6 +70,12 @@ echo "converting TFRecords"
 $cmd JOB=1:$nj $dir/log/tfrecords.JOB.log \
   python bin/convert-to-tfrecords.py \
     --check-length=$check_length \
+    --shard-size=$shard_size \
+    --record-format=$record_format \
+    --num-workers=$num_workers \
+    --left-context=$left_context \
+    --right-context=$right_context \
+    --subsample=$subsample \
     ${nnet_target:+ --nnet-target="$nnet_target"} \
     "$nnet_input" $subdir $subdir/tfrecords.scp || exit 1
 
@@ -8,6 +8,12 @@
 
 tr_tfrecords_scp=
 cv_tfrecords_scp=
+# With the labels rspecifiers, e.g. ark:exp/tr_labels.ark, the
+# *_tfrecords_scp are features rspecifiers, e.g. scp:data/train/feats.scp,
+# read directly without converting them to tfrecords.
+tr_nnet_target=
+cv_nnet_target=
+target_length_cutoff=1
 nnet_config=
 srcdir= # optional
 dir=
@@ -30,7 +36,8 @@ shuffle=false
 seed=777
 
 batch_size=256
-max_batch_size=512
+max_batch_size=512  # cap on the batch size with max_frames_per_batch.
+max_frames_per_batch=0  # padded frames per batch, 0 for batch_size utterances.
 batch_threads=8
 report_interval=100
 cv_goal=eval
@@ -53,10 +60,19 @@ echo
 
 [ ! -z "$srcdir" ] && [ -z "$nnet_config" ] && nnet_config="$srcdir/nnet.config"
 
-[ ! -e "$tr_tfrecords_scp" ] && echo -e "(ERROR) $tr_tfrecords_scp does not exist\n" && exit 1
-[ ! -e "$cv_tfrecords_scp" ] && echo -e "(ERROR) $cv_tfrecords_scp does not exist\n" && exit 1
+[ -z "$tr_nnet_target" ] && [ ! -e "$tr_tfrecords_scp" ] && echo -e "(ERROR) $tr_tfrecords_scp does not exist\n" && exit 1
+[ -z "$cv_nnet_target" ] && [ ! -e "$cv_tfrecords_scp" ] && echo -e "(ERROR) $cv_tfrecords_scp does not exist\n" && exit 1
 [ ! -e "$nnet_config" ] && echo -e "(ERROR) $nnet_config does not exist\n" && exit 1
 
+tr_data_opts=()
+[ ! -z "$tr_nnet_target" ] && \
+  tr_data_opts=(--nnet-target="$tr_nnet_target" \
+                --target-length-cutoff=$target_length_cutoff)
+cv_data_opts=()
+[ ! -z "$cv_nnet_target" ] && \
+  cv_data_opts=(--nnet-target="$cv_nnet_target" \
+                --target-length-cutoff=$target_length_cutoff)
+
 mkdir -p $dir
 
 ([ ! -z "$srcdir" ] || \
@@ -78,8 +94,11 @@ if [ ! -z "$srcdir" ]; then
       --evaluate=true \
       --batch-size $batch_size \
       --batch-threads $batch_threads \
+      --max-frames-per-batch $max_frames_per_batch \
+      --max-batch-size $max_batch_size \
       --report-interval=$report_interval \
-      $cv_tfrecords_scp $nnet_config $nnet_best \
+      "${cv_data_opts[@]}" \
+      "$cv_tfrecords_scp" $nnet_config $nnet_best \
       2> $dir/nnet.${iter}.cv.log || exit 1
     cv_loss=$(grep "^INFO:tensorflow:cv_loss" $dir/nnet.${iter}.cv.log | awk '{print $NF}')
     cv_eval=$(grep "^INFO:tensorflow:cv_eval" $dir/nnet.${iter}.cv.log | awk '{print $NF}')
@@ -94,7 +113,8 @@ else
       --batch-size=$batch_size \
       --batch-threads=$batch_threads \
       --report-interval=$report_interval \
-      $cv_tfrecords_scp $nnet_config $nnet_best \
+      "${cv_data_opts[@]}" \
+      "$cv_tfrecords_scp" $nnet_config $nnet_best \
       2> $dir/nnet.${iter}.cv.log || exit 1
     cv_loss=$(grep "^INFO:tensorflow:cv_loss" $dir/nnet.${iter}.cv.log | awk '{print $NF}')
     cv_eval=$(grep "^INFO:tensorflow:cv_eval" $dir/nnet.${iter}.cv.log | awk '{print $NF}')
@@ -139,8 +159,11 @@ for iter in $(seq $max_iter); do
       --shuffle=$shuffle \
       --batch-size $batch_size \
       --batch-threads $batch_threads \
+      --max-frames-per-batch $max_frames_per_batch \
+      --max-batch-size $max_batch_size \
       --report-interval=$report_interval \
-      $tr_tfrecords_scp $nnet_config $nnet_in $nnet_out \
+      "${tr_data_opts[@]}" \
+      "$tr_tfrecords_scp" $nnet_config $nnet_in $nnet_out \
       2> $dir/nnet.${iter}.tr.log || exit 1
     tr_loss=$(grep "^INFO:tensorflow:tr_loss" $dir/nnet.${iter}.tr.log | awk '{print $NF}')
     [ "$tr_loss" == "nan" ] && echo "(ERROR) tr_loss = $tr_loss" && exit 1
@@ -150,8 +173,11 @@ for iter in $(seq $max_iter); do
       --evaluate=true \
       --batch-size $batch_size \
       --batch-threads $batch_threads \
+      --max-frames-per-batch $max_frames_per_batch \
+      --max-batch-size $max_batch_size \
       --report-interval=$report_interval \
-      $cv_tfrecords_scp $nnet_config $nnet_out \
+      "${cv_data_opts[@]}" \
+      "$cv_tfrecords_scp" $nnet_config $nnet_out \
       2> $dir/nnet.${iter}.cv.log || exit 1
     cv_loss=$(grep "^INFO:tensorflow:cv_loss" $dir/nnet.${iter}.cv.log | awk '{print $NF}')
     cv_eval=$(grep "^INFO:tensorflow:cv_eval" $dir/nnet.${iter}.cv.log | awk '{print $NF}')